@@ -0,0 +1,57 @@
+# قياس إنتاجية التشفير التدفقي للمرفقات (crypto_stream) بالميغابايت في الثانية
+# لعدة أحجام أجزاء، مقارنة بـ Fernet على الملف كاملاً في الذاكرة (الطريقة الوحيدة سابقاً).
+#
+# التشغيل (من مجلد backend):
+#   PYTHONPATH=src python benchmarks/bench_crypto_stream.py --mb 256
+
+from __future__ import annotations
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from manus_pro_server import crypto, crypto_stream
+
+def mb_per_sec(size: int, seconds: float) -> float:
+    return size / (1024 * 1024) / seconds
+
+def timed(label: str, size: int, fn) -> None:
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<36} {mb_per_sec(size, elapsed):9.1f} MB/s   peak {peak / (1024 * 1024):8.1f} MB")
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=int, default=256)
+    parser.add_argument("--chunks", default="16,64,256,1024", help="أحجام الأجزاء بالكيلوبايت")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_crypto_") as tmp:
+        src = Path(tmp) / "plain.bin"
+        enc = Path(tmp) / "plain.bin.enc"
+        out = Path(tmp) / "plain.out"
+        with open(src, "wb") as f:
+            for _ in range(args.mb):
+                f.write(os.urandom(1024 * 1024))
+        size = src.stat().st_size
+        print(f"Input: {args.mb} MB")
+
+        for kb in (int(k) for k in args.chunks.split(",")):
+            chunk = kb * 1024
+            timed(f"stream encrypt  chunk={kb:>5} KB", size, lambda: crypto_stream.encrypt_file(str(src), str(enc), chunk))
+            timed(f"stream decrypt  chunk={kb:>5} KB", size, lambda: crypto_stream.decrypt_file(str(enc), str(out)))
+        assert out.read_bytes() == src.read_bytes()
+
+        fernet = crypto.get_key()
+        token = {}
+        timed("fernet encrypt (whole file)", size, lambda: token.setdefault("t", fernet.encrypt(src.read_bytes())))
+        timed("fernet decrypt (whole file)", size, lambda: fernet.decrypt(token["t"]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# قياس سرد المجلدات في LocalDeviceConnector على شجرة اصطناعية كبيرة:
+# المقارنة بين glob("**/*") مع عدة stat لكل عنصر، والمولّد المبني على os.scandir.
+#
+# التشغيل (من مجلد backend):
+#   PYTHONPATH=src python benchmarks/bench_local_device_scan.py --dirs 200 --files 500
+
+from __future__ import annotations
+import argparse
+import asyncio
+import shutil
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from manus_pro_server.connectors.local_device import LocalDeviceConnector, iter_directory
+
+def build_tree(root: Path, dirs: int, files: int) -> int:
+    for d in range(dirs):
+        sub = root / f"dir_{d:04d}" / "nested"
+        sub.mkdir(parents=True)
+        for f in range(files):
+            (sub / f"file_{f:05d}.txt").write_bytes(b"x")
+    return dirs * (files + 2)
+
+def legacy_scan(search_path: Path) -> int:
+    """السلوك السابق: glob متكرر و stat حتى ثلاث مرات لكل عنصر، وقائمة كاملة في الذاكرة."""
+    results = []
+    for p in search_path.glob("**/*"):
+        results.append({
+            "name": p.name,
+            "path": str(p),
+            "type": "file" if p.is_file() else "directory",
+            "size": p.stat().st_size if p.is_file() else 0,
+            "modified": p.stat().st_mtime,
+        })
+    return len(results)
+
+def measure(label: str, fn) -> None:
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    count = fn()
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<28} entries={count:>9,} time={elapsed:7.3f}s peak_mem={peak / 1e6:8.1f} MB")
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dirs", type=int, default=200)
+    parser.add_argument("--files", type=int, default=500)
+    parser.add_argument("--page", type=int, default=1000)
+    args = parser.parse_args()
+
+    root = Path(tempfile.mkdtemp(prefix="bench_scan_"))
+    try:
+        total = build_tree(root, args.dirs, args.files)
+        print(f"synthetic tree: {total:,} entries under {root}")
+        connector = LocalDeviceConnector("bench", "Bench", {"root_path": str(root)})
+
+        measure("legacy glob + stat", lambda: legacy_scan(root))
+        measure("scandir walker (stream)", lambda: sum(1 for _ in iter_directory(str(root))))
+        measure(f"first page (limit={args.page})", lambda: len(asyncio.run(
+            connector.fetch({"recursive": True, "limit": args.page}))))
+
+        def all_pages() -> int:
+            count, cursor = 0, None
+            while True:
+                page = asyncio.run(connector.fetch_page({"recursive": True, "limit": args.page, "cursor": cursor}))
+                count += len(page["items"])
+                cursor = page["next_cursor"]
+                if cursor is None:
+                    return count
+        measure(f"all pages (limit={args.page})", all_pages)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# قياس كلفة فحص حد المعدل لكل طلب (ميكروثانية) بالمخزن المحلي و Redis:
+# - hit مباشر على الاستراتيجية (Lua ذري واحد لكل فحص على Redis)
+# - rate_limit_key لرمز JWT (أول مرة تحقق من التوقيع، ثم من auth_cache)
+#
+# التشغيل (من مجلد backend):
+#   PYTHONPATH=src python benchmarks/bench_rate_limit.py --storage memory:// --storage redis://localhost:6379/2
+
+from __future__ import annotations
+import argparse
+import time
+
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import STRATEGIES
+from starlette.requests import Request
+
+from manus_pro_server.auth import create_access_token, rate_limit_key
+
+def per_call_us(fn, n: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t0) / n * 1e6
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--storage", action="append", default=None)
+    parser.add_argument("--strategy", default="sliding-window-counter")
+    parser.add_argument("-n", type=int, default=20000)
+    args = parser.parse_args()
+
+    limit = parse("1000000/minute")
+    for uri in args.storage or ["memory://"]:
+        try:
+            storage = storage_from_string(uri)
+            strategy = STRATEGIES[args.strategy](storage)
+            strategy.hit(limit, "bench", "warmup")
+        except Exception as e:
+            print(f"{uri:<32} unavailable: {e}")
+            continue
+        us = per_call_us(lambda: strategy.hit(limit, "bench", "user:1"), args.n)
+        print(f"{uri:<32} {args.strategy:<24} {us:8.1f} us/hit")
+
+    token = create_access_token({"sub": "user_1"})
+    scope = {"type": "http", "headers": [(b"authorization", f"Bearer {token}".encode())], "client": ("10.0.0.1", 1)}
+    request = Request(scope)
+    print(f"{'rate_limit_key (cached JWT)':<57} {per_call_us(lambda: rate_limit_key(request), args.n):8.1f} us/call")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# قياس إنتاجية محرك استقبال تيلجرام مقابل Bot API وهمي محلي.
+#
+# التشغيل (من مجلد backend):
+#   PYTHONPATH=src python benchmarks/bench_telegram_ingest.py --updates 20000 --batch 100
+
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from manus_pro_server.connectors.telegram import TelegramConnector
+from manus_pro_server.telegram_ingest import TelegramIngestor
+
+def make_fake_bot_api(total: int):
+    """خادم HTTP يحاكي getUpdates: يعيد التحديثات بدءاً من offset حتى total."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            offset = int(query.get("offset", ["0"])[0])
+            limit = int(query.get("limit", ["100"])[0])
+            result = [
+                {"update_id": u, "message": {"text": f"msg {u}", "chat": {"id": 1}, "from": {"username": "bench"}}}
+                for u in range(offset, min(offset + limit, total))
+            ]
+            body = json.dumps({"ok": True, "result": result}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+async def run(total: int, batch: int) -> None:
+    server = make_fake_bot_api(total)
+    token = "123:bench"
+    connector = TelegramConnector("bench", "Bench", {"token": token, "rate_limit": (1e6, 1e6)})
+    connector.base_url = f"http://127.0.0.1:{server.server_port}/bot{token}"
+
+    ingestor = TelegramIngestor("bench", connector, queue_size=batch * 10, handler=lambda update: None)
+    ingestor.commit_offset = lambda offset: None  # قياس المسار الشبكي والطابور فقط
+
+    stop = asyncio.Event()
+    consumer = asyncio.create_task(ingestor.run_consumer(stop))
+    t0 = time.perf_counter()
+    offset = 0
+    while offset < total:
+        offset = await ingestor.poll_once(offset, timeout=0, limit=batch)
+    await ingestor.queue.join()
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await consumer
+    server.shutdown()
+
+    print(f"updates={total} batch={batch} elapsed={elapsed:.3f}s "
+          f"throughput={total / elapsed:,.0f} updates/s requests={-(-total // batch)}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(run(args.updates, args.batch))
@@ -0,0 +1,75 @@
+# قياس فهرس البحث النصي في الـ Workspace على شجرة اصطناعية:
+# زمن الفهرسة الأولية، زمن المزامنة التدريجية بدون تغييرات، وزمن الاستعلامات
+# مقارنة بالبحث الخطي (قراءة كل الملفات كما يفعل العميل عبر read_file).
+#
+# التشغيل (من مجلد backend):
+#   PYTHONPATH=src python benchmarks/bench_workspace_search.py --files 20000 --kb 16
+
+from __future__ import annotations
+import argparse
+import random
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from manus_pro_server.workspace_search import WorkspaceSearchIndex
+
+WORDS = [f"term{i:05d}" for i in range(20000)] + ["deploy", "celery", "redis", "worker", "timeout", "مرحبا"]
+
+def build_tree(root: Path, files: int, kb: int, seed: int = 7) -> int:
+    rng = random.Random(seed)
+    total = 0
+    for i in range(files):
+        sub = root / f"dir_{i % 200:03d}"
+        sub.mkdir(exist_ok=True)
+        words = []
+        size = 0
+        while size < kb * 1024:
+            w = rng.choice(WORDS)
+            words.append(w)
+            size += len(w) + 1
+        data = " ".join(words).encode()
+        (sub / f"file_{i:06d}.txt").write_bytes(data)
+        total += len(data)
+    return total
+
+def linear_grep(root: Path, needle: str) -> int:
+    hits = 0
+    for p in root.rglob("*.txt"):
+        if needle in p.read_text(errors="replace"):
+            hits += 1
+    return hits
+
+def timed(label: str, fn):
+    t0 = time.perf_counter()
+    result = fn()
+    print(f"{label:<34} {(time.perf_counter() - t0) * 1000:10.1f} ms  -> {result}")
+    return result
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=20000)
+    parser.add_argument("--kb", type=int, default=16)
+    args = parser.parse_args()
+
+    tmp = Path(tempfile.mkdtemp(prefix="bench_search_"))
+    root = tmp / "ws"
+    root.mkdir()
+    try:
+        total = build_tree(root, args.files, args.kb)
+        print(f"synthetic workspace: {args.files:,} files, {total / 1e6:.0f} MB")
+        index = WorkspaceSearchIndex(tmp / "fts.sqlite3", root)
+
+        timed("initial index build", lambda: index.sync())
+        timed("incremental sync (no changes)", lambda: index.sync())
+        (root / "dir_000" / "file_000000.txt").write_text("fresh content mentions zebra")
+        timed("incremental sync (1 changed)", lambda: index.sync())
+        for q in ("term00042", "redis worker", "dep*", "zebra"):
+            timed(f"search '{q}' (top 20)", lambda q=q: len(index.search(q)["results"]))
+        timed("linear read+grep 'zebra'", lambda: linear_grep(root, "zebra"))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+# ═══════════════════════════════════════════════════════════════════════════════
+# الهجرة الثانية: مؤشرات المزامنة التزايدية للموصلات
+# ═══════════════════════════════════════════════════════════════════════════════
+
+"""Connector sync cursors
+
+Revision ID: 002
+Revises: 001
+Create Date: 2026-01-05 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '002'
+down_revision = '001'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    """إنشاء جدول connector_cursors"""
+    op.create_table(
+        'connector_cursors',
+        sa.Column('connector_id', sa.String(36), sa.ForeignKey('connectors.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('name', sa.String(100), primary_key=True),
+        sa.Column('cursor', sa.Text(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+    )
+
+def downgrade() -> None:
+    """حذف جدول connector_cursors"""
+    op.drop_table('connector_cursors')
@@ -0,0 +1,39 @@
+# ═══════════════════════════════════════════════════════════════════════════════
+# الهجرة الثالثة: جدول رموز OAuth مع فهرس وقت الانتهاء
+# ═══════════════════════════════════════════════════════════════════════════════
+
+"""OAuth tokens with expiry index
+
+Revision ID: 003
+Revises: 002
+Create Date: 2026-01-12 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '003'
+down_revision = '002'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    """إنشاء جدول oauth_tokens وفهرس expires_at لمجدول التحديث الاستباقي"""
+    op.create_table(
+        'oauth_tokens',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('connector_id', sa.String(36), sa.ForeignKey('connectors.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('access_token_encrypted', sa.LargeBinary(), nullable=False),
+        sa.Column('refresh_token_encrypted', sa.LargeBinary()),
+        sa.Column('expires_at', sa.DateTime()),
+        sa.Column('scopes', sa.Text()),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('idx_oauth_tokens_connector_id', 'oauth_tokens', ['connector_id'], unique=True)
+    op.create_index('idx_oauth_tokens_expires_at', 'oauth_tokens', ['expires_at'])
+
+def downgrade() -> None:
+    """حذف جدول oauth_tokens"""
+    op.drop_table('oauth_tokens')
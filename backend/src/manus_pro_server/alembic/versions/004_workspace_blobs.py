@@ -0,0 +1,34 @@
+# ═══════════════════════════════════════════════════════════════════════════════
+# الهجرة الرابعة: بصمات ملفات الـ Workspace المرفوعة
+# ═══════════════════════════════════════════════════════════════════════════════
+
+"""Workspace blob hashes
+
+Revision ID: 004
+Revises: 003
+Create Date: 2026-01-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '004'
+down_revision = '003'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    """إنشاء جدول workspace_blobs"""
+    op.create_table(
+        'workspace_blobs',
+        sa.Column('sha256', sa.String(64), primary_key=True),
+        sa.Column('path', sa.Text(), nullable=False),
+        sa.Column('size_bytes', sa.BigInteger(), nullable=False),
+        sa.Column('mtime_ns', sa.BigInteger(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+    )
+
+def downgrade() -> None:
+    """حذف جدول workspace_blobs"""
+    op.drop_table('workspace_blobs')
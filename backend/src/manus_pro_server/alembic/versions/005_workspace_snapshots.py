@@ -0,0 +1,39 @@
+# ═══════════════════════════════════════════════════════════════════════════════
+# الهجرة الخامسة: لقطات الـ Workspace لنقاط التفتيش
+# ═══════════════════════════════════════════════════════════════════════════════
+
+"""Workspace snapshots
+
+Revision ID: 005
+Revises: 004
+Create Date: 2026-01-26 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '005'
+down_revision = '004'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    """إنشاء جدول workspace_snapshots"""
+    op.create_table(
+        'workspace_snapshots',
+        sa.Column('id', sa.String(36), primary_key=True),
+        sa.Column('task_id', sa.String(36), sa.ForeignKey('tasks.id', ondelete='CASCADE')),
+        sa.Column('parent_id', sa.String(36)),
+        sa.Column('root', sa.Text(), nullable=False),
+        sa.Column('label', sa.String(255)),
+        sa.Column('file_count', sa.Integer(), nullable=False),
+        sa.Column('total_bytes', sa.BigInteger(), nullable=False),
+        sa.Column('new_bytes', sa.BigInteger(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('idx_workspace_snapshots_task_id', 'workspace_snapshots', ['task_id', 'created_at'])
+
+def downgrade() -> None:
+    """حذف جدول workspace_snapshots"""
+    op.drop_table('workspace_snapshots')
@@ -0,0 +1,33 @@
+# ═══════════════════════════════════════════════════════════════════════════════
+# الهجرة السادسة: عدّاد أجيال الإعدادات لإبطال الذاكرة المؤقتة
+# ═══════════════════════════════════════════════════════════════════════════════
+
+"""Settings generation counter
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-02-02 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '006'
+down_revision = '005'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    """إنشاء جدول settings_generation بصف واحد"""
+    table = op.create_table(
+        'settings_generation',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('generation', sa.Integer(), nullable=False),
+        sa.CheckConstraint('id = 1', name='ck_settings_generation_single_row'),
+    )
+    op.bulk_insert(table, [{'id': 1, 'generation': 0}])
+
+def downgrade() -> None:
+    """حذف جدول settings_generation"""
+    op.drop_table('settings_generation')
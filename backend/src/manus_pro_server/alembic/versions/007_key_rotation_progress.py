@@ -0,0 +1,36 @@
+# ═══════════════════════════════════════════════════════════════════════════════
+# الهجرة السابعة: نقاط تقدم إعادة التشفير بعد تدوير مفتاح Fernet
+# ═══════════════════════════════════════════════════════════════════════════════
+
+"""Key rotation progress
+
+Revision ID: 007
+Revises: 006
+Create Date: 2026-02-09 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '007'
+down_revision = '006'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    """إنشاء جدول key_rotation_progress"""
+    op.create_table(
+        'key_rotation_progress',
+        sa.Column('table_name', sa.String(100), primary_key=True),
+        sa.Column('key_id', sa.String(32), nullable=False),
+        sa.Column('last_key', sa.String(255), nullable=True),
+        sa.Column('scanned', sa.Integer(), nullable=False),
+        sa.Column('rotated', sa.Integer(), nullable=False),
+        sa.Column('completed', sa.Boolean(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+    )
+
+def downgrade() -> None:
+    """حذف جدول key_rotation_progress"""
+    op.drop_table('key_rotation_progress')
@@ -0,0 +1,40 @@
+# ═══════════════════════════════════════════════════════════════════════════════
+# الهجرة الثامنة: مفاتيح API مخزنة كبادئة + بصمة SHA-256 بفهرس فريد
+# ═══════════════════════════════════════════════════════════════════════════════
+
+"""API keys
+
+Revision ID: 008
+Revises: 007
+Create Date: 2026-02-16 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '008'
+down_revision = '007'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    """إنشاء جدول api_keys"""
+    op.create_table(
+        'api_keys',
+        sa.Column('id', sa.String(36), primary_key=True),
+        sa.Column('user_id', sa.String(36), sa.ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('name', sa.String(255)),
+        sa.Column('prefix', sa.String(16), nullable=False),
+        sa.Column('key_hash', sa.String(64), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('revoked_at', sa.DateTime()),
+    )
+    op.create_index('ix_api_keys_key_hash', 'api_keys', ['key_hash'], unique=True)
+    op.create_index('ix_api_keys_user_id', 'api_keys', ['user_id'])
+
+def downgrade() -> None:
+    """حذف جدول api_keys"""
+    op.drop_index('ix_api_keys_user_id', table_name='api_keys')
+    op.drop_index('ix_api_keys_key_hash', table_name='api_keys')
+    op.drop_table('api_keys')
@@ -0,0 +1,29 @@
+# ═══════════════════════════════════════════════════════════════════════════════
+# الهجرة التاسعة: دور المستخدم واستثناءات الصلاحيات لكل مستخدم
+# ═══════════════════════════════════════════════════════════════════════════════
+
+"""User role and permission overrides
+
+Revision ID: 009
+Revises: 008
+Create Date: 2026-02-23 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '009'
+down_revision = '008'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    """إضافة عمودي role و permission_overrides إلى users"""
+    op.add_column('users', sa.Column('role', sa.String(32), nullable=False, server_default='user'))
+    op.add_column('users', sa.Column('permission_overrides', sa.JSON(), nullable=True))
+
+def downgrade() -> None:
+    """حذف عمودي role و permission_overrides"""
+    op.drop_column('users', 'permission_overrides')
+    op.drop_column('users', 'role')
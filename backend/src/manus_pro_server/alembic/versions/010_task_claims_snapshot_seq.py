@@ -0,0 +1,35 @@
+# ═══════════════════════════════════════════════════════════════════════════════
+# الهجرة العاشرة: حجز المهام للعمال وتسلسل إدراج لقطات الـ Workspace
+# ═══════════════════════════════════════════════════════════════════════════════
+
+"""Task claims and workspace snapshot sequence
+
+Revision ID: 010
+Revises: 009
+Create Date: 2026-03-02 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '010'
+down_revision = '009'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    """إضافة claimed_by و claimed_until إلى tasks، و seq إلى workspace_snapshots"""
+    op.add_column('tasks', sa.Column('claimed_by', sa.String(255), nullable=True))
+    op.add_column('tasks', sa.Column('claimed_until', sa.DateTime(), nullable=True))
+    op.execute(sa.schema.CreateSequence(sa.Sequence('workspace_snapshots_seq')))
+    op.add_column('workspace_snapshots', sa.Column(
+        'seq', sa.BigInteger(), nullable=False, server_default=sa.text("nextval('workspace_snapshots_seq')"),
+    ))
+
+def downgrade() -> None:
+    """حذف أعمدة الحجز والتسلسل"""
+    op.drop_column('workspace_snapshots', 'seq')
+    op.execute(sa.schema.DropSequence(sa.Sequence('workspace_snapshots_seq')))
+    op.drop_column('tasks', 'claimed_until')
+    op.drop_column('tasks', 'claimed_by')
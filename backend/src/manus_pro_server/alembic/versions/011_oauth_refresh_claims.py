@@ -0,0 +1,29 @@
+# ═══════════════════════════════════════════════════════════════════════════════
+# الهجرة الحادية عشرة: حجز تحديث رموز OAuth بين العمليات
+# ═══════════════════════════════════════════════════════════════════════════════
+
+"""OAuth refresh claims
+
+Revision ID: 011
+Revises: 010
+Create Date: 2026-03-09 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '011'
+down_revision = '010'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    """إضافة refresh_claimed_by و refresh_claimed_until إلى oauth_tokens"""
+    op.add_column('oauth_tokens', sa.Column('refresh_claimed_by', sa.String(255), nullable=True))
+    op.add_column('oauth_tokens', sa.Column('refresh_claimed_until', sa.DateTime(), nullable=True))
+
+def downgrade() -> None:
+    """حذف أعمدة حجز التحديث"""
+    op.drop_column('oauth_tokens', 'refresh_claimed_until')
+    op.drop_column('oauth_tokens', 'refresh_claimed_by')
@@ -1,10 +1,11 @@
 from __future__ import annotations
+import asyncio
+import hmac
 import uuid
 import time
 import os
-import shutil
 import logging
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 from contextlib import asynccontextmanager
 from pathlib import Path
 
@@ -13,18 +14,33 @@ from fastapi import (
     APIRouter, Depends, status, UploadFile, File as FastAPIFile
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from slowapi import _rate_limit_exceeded_handler
+from slowapi.errors import RateLimitExceeded
+from slowapi.middleware import SlowAPIASGIMiddleware
 
-from . import db
+from . import db, telegram_ingest
+from .audit import audit_writer
+from .auth import limiter
+from .connectors import registry as connector_registry
 from .config import (
     FREE_TIER_MODELS,
     # FREE_TIER_QUOTAS, # تم إزالته لأنه غير موجود في config.py
     WORKSPACE_ROOT,
     API_KEY_SLOTS,
+    MAX_UPLOAD_SIZE,
     REPO_ROOT,
+    TELEGRAM_WEBHOOK_SECRET,
 )
 from .models.schemas import TaskCreate
-from .workspace_fs import list_dir, read_file
+from .workspace_fs import (
+    UploadTooLarge, is_task_workspace, iter_file_range, iter_upload_file, parse_range_header,
+    paths_overlap, read_file, stream_upload, task_workspace, workspace_rel_path,
+)
+from .workspace_index import workspace_index
+from .workspace_search import workspace_search
+from .workspace_snapshots import snapshot_store
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -34,7 +50,17 @@ logger = logging.getLogger(__name__)
 async def lifespan(app: FastAPI):
     logger.info("Application startup")
     db.init_db()
+    workspace_index.subscribe(workspace_search.enqueue)
+    await asyncio.to_thread(workspace_index.start)
+    workspace_search.start()
+    audit_writer.start()
     yield
+    await audit_writer.close()
+    workspace_index.stop()
+    workspace_search.stop()
+    await telegram_ingest.shutdown()
+    connector_registry.clear()
+    db.close()
     logger.info("Application shutdown")
 
 app = FastAPI(
@@ -43,6 +69,11 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+# حدود المعدل (RATE_LIMIT_DEFAULT لكل مستخدم/IP) في مخزن مشترك بين العمليات
+app.state.limiter = limiter
+app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+app.add_middleware(SlowAPIASGIMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -60,10 +91,7 @@ async def health():
 
 @v1.get("/settings/keys")
 async def get_settings():
-    configured = {}
-    for slot in API_KEY_SLOTS:
-        val = db.get_setting(slot)
-        configured[slot] = bool(val and len(val) > 5)
+    configured = {slot: bool(val and len(val) > 5) for slot, val in db.get_settings(API_KEY_SLOTS).items()}
     
     return {
         "api_keys_configured": configured,
@@ -93,7 +121,7 @@ async def create_task(req: TaskCreate):
     db.create_task(
         task_id,
         req.goal,
-        str(WORKSPACE_ROOT),
+        str(task_workspace(task_id)),
         req.token_budget or 1_000_000,
     )
     db.add_event(task_id, "info", "task.queued", "Task created")
@@ -113,27 +141,178 @@ async def get_events(task_id: str, after: int = 0, limit: int = 500):
     events = db.get_events(task_id, after=after, limit=limit)
     return {"events": events}
 
+@v1.get("/tasks/{task_id}/snapshots")
+async def list_task_snapshots(task_id: str):
+    if not db.get_task(task_id):
+        raise HTTPException(404, "Task not found")
+    return {"snapshots": db.list_workspace_snapshots(task_id)}
+
+@v1.post("/tasks/{task_id}/snapshots")
+async def create_task_snapshot(task_id: str, label: Optional[str] = None):
+    task = db.get_task(task_id)
+    if not task:
+        raise HTTPException(404, "Task not found")
+    if not is_task_workspace(task["project_path"]):
+        # مهام قديمة على الـ Workspace المشترك: استعادتها ستمس ملفات مهام أخرى
+        raise HTTPException(409, "Task has no dedicated workspace directory; snapshots are unavailable")
+    return await asyncio.to_thread(snapshot_store.create, task["project_path"], task_id, label)
+
+def _task_snapshot_or_404(task_id: str, snapshot_id: str) -> Dict[str, Any]:
+    snapshot = db.get_workspace_snapshot(snapshot_id)
+    if not snapshot or snapshot["task_id"] != task_id:
+        raise HTTPException(404, "Snapshot not found")
+    return snapshot
+
+@v1.get("/tasks/{task_id}/snapshots/{snapshot_id}/diff")
+async def diff_task_snapshot(task_id: str, snapshot_id: str, against: Optional[str] = None):
+    """الفرق مع لقطة أخرى (against) أو مع الحالة الحالية للـ Workspace."""
+    _task_snapshot_or_404(task_id, snapshot_id)
+    if against:
+        _task_snapshot_or_404(task_id, against)
+    return await asyncio.to_thread(snapshot_store.diff, snapshot_id, against)
+
+@v1.post("/tasks/{task_id}/snapshots/{snapshot_id}/restore")
+async def restore_task_snapshot(task_id: str, snapshot_id: str):
+    """إرجاع مجلد المهمة إلى لقطة (يُرفض أثناء تشغيل أي مهمة يتداخل مجلدها مع جذر اللقطة)."""
+    task = db.get_task(task_id)
+    if not task:
+        raise HTTPException(404, "Task not found")
+    snapshot = _task_snapshot_or_404(task_id, snapshot_id)
+    busy = [t["id"] for t in db.list_running_task_paths() if paths_overlap(t["project_path"], snapshot["root"])]
+    if busy:
+        raise HTTPException(409, f"Cancel running tasks sharing this workspace before restoring: {', '.join(busy)}")
+    result = await asyncio.to_thread(snapshot_store.restore, snapshot_id)
+    db.add_event(task_id, "info", "workspace.restored", f"Workspace restored to {snapshot_id}", data=result)
+    return result
+
+@v1.delete("/tasks/{task_id}/snapshots/{snapshot_id}")
+async def delete_task_snapshot(task_id: str, snapshot_id: str):
+    """حذف لقطة ثم جمع الكتل التي لم تعد أي لقطة تشير إليها."""
+    _task_snapshot_or_404(task_id, snapshot_id)
+    await asyncio.to_thread(snapshot_store.delete, snapshot_id)
+    return {"ok": True, "gc": await asyncio.to_thread(snapshot_store.gc)}
+
 @v1.get("/workspace/tree")
-async def workspace_tree(path: str = "."):
-    return list_dir(path)
+async def workspace_tree(
+    path: str = ".",
+    offset: int = 0,
+    limit: Optional[int] = None,
+    recursive: bool = False,
+    max_depth: Optional[int] = None,
+):
+    """استعراض من فهرس الذاكرة؛ recursive=true للسرد التكراري المرقّم."""
+    try:
+        rel = workspace_rel_path(path)
+        if recursive:
+            return workspace_index.walk(rel, offset=offset, limit=limit or 1000, max_depth=max_depth)
+        return workspace_index.list_dir(rel, offset=offset, limit=limit)
+    except FileNotFoundError as e:
+        raise HTTPException(404, str(e))
+    except (NotADirectoryError, ValueError) as e:
+        raise HTTPException(400, str(e))
+
+@v1.get("/workspace/version")
+async def workspace_version():
+    """عدّاد تغييرات الـ Workspace: يعيد العميل جلب الشجرة فقط عند تغيّره."""
+    return {"version": workspace_index.version}
+
+@v1.get("/workspace/search")
+async def workspace_search_endpoint(q: str, limit: int = 20, offset: int = 0, path: Optional[str] = None):
+    """بحث نصي كامل في محتوى الـ Workspace (مرتب مع مقتطفات)."""
+    try:
+        prefix = workspace_rel_path(path) if path else None
+        return await asyncio.to_thread(workspace_search.search, q, limit=min(limit, 200), offset=offset, path_prefix=prefix)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
 
 @v1.get("/workspace/file")
-async def workspace_read_file(path: str):
-    return {"content": read_file(path)}
+async def workspace_read_file(
+    path: str,
+    offset: int = 0,
+    length: Optional[int] = None,
+    tail: bool = False,
+):
+    """قراءة ملف أو نطاق منه (offset/length) أو نهايته (tail) للتصفح في الملفات الكبيرة."""
+    try:
+        return {"content": await asyncio.to_thread(read_file, path, offset=offset, length=length, tail=tail)}
+    except FileNotFoundError as e:
+        raise HTTPException(404, str(e))
+    except (IsADirectoryError, ValueError) as e:
+        raise HTTPException(400, str(e))
+
+@v1.get("/workspace/file/stream")
+async def workspace_stream_file(path: str, request: Request):
+    """بث الملف بذاكرة ثابتة مع دعم ترويسة Range (استجابة 206)."""
+    try:
+        file_path = WORKSPACE_ROOT / workspace_rel_path(path)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    if not file_path.is_file():
+        raise HTTPException(404, "File not found")
+    size = file_path.stat().st_size
+    try:
+        byte_range = parse_range_header(request.headers.get("range"), size)
+    except ValueError:
+        raise HTTPException(416, "Requested range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    headers = {"Accept-Ranges": "bytes"}
+    if byte_range is None:
+        start, end, status_code = 0, size - 1, 200
+    else:
+        (start, end), status_code = byte_range, 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(max(0, end - start + 1))
+    return StreamingResponse(
+        iter_file_range(path, start, end),
+        status_code=status_code,
+        media_type="application/octet-stream",
+        headers=headers,
+    )
 
 @v1.post("/workspace/upload")
 async def upload_file(file: UploadFile = FastAPIFile(...)):
     try:
-        upload_dir = WORKSPACE_ROOT / "uploads"
-        upload_dir.mkdir(parents=True, exist_ok=True)
-        file_path = upload_dir / file.filename
-        with file_path.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        return {"ok": True, "path": str(file_path.relative_to(WORKSPACE_ROOT))}
+        return await stream_upload(iter_upload_file(file), file.filename)
+    except UploadTooLarge as e:
+        raise HTTPException(413, str(e))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
     except Exception as e:
         logger.exception("Upload failed")
         raise HTTPException(500, str(e))
 
+@v1.put("/workspace/upload/{filename}")
+async def upload_file_raw(filename: str, request: Request):
+    """رفع جسم الطلب الخام مباشرة (بدون multipart) مع فرض الحد أثناء التدفق."""
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > MAX_UPLOAD_SIZE:
+        raise HTTPException(413, "Upload too large")
+    try:
+        return await stream_upload(request.stream(), filename)
+    except UploadTooLarge as e:
+        raise HTTPException(413, str(e))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except Exception as e:
+        logger.exception("Upload failed")
+        raise HTTPException(500, str(e))
+
+@v1.post("/connectors/telegram/{connector_id}/webhook")
+@limiter.exempt
+async def telegram_webhook(connector_id: str, request: Request):
+    """مستقبل Webhook لتيلجرام: يغذي نفس طابور الـ long polling (مغلق ما لم يُضبط TELEGRAM_WEBHOOK_SECRET)."""
+    if not TELEGRAM_WEBHOOK_SECRET:
+        raise HTTPException(403, "Telegram webhook is disabled (TELEGRAM_WEBHOOK_SECRET is not set)")
+    provided = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(provided, TELEGRAM_WEBHOOK_SECRET):
+        raise HTTPException(401, "Invalid webhook secret")
+    try:
+        ingestor = telegram_ingest.get_ingestor(connector_id)
+    except LookupError as e:
+        raise HTTPException(404, str(e))
+    update = await request.json()
+    accepted = await ingestor.submit(update)
+    return {"ok": True, "accepted": accepted}
+
 # Include V1 Router
 app.include_router(v1)
 
@@ -0,0 +1,226 @@
+# كاتب سجل التدقيق غير المتزامن:
+# - log_audit يضع السجل في طابور محدود في الذاكرة ويعود فوراً (لا انتظار لقاعدة البيانات في الطلب).
+# - مهمة خلفية تجمع السجلات وتكتبها بدفعات (executemany في معاملة واحدة) كل flush_interval أو عند امتلاء الدفعة.
+# - عند امتلاء الطابور أو فشل الكتابة تُلحق السجلات بملف journal محلي (JSON lines) بدلاً من فقدانها،
+#   ويُعاد إدخال الملف عند خمول الطابور وعند بدء التشغيل (تسليم at-least-once).
+# - الـ journal مشترك بين العمليات (عمال uvicorn/Celery): الإلحاق والنقل تحت قفل flock قصير،
+#   وإعادة الإدخال تحت قفل flock ثانٍ غير حاجب فلا تعيد عمليتان إدخال نفس الملف،
+#   مع حفظ موضع آخر دفعة مُدخلة فلا يُعاد إدخال ما سبقها بعد فشل جزئي.
+
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import orjson
+
+from . import db
+from .config import AUDIT_JOURNAL_PATH
+from .logging_config import get_logger
+
+logger = get_logger(__name__)
+
+try:
+    import fcntl
+except ImportError:  # Windows: الأقفال داخل العملية فقط
+    fcntl = None
+
+DEFAULT_QUEUE_SIZE = 10_000
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL_SEC = 1.0
+
+class AuditWriter:
+    """طابور تدقيق محدود مع كتابة بالدفعات وملف journal للضغط الزائد والأعطال."""
+
+    def __init__(
+        self,
+        journal_path: Path = AUDIT_JOURNAL_PATH,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL_SEC,
+    ):
+        self.journal_path = Path(journal_path)
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: Optional[asyncio.Queue] = None
+        self._consumer: Optional[asyncio.Task] = None
+        self._journal_lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+        self.stats = {"queued": 0, "written": 0, "batches": 0, "spilled": 0, "replayed": 0, "errors": 0}
+
+    # --- Journal ---
+    def _sibling(self, suffix: str) -> Path:
+        return self.journal_path.with_name(self.journal_path.name + suffix)
+
+    @contextmanager
+    def _file_lock(self, thread_lock: threading.Lock, suffix: str, blocking: bool = True) -> Iterator[bool]:
+        """قفل بين الخيوط (threading) وبين العمليات (flock على ملف جانبي)؛ يعيد False إن كان محجوزاً."""
+        if not thread_lock.acquire(blocking):
+            yield False
+            return
+        try:
+            if fcntl is None:
+                yield True
+                return
+            self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self._sibling(suffix), "ab") as lock_file:
+                try:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+                except BlockingIOError:
+                    yield False
+                    return
+                try:
+                    yield True
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        finally:
+            thread_lock.release()
+
+    def _spill(self, records: List[Dict[str, Any]]) -> None:
+        """إلحاق سجلات بملف الـ journal (مسار الضغط الزائد؛ لا يُفقد أي سجل)."""
+        data = b"".join(orjson.dumps(r) + b"\n" for r in records)
+        with self._file_lock(self._journal_lock, ".lock"):
+            with open(self.journal_path, "ab") as f:
+                f.write(data)
+        self.stats["spilled"] += len(records)
+
+    def _has_journal(self) -> bool:
+        return self.journal_path.exists() or self._sibling(".replaying").exists()
+
+    def replay_journal(self) -> int:
+        """
+        إدخال سجلات الـ journal في قاعدة البيانات بدفعات ثم حذفه.
+        يُنقل الملف أولاً إلى .replaying فتستمر الإلحاقات الجديدة في ملف جديد؛
+        وبعد كل دفعة يُحفظ موضعها في .replaying.offset، فإن فشل الإدخال يُستأنف من أول دفعة لم تُدخل.
+        إن كانت عملية أخرى تعيد الإدخال حالياً يعود فوراً بصفر.
+
+        Returns:
+            عدد السجلات المُدخلة
+        """
+        with self._file_lock(self._replay_lock, ".replay.lock", blocking=False) as acquired:
+            if not acquired:
+                return 0
+            replaying = self._sibling(".replaying")
+            offset_path = self._sibling(".replaying.offset")
+            if not replaying.exists():
+                with self._file_lock(self._journal_lock, ".lock"):
+                    if not self.journal_path.exists():
+                        return 0
+                    os.replace(self.journal_path, replaying)
+                offset_path.unlink(missing_ok=True)
+            try:
+                position = int(offset_path.read_text() or 0)
+            except (OSError, ValueError):
+                position = 0
+
+            total = 0
+            batch: List[Dict[str, Any]] = []
+            with open(replaying, "rb") as f:
+                f.seek(position)
+                for raw in f:
+                    line = raw.strip()
+                    if line:
+                        try:
+                            batch.append(orjson.loads(line))
+                        except orjson.JSONDecodeError:
+                            # سطر مقتطع من إيقاف مفاجئ أثناء الكتابة
+                            logger.warning(f"Skipping corrupt audit journal line: {line[:80]!r}")
+                    position += len(raw)
+                    if len(batch) >= self.batch_size:
+                        total += db.create_audit_logs(batch)
+                        batch = []
+                        offset_path.write_text(str(position))
+            total += db.create_audit_logs(batch)
+            replaying.unlink()
+            offset_path.unlink(missing_ok=True)
+        self.stats["replayed"] += total
+        if total:
+            logger.info(f"Replayed {total} audit records from journal")
+        return total
+
+    # --- Queue ---
+    def submit(self, record: Dict[str, Any]) -> None:
+        """إدخال سجل دون انتظار: الطابور إن وُجدت مساحة، وإلا الـ journal."""
+        record.setdefault("timestamp", time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()))
+        if self.queue is None or self._consumer is None or self._consumer.done():
+            try:
+                self.start()
+            except RuntimeError:
+                # لا توجد حلقة أحداث (استدعاء من سياق متزامن): الـ journal مباشرة
+                self._spill([record])
+                return
+        try:
+            self.queue.put_nowait(record)
+            self.stats["queued"] += 1
+        except asyncio.QueueFull:
+            self._spill([record])
+
+    def _drain(self, first: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        batch = [first] if first is not None else []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+
+    async def _write(self, batch: List[Dict[str, Any]]) -> None:
+        try:
+            await asyncio.to_thread(db.create_audit_logs, batch)
+            self.stats["written"] += len(batch)
+            self.stats["batches"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"Audit batch write failed ({len(batch)} records), spilling to journal: {e}")
+            await asyncio.to_thread(self._spill, batch)
+
+    async def run(self) -> None:
+        """حلقة الكتابة: دفعة عند توفر سجلات، وإعادة إدخال الـ journal عند الخمول."""
+        while True:
+            try:
+                first = await asyncio.wait_for(self.queue.get(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                if self._has_journal():
+                    try:
+                        await asyncio.to_thread(self.replay_journal)
+                    except Exception as e:
+                        logger.error(f"Audit journal replay failed: {e}")
+                continue
+            # انتظار قصير لتجميع دفعة أكبر تحت الحمل
+            if self.queue.qsize() < self.batch_size:
+                await asyncio.sleep(0)
+            await self._write(self._drain(first))
+
+    def start(self) -> None:
+        """تشغيل الكاتب في حلقة الأحداث الحالية (يرفع RuntimeError خارج حلقة أحداث)."""
+        loop = asyncio.get_running_loop()
+        if self._consumer is not None and not self._consumer.done() and self._consumer.get_loop() is loop:
+            return
+        if self.queue is not None and self.queue.qsize():
+            # سجلات من حلقة سابقة لم تُكتب
+            self._spill(self._drain())
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._consumer = loop.create_task(self.run())
+
+    async def close(self) -> None:
+        """إيقاف الكاتب وكتابة ما تبقى في الطابور (أو إلحاقه بالـ journal)."""
+        if self._consumer is not None:
+            self._consumer.cancel()
+            try:
+                await self._consumer
+            except asyncio.CancelledError:
+                pass
+            self._consumer = None
+        if self.queue is not None:
+            while not self.queue.empty():
+                await self._write(self._drain())
+            self.queue = None
+
+# الكاتب العام لسجل التدقيق
+audit_writer = AuditWriter()
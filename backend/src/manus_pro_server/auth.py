@@ -5,9 +5,17 @@
 # ═══════════════════════════════════════════════════════════════════════════════
 
 from __future__ import annotations
+import asyncio
+import hashlib
 import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable, List, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status, Request
@@ -20,10 +28,21 @@ JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-this-in-pro
 JWT_ALGORITHM = "HS256"
 JWT_ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
 JWT_REFRESH_TOKEN_EXPIRE_DAYS = 30
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "30"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+API_KEY_NEGATIVE_TTL_SECONDS = float(os.getenv("API_KEY_NEGATIVE_TTL_SECONDS", "300"))
+API_KEY_PREFIX = "mkh_"
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+# مخزن حدود المعدل المشترك بين العمليات والنسخ (Redis)، مع ذاكرة محلية عند غيابه أو تعطله
+RATE_LIMIT_STORAGE_URI = os.getenv("RATE_LIMIT_STORAGE_URI", os.getenv("REDIS_URL", "memory://"))
+RATE_LIMIT_STRATEGY = os.getenv("RATE_LIMIT_STRATEGY", "sliding-window-counter")
+RATE_LIMIT_DEFAULT = os.getenv("RATE_LIMIT_DEFAULT", "600/minute")
 
 # ═══ Password Hashing ═══
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# الدوال المتزامنة للسكربتات والعمال فقط؛ مسارات FastAPI تستخدم *_async و authenticate_user
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """التحقق من كلمة المرور"""
     return pwd_context.verify(plain_password, hashed_password)
@@ -32,6 +51,123 @@ def get_password_hash(password: str) -> str:
     """تشفير كلمة المرور"""
     return pwd_context.hash(password)
 
+class PasswordHasher:
+    """
+    تنفيذ bcrypt في مجمع خيوط محدود بدلاً من حلقة الأحداث.
+
+    - bcrypt يحرر الـ GIL أثناء الحساب، فالخيوط تكفي دون عمليات منفصلة
+    - max_workers عملية حساب متزامنة على الأكثر، والباقي ينتظر في الطابور
+    - عند تجاوز max_pending (قيد التنفيذ + في الانتظار) يُرفض الطلب بـ 503 بدلاً من تراكم التأخير
+    - stats() تعرض الطابور وأزمنة الانتظار والحساب للمراقبة
+    """
+
+    def __init__(self, max_workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._run_total = 0.0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    def _timed(self, submitted: float, fn: Callable, *args: Any) -> Any:
+        started = time.perf_counter()
+        with self._lock:
+            self._running += 1
+            self._wait_total += started - submitted
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+                self._run_total += time.perf_counter() - started
+
+    async def run(self, fn: Callable, *args: Any) -> Any:
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Authentication service busy, retry shortly",
+                    headers={"Retry-After": "1"},
+                )
+            self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), self._timed, time.perf_counter(), fn, *args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self.run(verify_password, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self.run(get_password_hash, password)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            done = self._completed or 1
+            return {
+                "workers": self.max_workers,
+                "running": self._running,
+                "queued": self._pending - self._running,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "avg_wait_ms": round(self._wait_total / done * 1000, 2),
+                "avg_run_ms": round(self._run_total / done * 1000, 2),
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+password_hasher = PasswordHasher()
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """التحقق من كلمة المرور دون حجب حلقة الأحداث"""
+    return await password_hasher.verify(plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """تشفير كلمة المرور دون حجب حلقة الأحداث"""
+    return await password_hasher.hash(password)
+
+# بصمة ثابتة للمقارنة عند عدم وجود المستخدم (زمن استجابة متساوٍ لا يكشف وجود الحساب)
+_DUMMY_PASSWORD_HASH = "$2b$12$LdGiTyIJ.38IpK26eoUuLuV2VDyjZdMB2Zuy1AC/w2k31KAZlR0Ge"
+
+async def authenticate_user(email: str, password: str) -> Optional[Dict[str, Any]]:
+    """
+    التحقق من بيانات الدخول لمسارات تسجيل الدخول
+    
+    Args:
+        email: البريد الإلكتروني
+        password: كلمة المرور
+    
+    Returns:
+        معلومات المستخدم، أو None إذا كانت البيانات غير صحيحة
+    """
+    from . import db
+    
+    user = await asyncio.to_thread(db.get_user_by_email, email)
+    hashed = user.get("hashed_password") if user else None
+    valid = await verify_password_async(password, hashed or _DUMMY_PASSWORD_HASH)
+    if not user or not hashed or not valid:
+        return None
+    return user
+
 # ═══ JWT Token Operations ═══
 def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta] = None) -> str:
     """
@@ -96,6 +232,114 @@ def decode_token(token: str) -> Dict[str, Any]:
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+# ═══ Auth Cache ═══
+class AuthCache:
+    """
+    ذاكرة مؤقتة LRU مع TTL للرموز المتحقق منها وسجلات المستخدمين.
+
+    - الرمز يُخزّن حتى انتهاء صلاحيته (exp) فلا يُعاد التحقق من توقيعه في كل طلب
+    - سجل المستخدم يُخزّن ttl ثانية على الأكثر؛ كل تعديل عبر db.update_user_fields يُبطله فوراً
+      في هذه العملية (invalidate_user)، والـ ttl هو الحد الأقصى لتأخر العمليات الأخرى
+    - المستخدمون غير الموجودين أو المعطلون لا يُخزّنون
+    - مفاتيح API بالبصمة: الصالحة لمدة ttl، وغير الصالحة لمدة negative_ttl
+      (رفض محاولات التخمين المتكررة دون الوصول إلى قاعدة البيانات)
+    """
+
+    def __init__(
+        self,
+        ttl: float = AUTH_CACHE_TTL_SECONDS,
+        max_entries: int = AUTH_CACHE_MAX_ENTRIES,
+        clock: Callable[[], float] = time.monotonic,
+        negative_ttl: float = API_KEY_NEGATIVE_TTL_SECONDS,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        self._clock = clock
+        self._tokens: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._users: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._api_keys: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._invalid_keys: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, store: "OrderedDict", key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            item = store.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if self._clock() >= expires_at:
+                del store[key]
+                return None
+            store.move_to_end(key)
+            return value
+
+    def _put(self, store: "OrderedDict", key: str, value: Dict[str, Any], ttl: float) -> None:
+        if ttl <= 0:
+            return
+        with self._lock:
+            store[key] = (value, self._clock() + ttl)
+            store.move_to_end(key)
+            while len(store) > self.max_entries:
+                store.popitem(last=False)
+
+    def get_payload(self, token: str) -> Optional[Dict[str, Any]]:
+        return self._get(self._tokens, token)
+
+    def put_payload(self, token: str, payload: Dict[str, Any]) -> None:
+        # لا يُخزّن الرمز بعد انتهاء صلاحيته الفعلية
+        exp = payload.get("exp")
+        ttl = float(exp) - time.time() if exp is not None else self.ttl
+        self._put(self._tokens, token, payload, ttl)
+
+    def get_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return self._get(self._users, user_id)
+
+    def put_user(self, user_id: str, user: Dict[str, Any]) -> None:
+        self._put(self._users, user_id, user, self.ttl)
+
+    def get_api_key_user(self, key_hash: str) -> Optional[Dict[str, Any]]:
+        return self._get(self._api_keys, key_hash)
+
+    def put_api_key_user(self, key_hash: str, user: Dict[str, Any]) -> None:
+        self._put(self._api_keys, key_hash, user, self.ttl)
+
+    def is_invalid_key(self, key_hash: str) -> bool:
+        return self._get(self._invalid_keys, key_hash) is not None
+
+    def mark_invalid_key(self, key_hash: str) -> None:
+        self._put(self._invalid_keys, key_hash, {}, self.negative_ttl)
+
+    def invalidate_api_key(self, key_hash: str) -> None:
+        with self._lock:
+            self._api_keys.pop(key_hash, None)
+
+    def invalidate_user(self, user_id: str) -> None:
+        with self._lock:
+            self._users.pop(user_id, None)
+            for key_hash in [h for h, (u, _) in self._api_keys.items() if u.get("id") == user_id]:
+                del self._api_keys[key_hash]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._tokens.clear()
+            self._users.clear()
+            self._api_keys.clear()
+            self._invalid_keys.clear()
+
+auth_cache = AuthCache()
+
+def invalidate_user(user_id: str) -> None:
+    """إبطال سجل المستخدم المخزن (يُستدعى تلقائياً من db.update_user_fields)"""
+    auth_cache.invalidate_user(user_id)
+
+def _register_user_invalidation() -> None:
+    from . import db
+    
+    db.add_user_change_listener(invalidate_user)
+
+_register_user_invalidation()
+
 # ═══ Authentication Dependencies ═══
 security = HTTPBearer()
 
@@ -115,38 +359,47 @@ async def get_current_user(
         HTTPException: إذا كان الرمز غير صالح
     """
     token = credentials.credentials
-    payload = decode_token(token)
-    
-    if payload.get("type") != "access":
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid token type",
-        )
-    
-    user_id: str = payload.get("sub")
-    if user_id is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-        )
-    
-    # الحصول على المستخدم من قاعدة البيانات
-    from . import db
-    user = db.get_user_by_id(user_id)
+    payload = auth_cache.get_payload(token)
+    if payload is None:
+        payload = decode_token(token)
+        
+        if payload.get("type") != "access":
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid token type",
+            )
+        
+        if payload.get("sub") is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials",
+            )
+        
+        auth_cache.put_payload(token, payload)
     
+    user_id: str = payload["sub"]
+    user = auth_cache.get_user(user_id)
     if user is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="User not found",
-        )
-    
-    if not user.get("is_active"):
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Inactive user",
-        )
+        # الحصول على المستخدم من قاعدة البيانات
+        from . import db
+        user = db.get_user_by_id(user_id)
+        
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="User not found",
+            )
+        
+        if not user.get("is_active"):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Inactive user",
+            )
+        
+        auth_cache.put_user(user_id, with_permission_mask(user))
     
-    return user
+    # نسخة سطحية حتى لا يُعدّل المعالج السجل المخزن
+    return dict(user)
 
 async def get_current_admin_user(
     current_user: Dict[str, Any] = Depends(get_current_user)
@@ -226,6 +479,56 @@ ROLE_PERMISSIONS = {
     ],
 }
 
+# ═══ Compiled Permissions ═══
+# كل صلاحية بت واحد؛ صلاحيات الدور قناع int واحد يُحسب مرة عند بدء التشغيل،
+# فيصبح الفحص عملية AND بدلاً من البحث في قائمة.
+ALL_PERMISSIONS = tuple(v for k, v in vars(Permission).items() if k.isupper())
+PERMISSION_BITS: Dict[str, int] = {perm: 1 << i for i, perm in enumerate(ALL_PERMISSIONS)}
+ALL_PERMISSIONS_MASK = (1 << len(ALL_PERMISSIONS)) - 1
+ROLE_MASKS: Dict[str, int] = {}
+ROLE_PERMISSION_SETS: Dict[str, frozenset] = {}
+
+def permissions_mask(permissions) -> int:
+    """تحويل مجموعة صلاحيات إلى قناع بتات (ADMIN_ALL تعني كل الصلاحيات)"""
+    mask = 0
+    for perm in permissions:
+        if perm == Permission.ADMIN_ALL:
+            return ALL_PERMISSIONS_MASK
+        mask |= PERMISSION_BITS.get(perm, 0)
+    return mask
+
+def compile_role_permissions() -> None:
+    """تجميع ROLE_PERMISSIONS إلى أقنعة و frozensets (يُعاد استدعاؤها إذا عُدّلت الأدوار)"""
+    ROLE_MASKS.clear()
+    ROLE_PERMISSION_SETS.clear()
+    for role, perms in ROLE_PERMISSIONS.items():
+        mask = permissions_mask(perms)
+        ROLE_MASKS[role] = mask
+        ROLE_PERMISSION_SETS[role] = frozenset(p for p in ALL_PERMISSIONS if mask & PERMISSION_BITS[p])
+
+compile_role_permissions()
+
+def user_permission_mask(user: Dict[str, Any]) -> int:
+    """
+    قناع صلاحيات المستخدم: صلاحيات دوره + المنح - المنع من permission_overrides.
+    يُحسب عند تخزين السجل في auth_cache ويُحفظ معه في permission_mask.
+    """
+    mask = user.get("permission_mask")
+    if mask is not None:
+        return mask
+    if user.get("is_admin"):
+        return ALL_PERMISSIONS_MASK
+    mask = ROLE_MASKS.get(user.get("role") or Role.USER, 0)
+    overrides = user.get("permission_overrides") or {}
+    mask |= permissions_mask(overrides.get("grant", ()))
+    mask &= ~permissions_mask(overrides.get("deny", ()))
+    return mask
+
+def with_permission_mask(user: Dict[str, Any]) -> Dict[str, Any]:
+    """إرفاق قناع الصلاحيات المحسوب بسجل المستخدم (قبل تخزينه مؤقتاً)"""
+    user["permission_mask"] = user_permission_mask(user)
+    return user
+
 def has_permission(user: Dict[str, Any], permission: str) -> bool:
     """
     التحقق من صلاحية المستخدم
@@ -240,16 +543,10 @@ def has_permission(user: Dict[str, Any], permission: str) -> bool:
     # المسؤول لديه جميع الصلاحيات
     if user.get("is_admin"):
         return True
-    
-    # الحصول على دور المستخدم
-    role = user.get("role", Role.USER)
-    
-    # الحصول على صلاحيات الدور
-    permissions = ROLE_PERMISSIONS.get(role, [])
-    
-    # التحقق من الصلاحية
-    return permission in permissions or Permission.ADMIN_ALL in permissions
+    bit = PERMISSION_BITS.get(permission)
+    return bit is not None and bool(user_permission_mask(user) & bit)
 
+@lru_cache(maxsize=None)
 def require_permission(permission: str):
     """
     Decorator للتحقق من الصلاحية
@@ -258,12 +555,16 @@ def require_permission(permission: str):
         permission: الصلاحية المطلوبة
     
     Returns:
-        Dependency function
+        Dependency function (واحدة لكل صلاحية، فيعيد FastAPI استخدام نتيجتها داخل الطلب)
     """
+    bit = PERMISSION_BITS.get(permission)
+    if bit is None:
+        raise ValueError(f"Unknown permission '{permission}'")
+    
     async def permission_checker(
         current_user: Dict[str, Any] = Depends(get_current_user)
     ) -> Dict[str, Any]:
-        if not has_permission(current_user, permission):
+        if not (current_user.get("is_admin") or user_permission_mask(current_user) & bit):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail=f"Permission denied: {permission}",
@@ -273,7 +574,44 @@ def require_permission(permission: str):
     return permission_checker
 
 # ═══ Rate Limiting ═══
-limiter = Limiter(key_func=get_remote_address)
+def rate_limit_key(request: Request) -> str:
+    """
+    مفتاح حد المعدل: معرف المستخدم من رمز JWT صالح، أو معرف مفتاح API صالح، وإلا عنوان IP.
+    
+    الرمز يُتحقق من توقيعه (مرة واحدة ثم من auth_cache) حتى لا يستنفد رمز مزوّر
+    حصة مستخدم آخر؛ والرموز غير الصالحة تُحسب على عنوان IP.
+    """
+    header = request.headers.get("authorization", "")
+    if header[:7].lower() == "bearer ":
+        token = header[7:].strip()
+        payload = auth_cache.get_payload(token)
+        if payload is None:
+            try:
+                payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+            except JWTError:
+                payload = None
+            if payload is not None and payload.get("type") == "access" and payload.get("sub") is not None:
+                auth_cache.put_payload(token, payload)
+            else:
+                payload = None
+        if payload is not None:
+            return f"user:{payload['sub']}"
+        if token.startswith(API_KEY_PREFIX):
+            # بحث واحد يُخزّن النتيجة فلا يكرره get_api_key_user في نفس الطلب
+            user = lookup_api_key(token)
+            if user is not None:
+                return f"key:{user['api_key_id']}"
+    return f"ip:{get_remote_address(request)}"
+
+# sliding-window-counter على Redis: عدّادان لكل مفتاح وتحديث ذري بسكربت Lua واحد (O(1) ذاكرة)
+limiter = Limiter(
+    key_func=rate_limit_key,
+    default_limits=[RATE_LIMIT_DEFAULT] if RATE_LIMIT_DEFAULT else [],
+    storage_uri=RATE_LIMIT_STORAGE_URI,
+    strategy=RATE_LIMIT_STRATEGY,
+    in_memory_fallback_enabled=True,
+    key_prefix="mkh",
+)
 
 def rate_limit(limit: str):
     """
@@ -299,7 +637,7 @@ async def log_audit(
     request: Optional[Request] = None
 ) -> None:
     """
-    تسجيل حدث تدقيق
+    تسجيل حدث تدقيق (يُضاف إلى طابور audit_writer ويُكتب بدفعات في الخلفية)
     
     Args:
         user_id: معرف المستخدم
@@ -309,7 +647,7 @@ async def log_audit(
         details: تفاصيل إضافية
         request: طلب HTTP
     """
-    from . import db
+    from .audit import audit_writer
     
     ip_address = None
     user_agent = None
@@ -318,17 +656,80 @@ async def log_audit(
         ip_address = request.client.host if request.client else None
         user_agent = request.headers.get("user-agent")
     
-    db.create_audit_log(
-        user_id=user_id,
-        action=action,
-        resource_type=resource_type,
-        resource_id=resource_id,
-        details=details,
-        ip_address=ip_address,
-        user_agent=user_agent
-    )
+    audit_writer.submit({
+        "user_id": user_id,
+        "action": action,
+        "resource_type": resource_type,
+        "resource_id": resource_id,
+        "details": details,
+        "ip_address": ip_address,
+        "user_agent": user_agent,
+    })
 
 # ═══ API Key Authentication (for external services) ═══
+def hash_api_key(api_key: str) -> str:
+    """بصمة SHA-256 لمفتاح API (المفاتيح عشوائية بإنتروبيا عالية فلا حاجة لـ bcrypt)"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+def generate_api_key() -> Tuple[str, str, str]:
+    """
+    إنشاء مفتاح API جديد بصيغة mkh_<prefix>_<secret>
+    
+    Returns:
+        (المفتاح الكامل - يُعرض مرة واحدة فقط، البادئة للعرض، البصمة للتخزين)
+    """
+    prefix = secrets.token_hex(4)
+    api_key = f"{API_KEY_PREFIX}{prefix}_{secrets.token_urlsafe(32)}"
+    return api_key, prefix, hash_api_key(api_key)
+
+def create_api_key(user_id: str, name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    إنشاء مفتاح API لمستخدم وتخزين بصمته فقط
+    
+    Returns:
+        { "id", "prefix", "api_key" } (api_key لا يمكن استرجاعه لاحقاً)
+    """
+    from . import db
+    
+    api_key, prefix, key_hash = generate_api_key()
+    key_id = f"key_{secrets.token_hex(8)}"
+    db.create_api_key(key_id, user_id, prefix, key_hash, name)
+    return {"id": key_id, "prefix": prefix, "api_key": api_key}
+
+def revoke_api_key(key_id: str) -> bool:
+    """إلغاء مفتاح API وإبطاله من الذاكرة المؤقتة"""
+    from . import db
+    
+    key_hash = db.revoke_api_key(key_id)
+    if key_hash is None:
+        return False
+    auth_cache.invalidate_api_key(key_hash)
+    return True
+
+def lookup_api_key(api_key: str) -> Optional[Dict[str, Any]]:
+    """
+    المستخدم صاحب مفتاح API (أو None)
+    
+    الصيغة الخاطئة تُرفض دون حساب، والبصمات غير الصالحة تُرفض من الذاكرة السلبية،
+    وإلا استعلام واحد عبر الفهرس الفريد لـ key_hash.
+    """
+    if not api_key.startswith(API_KEY_PREFIX) or len(api_key) > 128:
+        return None
+    key_hash = hash_api_key(api_key)
+    user = auth_cache.get_api_key_user(key_hash)
+    if user is not None:
+        return user
+    if auth_cache.is_invalid_key(key_hash):
+        return None
+    
+    from . import db
+    user = db.get_user_by_api_key_hash(key_hash)
+    if user is None or not user.get("is_active"):
+        auth_cache.mark_invalid_key(key_hash)
+        return None
+    auth_cache.put_api_key_user(key_hash, with_permission_mask(user))
+    return user
+
 async def verify_api_key(api_key: str) -> bool:
     """
     التحقق من مفتاح API
@@ -339,19 +740,16 @@ async def verify_api_key(api_key: str) -> bool:
     Returns:
         True إذا كان المفتاح صالحاً
     """
-    from . import db
-    
-    # التحقق من قاعدة البيانات
-    valid = db.verify_api_key(api_key)
-    
-    return valid
+    return lookup_api_key(api_key) is not None
 
-async def get_api_key_user(api_key: str = Depends(HTTPBearer())) -> Dict[str, Any]:
+async def get_api_key_user(
+    credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())
+) -> Dict[str, Any]:
     """
     الحصول على المستخدم من مفتاح API
     
     Args:
-        api_key: مفتاح API
+        credentials: مفتاح API في ترويسة Authorization
     
     Returns:
         معلومات المستخدم
@@ -359,14 +757,7 @@ async def get_api_key_user(api_key: str = Depends(HTTPBearer())) -> Dict[str, An
     Raises:
         HTTPException: إذا كان المفتاح غير صالح
     """
-    if not await verify_api_key(api_key):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid API key",
-        )
-    
-    from . import db
-    user = db.get_user_by_api_key(api_key)
+    user = lookup_api_key(credentials.credentials)
     
     if not user:
         raise HTTPException(
@@ -374,4 +765,4 @@ async def get_api_key_user(api_key: str = Depends(HTTPBearer())) -> Dict[str, An
             detail="Invalid API key",
         )
     
-    return user
+    return dict(user)
@@ -85,6 +85,10 @@ celery_app.conf.task_routes = {
         "queue": "low_priority",
         "routing_key": "low",
     },
+    "manus_pro_server.tasks.reencrypt_secrets": {
+        "queue": "low_priority",
+        "routing_key": "low",
+    },
 }
 
 # ═══ Scheduled Tasks (Beat) ═══
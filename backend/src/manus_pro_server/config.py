@@ -11,6 +11,18 @@ DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 DB_PATH = Path(os.getenv("MANUS_PRO_DB_PATH", str(DATA_DIR / "state.sqlite3")))
 FERNET_KEY_PATH = Path(os.getenv("MANUS_PRO_FERNET_KEY_PATH", str(DATA_DIR / "fernet.key")))
+SEARCH_INDEX_PATH = Path(os.getenv("MANUS_PRO_SEARCH_INDEX_PATH", str(DATA_DIR / "workspace_fts.sqlite3")))
+SNAPSHOT_DIR = Path(os.getenv("MANUS_PRO_SNAPSHOT_DIR", str(DATA_DIR / "snapshots")))
+AUDIT_JOURNAL_PATH = Path(os.getenv("MANUS_PRO_AUDIT_JOURNAL_PATH", str(DATA_DIR / "audit_journal.jsonl")))
+
+# Runtime storage backend: "sqlite" (ملف DB_PATH، عقدة واحدة) أو "postgres" (مجمّع asyncpg مشترك بين العقد)
+DB_BACKEND = os.getenv("MANUS_PRO_DB_BACKEND", "sqlite").lower()
+DATABASE_URL = os.getenv("MANUS_PRO_DATABASE_URL", os.getenv("DATABASE_URL", ""))
+# مخطط منفصل لجداول وقت التشغيل حتى لا تتعارض مع جداول هجرات Alembic في نفس القاعدة
+DB_SCHEMA = os.getenv("MANUS_PRO_DB_SCHEMA", "manus_runtime")
+DB_POOL_MIN_SIZE = int(os.getenv("MANUS_PRO_DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("MANUS_PRO_DB_POOL_MAX_SIZE", "20"))
+DB_COMMAND_TIMEOUT_SEC = float(os.getenv("MANUS_PRO_DB_COMMAND_TIMEOUT_SEC", "60"))
 
 # Create data directory if it doesn't exist
 DB_PATH.parent.mkdir(parents=True, exist_ok=True)
@@ -23,6 +35,20 @@ WORKSPACE_ROOT.mkdir(parents=True, exist_ok=True)
 OPENMANUS_CONFIG_PATH = Path(os.getenv("OPENMANUS_CONFIG_PATH", str(REPO_ROOT / "config" / "config.toml")))
 CEREBRAS_BASE_URL_DEFAULT = os.getenv("CEREBRAS_BASE_URL", "https://api.cerebras.ai/v1")
 
+# Telegram ingestion (long polling / webhook)
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+# من يحق له إنشاء مهام عبر /task (معرّفات مفصولة بفواصل)؛ القائمتان فارغتان = لا تُنشأ أي مهمة
+TELEGRAM_ALLOWED_CHAT_IDS = frozenset(
+    int(v) for v in os.getenv("TELEGRAM_ALLOWED_CHAT_IDS", "").split(",") if v.strip()
+)
+TELEGRAM_ALLOWED_USER_IDS = frozenset(
+    int(v) for v in os.getenv("TELEGRAM_ALLOWED_USER_IDS", "").split(",") if v.strip()
+)
+
+# تشفير مرفقات MinIO/S3 قبل رفعها (crypto_stream)؛ هنا لا في s3_storage لأن إعادة التشفير
+# بعد تدوير المفاتيح تحتاج معرفته دون استيراد عميل minio
+MINIO_ENCRYPT_AT_REST = os.getenv("MINIO_ENCRYPT_AT_REST", "false").lower() == "true"
+
 # API Key Slots
 API_KEY_SLOTS = ["api_key_1", "api_key_2", "api_key_3", "api_key_4", "api_key_5"]
 
@@ -48,7 +74,9 @@ DEFAULT_AGENT_PROFILES = AgentProfiles()
 
 # Runtime Settings - Optimized for performance and full access
 RUNTIME_POLL_INTERVAL_SEC = 0.5 # Faster polling
+TASK_CLAIM_LEASE_SEC = float(os.getenv("MANUS_PRO_TASK_CLAIM_LEASE_SEC", "1800")) # Worker claim on a task; must outlast one cycle
 CYCLE_STEPS_DEFAULT = 10 # More steps per cycle
 TOKEN_SOFT_BUDGET_FRACTION = 0.98 # Higher budget utilization
 CORS_ALLOWED_ORIGINS = ["*"] # Permissive CORS for local/codespaces use
 MAX_FILE_READ_SIZE = 10 * 1024 * 1024 # 10MB file read limit
+MAX_UPLOAD_SIZE = int(os.getenv("MANUS_PRO_MAX_UPLOAD_SIZE", str(512 * 1024 * 1024))) # 512MB upload limit
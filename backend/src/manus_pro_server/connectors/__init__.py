@@ -0,0 +1,187 @@
+# ═══════════════════════════════════════════════════════════════════════════════
+# Connector Registry - سجل الموصلات مع تحميل كسول وتخزين مؤقت للنسخ الحية
+# ═══════════════════════════════════════════════════════════════════════════════
+
+import importlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# نوع الموصل -> (الوحدة، اسم الصنف). لا تُستورد الوحدات إلا عند أول استخدام.
+CONNECTOR_CLASS_PATHS: Dict[str, Tuple[str, str]] = {
+    "local_device": ("local_device", "LocalDeviceConnector"),
+    "telegram": ("telegram", "TelegramConnector"),
+    "google": ("google", "GoogleConnector"),
+    "google_drive": ("google_drive", "GoogleDriveConnector"),
+    "microsoft_onedrive": ("microsoft_onedrive", "MicrosoftOnedriveConnector"),
+    "facebook": ("facebook", "FacebookConnector"),
+    "messenger": ("messenger", "MessengerConnector"),
+    "instagram": ("instagram", "InstagramConnector"),
+    "threads": ("threads", "ThreadsConnector"),
+    "tiktok": ("tiktok", "TiktokConnector"),
+    "snapchat": ("snapchat", "SnapchatConnector"),
+    "whatsapp": ("whatsapp", "WhatsappConnector"),
+    "discord": ("discord", "DiscordConnector"),
+    "linkedin": ("linkedin", "LinkedinConnector"),
+    "github": ("github", "GitHubConnector"),
+    "reddit": ("reddit", "RedditConnector"),
+}
+
+DEFAULT_IDLE_TTL = 900.0  # ثوانٍ قبل إخلاء نسخة غير مستخدمة
+DEFAULT_MAX_INSTANCES = 256
+
+class _Entry:
+    __slots__ = ("connector", "version", "last_used")
+
+    def __init__(self, connector: Any, version: Any, last_used: float):
+        self.connector = connector
+        self.version = version
+        self.last_used = last_used
+
+class ConnectorRegistry:
+    """
+    سجل موحّد للموصلات.
+
+    - يستورد وحدة الموصل عند أول طلب لنوعه فقط (تسريع بدء تشغيل الـ API)
+    - يحتفظ بنسخة حية لكل connector_id مع جلسة HTTP الخاصة بها
+    - يُبطل النسخة عند تغيّر سجل الموصل أو رموزه (حتى من عملية أخرى)
+    - يُخلي النسخ الخاملة بعد idle_ttl ويحد العدد الكلي بـ max_instances (LRU)
+    """
+
+    def __init__(
+        self,
+        idle_ttl: float = DEFAULT_IDLE_TTL,
+        max_instances: int = DEFAULT_MAX_INSTANCES,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.idle_ttl = idle_ttl
+        self.max_instances = max_instances
+        self._clock = clock
+        self._classes: Dict[str, type] = {}
+        self._instances: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def connector_types(self) -> List[str]:
+        return list(CONNECTOR_CLASS_PATHS)
+
+    def get_class(self, connector_type: str) -> type:
+        """الحصول على صنف الموصل (استيراد كسول مع تخزين مؤقت)"""
+        cls = self._classes.get(connector_type)
+        if cls is not None:
+            return cls
+        if connector_type not in CONNECTOR_CLASS_PATHS:
+            raise KeyError(f"Unknown connector type '{connector_type}'")
+        module_name, class_name = CONNECTOR_CLASS_PATHS[connector_type]
+        module = importlib.import_module(f".{module_name}", __name__)
+        cls = self._classes[connector_type] = getattr(module, class_name)
+        return cls
+
+    def create(self, connector_type: str, connector_id: str, name: str, config: Dict[str, Any]) -> Any:
+        """إنشاء نسخة مؤقتة غير مخزنة (مثل خطوات OAuth قبل حفظ الموصل)"""
+        return self.get_class(connector_type)(connector_id=connector_id, name=name, config=config)
+
+    def get(self, connector_id: str) -> Any:
+        """
+        الحصول على النسخة الحية لموصل محفوظ في قاعدة البيانات
+
+        Raises:
+            KeyError: إذا لم يكن الموصل موجوداً
+        """
+        from .. import db
+
+        version = db.get_connector_version(connector_id)
+        if version is None:
+            self.invalidate(connector_id)
+            raise KeyError(f"Connector '{connector_id}' not found")
+
+        now = self._clock()
+        with self._lock:
+            self.evict_idle(now)
+            entry = self._instances.get(connector_id)
+            if entry is not None and entry.version == version:
+                entry.last_used = now
+                self._instances.move_to_end(connector_id)
+                return entry.connector
+
+        connector = self._build(connector_id)
+        with self._lock:
+            stale = self._instances.pop(connector_id, None)
+            self._instances[connector_id] = _Entry(connector, version, now)
+            while len(self._instances) > self.max_instances:
+                _, evicted = self._instances.popitem(last=False)
+                evicted.connector.close()
+        if stale is not None and stale.connector is not connector:
+            stale.connector.close()
+        return connector
+
+    def _build(self, connector_id: str) -> Any:
+        from .. import db
+
+        record = db.get_connector_record(connector_id)
+        if record is None:
+            raise KeyError(f"Connector '{connector_id}' not found")
+        config = dict(record["config"])
+        token = db.get_oauth_token(connector_id)
+        if token is not None:
+            config.update(
+                access_token=token["access_token"],
+                refresh_token=token["refresh_token"],
+                expires_at=token["expires_at"],
+            )
+        logger.debug(f"Building connector {connector_id} ({record['type']})")
+        return self.create(record["type"], connector_id, record["name"], config)
+
+    def invalidate(self, connector_id: str) -> None:
+        """إزالة النسخة المخزنة لموصل (بعد تعديل إعداداته أو حذفه)"""
+        with self._lock:
+            entry = self._instances.pop(connector_id, None)
+        if entry is not None:
+            entry.connector.close()
+
+    def evict_idle(self, now: Optional[float] = None) -> List[str]:
+        """إخلاء النسخ التي لم تُستخدم منذ idle_ttl، وإرجاع معرفاتها"""
+        now = self._clock() if now is None else now
+        evicted = []
+        with self._lock:
+            # المدخلات مرتبة من الأقدم استخداماً إلى الأحدث
+            while self._instances:
+                connector_id, entry = next(iter(self._instances.items()))
+                if now - entry.last_used < self.idle_ttl:
+                    break
+                self._instances.popitem(last=False)
+                entry.connector.close()
+                evicted.append(connector_id)
+        return evicted
+
+    def clear(self) -> None:
+        """إغلاق جميع النسخ الحية (عند إيقاف التطبيق)"""
+        with self._lock:
+            entries = list(self._instances.values())
+            self._instances.clear()
+        for entry in entries:
+            entry.connector.close()
+
+    def __len__(self) -> int:
+        return len(self._instances)
+
+# السجل العام المشترك
+registry = ConnectorRegistry()
+
+def get_connector(connector_id: str) -> Any:
+    """الحصول على النسخة الحية لموصل محفوظ"""
+    return registry.get(connector_id)
+
+async def get_fresh_connector(connector_id: str, skew_seconds: float = 60) -> Any:
+    """
+    الحصول على النسخة الحية بعد ضمان صلاحية رمز OAuth لمسارات الطلبات:
+    الرمز الذي ينتهي خلال skew_seconds يُحدّث أولاً (تحديث واحد مشترك للطلبات المتزامنة)،
+    وحفظ الرمز الجديد يُبطل النسخة المخزنة فيُعاد بناؤها به.
+    """
+    from ..token_refresh import ensure_fresh_token
+
+    await ensure_fresh_token(connector_id, skew_seconds)
+    return registry.get(connector_id)
@@ -3,9 +3,19 @@
 # ═══════════════════════════════════════════════════════════════════════════════
 
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
 from enum import Enum
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable, Tuple
+import asyncio
+import hashlib
 import logging
+import random
+import threading
+import time
+
+import requests
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +36,372 @@ class ConnectorAuthType(Enum):
     OAUTH2 = "oauth2"
     TOKEN = "token"
 
+# ═══ Connector Middleware: Rate Limiting + Retry + Circuit Breaking ═══
+
+@dataclass(frozen=True)
+class RateLimit:
+    """حد معدل بأسلوب Token Bucket: عدد الطلبات في الثانية وسعة الاندفاع"""
+    rate: float
+    burst: float
+
+# الحدود لكل مزوّد: "token" لكل توكن على حدة، و"provider" سقف إجمالي للعملية
+PROVIDER_RATE_LIMITS: Dict[str, Dict[str, RateLimit]] = {
+    "github": {"token": RateLimit(1.38, 30), "provider": RateLimit(20.0, 40)},  # 5000 طلب/ساعة لكل توكن
+    "telegram": {"token": RateLimit(30.0, 30), "provider": RateLimit(100.0, 100)},
+    "google_drive": {"token": RateLimit(10.0, 20), "provider": RateLimit(50.0, 100)},
+    "microsoft_onedrive": {"token": RateLimit(10.0, 20), "provider": RateLimit(50.0, 100)},
+    "discord": {"token": RateLimit(50.0, 50), "provider": RateLimit(50.0, 50)},
+}
+DEFAULT_RATE_LIMITS: Dict[str, RateLimit] = {"token": RateLimit(5.0, 10), "provider": RateLimit(20.0, 40)}
+
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+# طرق يُعاد إرسالها تلقائياً؛ غيرها (POST/PATCH) فقط باختيار صريح (idempotent=True)
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+DEFAULT_REQUEST_TIMEOUT = 30.0
+
+class CircuitOpenError(Exception):
+    """يُرفع عندما تكون دائرة المزوّد مفتوحة بعد فشل متكرر"""
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """سياسة إعادة المحاولة مع backoff أُسّي و jitter"""
+    max_retries: int = 5
+    base_delay: float = 0.5
+    max_delay: float = 60.0
+
+class TokenBucket:
+    """
+    Token Bucket آمن للخيوط.
+    
+    يسمح بالحجز المسبق (رصيد سالب) بحيث تُخدم الطلبات المتزامنة بالترتيب
+    دون أن تتجاوز المعدل المستدام.
+    """
+    
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._clock = clock
+        self._tokens = float(capacity)
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = max(0.0, now - self._updated)
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated = now
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """
+        حجز رموز وإرجاع مدة الانتظار اللازمة بالثواني
+        
+        Args:
+            tokens: عدد الرموز المطلوبة
+        
+        Returns:
+            مدة الانتظار قبل تنفيذ الطلب (0 إذا كان متاحاً فوراً)
+        """
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self._tokens -= tokens
+            wait = 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+            return max(wait, self._paused_until - now)
+
+    async def acquire(self, tokens: float = 1.0, sleep: Callable = asyncio.sleep) -> None:
+        """انتظار توفر الرموز ثم استهلاكها"""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await sleep(wait)
+
+    def pause_for(self, seconds: float) -> None:
+        """إيقاف الحجز مؤقتاً (مثلاً بعد 429 أو نفاد الحصة)"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, self._clock() + seconds)
+
+class CircuitBreaker:
+    """
+    قاطع دائرة بثلاث حالات: closed → open → half_open.
+    
+    يفتح بعد failure_threshold إخفاقات متتالية، ويسمح بطلب تجريبي واحد
+    بعد reset_timeout ثانية.
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if self._clock() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow_request(self) -> bool:
+        """هل يُسمح بتمرير الطلب الآن؟"""
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = self._clock()
+
+    def release_probe(self) -> None:
+        """تحرير الطلب التجريبي دون حكم على صحة الخدمة (استثناء محلي أو إلغاء)"""
+        with self._lock:
+            self._probe_in_flight = False
+
+def _header_delay(headers: Any, now: Optional[float] = None) -> Optional[float]:
+    """استخراج مدة الانتظار من Retry-After أو X-RateLimit-Reset"""
+    now = time.time() if now is None else now
+    retry_after = headers.get("Retry-After")
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - now)
+            except (TypeError, ValueError):
+                pass
+    if headers.get("X-RateLimit-Remaining") == "0" and headers.get("X-RateLimit-Reset"):
+        try:
+            return max(0.0, float(headers["X-RateLimit-Reset"]) - now)
+        except ValueError:
+            pass
+    return None
+
+def compute_retry_delay(
+    attempt: int,
+    policy: RetryPolicy,
+    headers: Optional[Any] = None,
+    now: Optional[float] = None,
+    rng: Callable[[], float] = random.random,
+) -> Optional[float]:
+    """
+    حساب مدة الانتظار قبل إعادة المحاولة
+    
+    Args:
+        attempt: رقم المحاولة (يبدأ من 0)
+        policy: سياسة إعادة المحاولة
+        headers: ترويسات الاستجابة (Retry-After / X-RateLimit-Reset)
+        now: الوقت الحالي (epoch) للاختبار
+        rng: مولد أرقام عشوائية في [0, 1)
+    
+    Returns:
+        مدة الانتظار بالثواني، أو None إذا طلب الخادم انتظاراً أطول من max_delay
+    """
+    if headers is not None:
+        hinted = _header_delay(headers, now)
+        if hinted is not None:
+            return hinted if hinted <= policy.max_delay else None
+    # Full jitter: uniform(0, min(max_delay, base * 2^attempt))
+    return rng() * min(policy.max_delay, policy.base_delay * (2 ** attempt))
+
+def _is_retryable(resp: requests.Response) -> bool:
+    if resp.status_code in RETRYABLE_STATUS_CODES:
+        return True
+    # GitHub secondary rate limit يعيد 403 مع Retry-After أو حصة منتهية
+    return resp.status_code == 403 and (
+        "Retry-After" in resp.headers or resp.headers.get("X-RateLimit-Remaining") == "0"
+    )
+
+def _rewind_streams(kwargs: Dict[str, Any]) -> None:
+    """إرجاع مؤشر الملفات المفتوحة إلى البداية قبل إعادة الإرسال"""
+    for key in ("files", "data"):
+        value = kwargs.get(key)
+        items = value.values() if isinstance(value, dict) else [value]
+        for item in items:
+            if isinstance(item, tuple) and len(item) > 1:
+                item = item[1]
+            if hasattr(item, "seek"):
+                try:
+                    item.seek(0)
+                except Exception:
+                    pass
+
+class ConnectorMiddleware:
+    """
+    طبقة وسيطة موحدة لطلبات HTTP الخاصة بالموصلات.
+    
+    - Token Bucket لكل مزوّد ولكل توكن (LRU محدود بـ max_buckets: التوكنات تتغير مع كل تحديث OAuth)
+    - إعادة المحاولة مع backoff أُسّي و jitter مع احترام Retry-After / X-RateLimit-Reset
+    - قاطع دائرة لكل مزوّد لتجنب إغراق خدمة متعطلة
+    """
+    
+    def __init__(
+        self,
+        retry_policy: Optional[RetryPolicy] = None,
+        transport: Optional[Callable[..., requests.Response]] = None,
+        sleep: Callable = asyncio.sleep,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        max_buckets: int = 4096,
+    ):
+        self.retry_policy = retry_policy or RetryPolicy()
+        self._transport = transport
+        self._sleep = sleep
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self.max_buckets = max_buckets
+        self._buckets: "OrderedDict[Tuple[str, str], TokenBucket]" = OrderedDict()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def limits_for(self, provider: str) -> Dict[str, RateLimit]:
+        return PROVIDER_RATE_LIMITS.get(provider, DEFAULT_RATE_LIMITS)
+
+    def bucket(self, provider: str, token_key: Optional[str] = None, limit: Optional[RateLimit] = None) -> TokenBucket:
+        """الحصول على Token Bucket للمزوّد (token_key=None) أو لتوكن محدد"""
+        key = (provider, token_key or "*")
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                limit = limit or self.limits_for(provider)["token" if token_key else "provider"]
+                bucket = self._buckets[key] = TokenBucket(limit.rate, limit.burst)
+                while len(self._buckets) > self.max_buckets:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket
+
+    def breaker(self, provider: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(provider)
+            if breaker is None:
+                breaker = self._breakers[provider] = CircuitBreaker(self._failure_threshold, self._reset_timeout)
+            return breaker
+
+    @staticmethod
+    def _observe_quota(resp: requests.Response, bucket: TokenBucket) -> None:
+        """إيقاف حجز التوكن حتى موعد إعادة الضبط عند نفاد الحصة"""
+        if resp.headers.get("X-RateLimit-Remaining") == "0":
+            delay = _header_delay(resp.headers)
+            if delay:
+                bucket.pause_for(delay)
+
+    async def request(
+        self,
+        provider: str,
+        token_key: str,
+        method: str,
+        url: str,
+        rate_limit: Optional[RateLimit] = None,
+        max_retries: Optional[int] = None,
+        session: Optional[requests.Session] = None,
+        idempotent: Optional[bool] = None,
+        **kwargs: Any,
+    ) -> requests.Response:
+        """
+        تنفيذ طلب HTTP عبر حدود المعدل وإعادة المحاولة وقاطع الدائرة
+        
+        الطلبات غير المتكررة الأثر (POST/PATCH) لا يُعاد إرسالها افتراضياً: انقطاع الاتصال أو 5xx
+        لا يعني أن الخادم لم ينفذها، وإعادتها قد تكرر رسالة أو ملفاً. قاطع الدائرة يسجل
+        نتيجة واحدة لكل طلب منطقي مهما تعددت محاولاته.
+        
+        Args:
+            provider: نوع الموصل (github, telegram, ...)
+            token_key: معرّف التوكن (مُجزّأ) لحد المعدل الخاص به
+            method: طريقة HTTP
+            url: الرابط
+            rate_limit: تجاوز حد المعدل الافتراضي لهذا التوكن
+            max_retries: تجاوز عدد المحاولات في السياسة (0 لطلبات غير قابلة للتكرار)
+            session: جلسة HTTP للموصل (إعادة استخدام اتصالات keep-alive)
+            idempotent: هل تكرار الطلب آمن؟ (None = حسب الطريقة: GET/HEAD/OPTIONS/PUT/DELETE)
+            **kwargs: معاملات requests.request
+        
+        Returns:
+            آخر استجابة (قد تكون 429/5xx إذا نفدت المحاولات)
+        
+        Raises:
+            CircuitOpenError: إذا كانت دائرة المزوّد مفتوحة
+            requests.RequestException: إذا فشل الاتصال بعد كل المحاولات
+        """
+        policy = self.retry_policy
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        if max_retries is None and not idempotent:
+            max_retries = 0
+        if max_retries is not None:
+            policy = RetryPolicy(max_retries, policy.base_delay, policy.max_delay)
+        breaker = self.breaker(provider)
+        provider_bucket = self.bucket(provider)
+        token_bucket = self.bucket(provider, token_key, rate_limit)
+        kwargs.setdefault("timeout", DEFAULT_REQUEST_TIMEOUT)
+        transport = self._transport or (session.request if session is not None else requests.request)
+        
+        if not breaker.allow_request():
+            raise CircuitOpenError(f"Circuit open for provider '{provider}'")
+        # الحكم النهائي للطلب المنطقي: True نجاح، False إخفاق، None بلا حكم (يُحرر الطلب التجريبي فقط)
+        healthy: Optional[bool] = None
+        try:
+            for attempt in range(policy.max_retries + 1):
+                await provider_bucket.acquire(sleep=self._sleep)
+                await token_bucket.acquire(sleep=self._sleep)
+                if attempt:
+                    _rewind_streams(kwargs)
+                
+                try:
+                    resp = await asyncio.to_thread(transport, method, url, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    if attempt >= policy.max_retries:
+                        healthy = False
+                        raise
+                    delay = compute_retry_delay(attempt, policy)
+                    logger.warning(f"{provider} request error ({e}); retry {attempt + 1} in {delay:.2f}s")
+                    await self._sleep(delay)
+                    continue
+                
+                self._observe_quota(resp, token_bucket)
+                # 429/403 تعني أن الخدمة سليمة لكنها تطلب التمهّل
+                healthy = resp.status_code < 500
+                if not _is_retryable(resp):
+                    return resp
+                
+                delay = compute_retry_delay(attempt, policy, resp.headers)
+                if attempt >= policy.max_retries or delay is None:
+                    return resp
+                if resp.status_code < 500:
+                    token_bucket.pause_for(delay)
+                logger.warning(f"{provider} returned {resp.status_code}; retry {attempt + 1} in {delay:.2f}s")
+                healthy = None
+                await self._sleep(delay)
+        finally:
+            if healthy is True:
+                breaker.record_success()
+            elif healthy is False:
+                breaker.record_failure()
+            else:
+                breaker.release_probe()
+
+# الطبقة الوسيطة العامة المشتركة بين جميع الموصلات
+connector_middleware = ConnectorMiddleware()
+
 class BaseConnector(ABC):
     """الواجهة الأساسية لجميع الموصلات"""
     
@@ -45,6 +421,35 @@ class BaseConnector(ABC):
         self.auth_type = auth_type
         self.config = config
         self.is_connected = False
+        self._session: Optional[requests.Session] = None
+
+    @property
+    def session(self) -> requests.Session:
+        """جلسة HTTP خاصة بالموصل (تُنشأ عند أول طلب وتُعاد لكل الطلبات اللاحقة)"""
+        if self._session is None:
+            self._session = requests.Session()
+        return self._session
+
+    def close(self) -> None:
+        """إغلاق جلسة HTTP وتحرير اتصالاتها"""
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def _rate_limit_key(self) -> str:
+        """مفتاح حد المعدل لكل توكن (مُجزّأ لعدم الاحتفاظ بالتوكن كمفتاح)"""
+        secret = getattr(self, "access_token", None) or getattr(self, "token", None) or self.connector_id
+        return hashlib.sha256(str(secret).encode()).hexdigest()[:16]
+
+    async def _request(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        """تنفيذ طلب HTTP عبر الطبقة الوسيطة (حد المعدل + إعادة المحاولة + قاطع الدائرة)"""
+        rate_limit = self.config.get("rate_limit")
+        if rate_limit is not None and not isinstance(rate_limit, RateLimit):
+            rate_limit = RateLimit(*rate_limit)
+        return await connector_middleware.request(
+            self.connector_type, self._rate_limit_key(), method, url,
+            rate_limit=rate_limit, session=self.session, **kwargs
+        )
 
     @abstractmethod
     async def connect(self) -> bool:
@@ -66,6 +471,23 @@ class BaseConnector(ABC):
         """جلب بيانات أو سرد محتويات"""
         pass
 
+    async def sync(self, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        مزامنة تزايدية (اختياري)
+        
+        Args:
+            cursor: المؤشر المُعاد من المزامنة السابقة (None لمزامنة كاملة)
+        
+        Returns:
+            { "changes": [{"id", "removed", "item"}], "cursor": المؤشر الجديد, "full": هل كانت مزامنة كاملة }
+        """
+        if ConnectorCapability.SYNC not in self.capabilities:
+            raise NotImplementedError("هذا الموصل لا يدعم المزامنة")
+        # الافتراضي: لا يوجد change feed لدى المزوّد، فنعيد السرد الكامل
+        items = await self.fetch({})
+        changes = [{"id": item.get("id"), "removed": False, "item": item} for item in items]
+        return {"changes": changes, "cursor": None, "full": True}
+
     async def upload(self, local_path: str, remote_path: str) -> bool:
         """رفع ملف (اختياري)"""
         if ConnectorCapability.UPLOAD not in self.capabilities:
@@ -95,6 +517,26 @@ class OAuthConnector(BaseConnector):
         """تبادل الرمز بـ Access Token"""
         raise NotImplementedError()
 
+    # نقطة نهاية التوكن لدى المزوّد (None إذا لم يدعم refresh_token)
+    token_url: Optional[str] = None
+
     async def refresh_access_token(self) -> Dict[str, Any]:
-        
-        raise NotImplementedError()
+        """تجديد Access Token باستخدام refresh_token (grant_type=refresh_token)"""
+        if not self.token_url or not self.refresh_token:
+            raise NotImplementedError()
+        resp = await self._request("POST", self.token_url, max_retries=0, headers={"Accept": "application/json"}, data={
+            "client_id": self.config.get("client_id"),
+            "client_secret": self.config.get("client_secret"),
+            "refresh_token": self.refresh_token,
+            "grant_type": "refresh_token"
+        })
+        resp.raise_for_status()
+        tokens = resp.json()
+        if "access_token" not in tokens:
+            raise RuntimeError(tokens.get("error_description") or tokens.get("error") or "token refresh failed")
+        self.access_token = tokens["access_token"]
+        self.refresh_token = tokens.get("refresh_token", self.refresh_token)
+        if hasattr(self, "headers") and "Authorization" in self.headers:
+            scheme = self.headers["Authorization"].split(" ", 1)[0]
+            self.headers["Authorization"] = f"{scheme} {self.access_token}"
+        return tokens
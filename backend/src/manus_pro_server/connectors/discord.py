@@ -3,13 +3,14 @@
 # ═══════════════════════════════════════════════════════════════════════════════
 
 import logging
-import requests
 from typing import List, Dict, Any, Optional
 from .base import OAuthConnector, ConnectorCapability
 
 logger = logging.getLogger(__name__)
 
 class DiscordConnector(OAuthConnector):
+    token_url = "https://discord.com/api/oauth2/token"
+
     def __init__(self, connector_id: str, name: str, config: Dict[str, Any]):
         super().__init__(
             connector_id=connector_id,
@@ -23,7 +24,7 @@ class DiscordConnector(OAuthConnector):
 
     async def connect(self) -> bool:
         try:
-            resp = requests.get(self.base_url, headers=self.headers)
+            resp = await self._request("GET", self.base_url, headers=self.headers)
             return resp.status_code == 200
         except Exception as e:
             logger.error(f"Discord connection failed: {e}")
@@ -34,7 +35,7 @@ class DiscordConnector(OAuthConnector):
 
     async def send(self, payload: Dict[str, Any], attachments: Optional[List[str]] = None) -> Dict[str, Any]:
         try:
-            resp = requests.post(self.base_url, headers=self.headers, json=payload)
+            resp = await self._request("POST", self.base_url, headers=self.headers, json=payload, max_retries=0)
             return resp.json()
         except Exception as e:
             logger.error(f"Discord send failed: {e}")
@@ -42,7 +43,7 @@ class DiscordConnector(OAuthConnector):
 
     async def fetch(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
         try:
-            resp = requests.get(self.base_url, headers=self.headers, params=params)
+            resp = await self._request("GET", self.base_url, headers=self.headers, params=params)
             data = resp.json()
             return data if isinstance(data, list) else [data]
         except Exception as e:
@@ -0,0 +1,140 @@
+# ═══════════════════════════════════════════════════════════════════════════════
+# Fan-out Send - إرسال متزامن إلى عدة موصلات
+# ═══════════════════════════════════════════════════════════════════════════════
+
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Union
+
+from .base import BaseConnector
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEND_TIMEOUT = 30.0
+
+# الوجهة موصل جاهز، أو معرّف يُحلّ داخل مهمة الإرسال نفسها عبر resolve
+Target = Union[BaseConnector, str]
+Resolver = Callable[[str], Awaitable[BaseConnector]]
+
+def _target_id(target: Target) -> str:
+    return target if isinstance(target, str) else target.connector_id
+
+async def _send_one(
+    target: Target,
+    payload: Dict[str, Any],
+    attachments: Optional[List[str]],
+    timeout: float,
+    resolve: Optional[Resolver] = None,
+) -> Dict[str, Any]:
+    """
+    إرسال إلى موصل واحد مع مهلة، وإرجاع نتيجة موحّدة بدلاً من رفع استثناء.
+
+    فشل حلّ المعرّف (موصل غير معروف أو فشل تحديث رمز OAuth) نتيجة فاشلة لهذه الوجهة فقط.
+    انتهاء المهلة لا يوقف الإرسال نفسه: طلب HTTP يعمل في خيط لا يُلغى، فقد يكتمل لاحقاً.
+    لذلك تُعلَّم النتيجة unknown (لا نعرف إن وصلت الرسالة) بدلاً من اعتبارها فشلاً.
+    """
+    t0 = time.perf_counter()
+    outcome: Dict[str, Any] = {"connector_id": _target_id(target), "connector_type": None}
+    try:
+        if isinstance(target, str):
+            if resolve is None:
+                raise ValueError("connector id given without a resolver")
+            connector = await resolve(target)
+        else:
+            connector = target
+    except Exception as e:
+        logger.error(f"Fan-out could not resolve connector {target}: {e}")
+        outcome.update(success=False, error=f"connector resolution failed: {e}", elapsed=time.perf_counter() - t0)
+        return outcome
+    outcome["connector_type"] = connector.connector_type
+    try:
+        result = await asyncio.wait_for(connector.send(payload, attachments), timeout=timeout)
+        outcome["success"] = not (isinstance(result, dict) and result.get("success") is False)
+        outcome["result"] = result
+    except asyncio.TimeoutError:
+        outcome.update(success=False, unknown=True, error=f"no result after {timeout:.1f}s; the send may still complete")
+    except Exception as e:
+        logger.error(f"Fan-out send to {connector.connector_id} failed: {e}")
+        outcome.update(success=False, error=str(e))
+    outcome["elapsed"] = time.perf_counter() - t0
+    return outcome
+
+async def iter_fan_out_send(
+    connectors: List[Target],
+    payload: Dict[str, Any],
+    attachments: Optional[List[str]] = None,
+    timeout: float = DEFAULT_SEND_TIMEOUT,
+    timeouts: Optional[Dict[str, float]] = None,
+    overrides: Optional[Dict[str, Dict[str, Any]]] = None,
+    resolve: Optional[Resolver] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    إرسال نفس الحمولة إلى عدة موصلات بالتوازي وبث النتائج فور اكتمال كل منها.
+
+    حدود المعدل وإعادة المحاولة تُطبّق لكل موصل عبر الطبقة الوسيطة المشتركة.
+
+    Args:
+        connectors: الموصلات الوجهة أو معرّفاتها (المكرر بنفس connector_id يُرسل إليه مرة واحدة)
+        payload: الحمولة المشتركة
+        attachments: مرفقات مشتركة
+        timeout: المهلة الافتراضية لكل موصل
+        timeouts: مهلة خاصة لكل connector_id
+        overrides: حقول تُدمج فوق الحمولة لكل connector_id (مثل chat_id أو repo)
+        resolve: دالة تحوّل المعرّف إلى موصل (مثل get_fresh_connector)، تُستدعى لكل وجهة على حدة
+    """
+    timeouts = timeouts or {}
+    overrides = overrides or {}
+    # الموصل المكرر يُرسل إليه مرة واحدة فقط
+    targets = list({_target_id(target): target for target in connectors}.values())
+    pending = [
+        asyncio.ensure_future(_send_one(
+            target,
+            {**payload, **overrides.get(_target_id(target), {})},
+            attachments,
+            timeouts.get(_target_id(target), timeout),
+            resolve,
+        ))
+        for target in targets
+    ]
+    try:
+        for next_done in asyncio.as_completed(pending):
+            yield await next_done
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def fan_out_send(
+    connectors: List[Target],
+    payload: Dict[str, Any],
+    attachments: Optional[List[str]] = None,
+    timeout: float = DEFAULT_SEND_TIMEOUT,
+    timeouts: Optional[Dict[str, float]] = None,
+    overrides: Optional[Dict[str, Dict[str, Any]]] = None,
+    on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+    resolve: Optional[Resolver] = None,
+) -> Dict[str, Any]:
+    """
+    إرسال متزامن إلى عدة موصلات وإرجاع تقرير مُجمّع.
+    زمن البث الكلي ≈ أبطأ إرسال بدلاً من مجموع الأزمنة.
+
+    Returns:
+        { "total", "succeeded", "failed", "unknown", "elapsed", "results": {connector_id: outcome} }
+        حيث unknown عدد الموصلات التي انتهت مهلتها دون نتيجة (قد يكتمل إرسالها لاحقاً).
+    """
+    t0 = time.perf_counter()
+    results: Dict[str, Dict[str, Any]] = {}
+    async for outcome in iter_fan_out_send(connectors, payload, attachments, timeout, timeouts, overrides, resolve):
+        results[outcome["connector_id"]] = outcome
+        if on_result:
+            on_result(outcome)
+    succeeded = sum(1 for r in results.values() if r["success"])
+    unknown = sum(1 for r in results.values() if r.get("unknown"))
+    return {
+        "total": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded - unknown,
+        "unknown": unknown,
+        "elapsed": time.perf_counter() - t0,
+        "results": results,
+    }
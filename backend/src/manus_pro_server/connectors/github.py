@@ -2,20 +2,65 @@
 # GitHub Connector - موصل جيت هوب (مُنفّذ بالكامل)
 # ═══════════════════════════════════════════════════════════════════════════════
 
+import asyncio
 import logging
-import requests
 import base64
-from typing import List, Dict, Any, Optional
+import os
+import posixpath
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
+
+import requests
 
 from .base import OAuthConnector, ConnectorCapability
 
 logger = logging.getLogger(__name__)
 
+# ═══ Conditional Request Cache (ETag / Last-Modified) ═══
+
+@dataclass
+class _CachedResponse:
+    etag: Optional[str]
+    last_modified: Optional[str]
+    body: Any
+    next_url: Optional[str]
+
+class _ResponseCache:
+    """ذاكرة LRU محدودة الحجم لاستجابات GET مفتاحها (التوكن، الرابط الكامل)"""
+    
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], _CachedResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str]) -> Optional[_CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: Tuple[str, str], entry: _CachedResponse) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+_response_cache = _ResponseCache()
+
 class GitHubConnector(OAuthConnector):
     """
     موصل جيت هوب باستخدام GitHub API.
     يوفر إدارة المستودعات والملفات والبحث.
     """
+    token_url = "https://github.com/login/oauth/access_token"
     
     def __init__(self, connector_id: str, name: str, config: Dict[str, Any]):
         super().__init__(
@@ -32,6 +77,7 @@ class GitHubConnector(OAuthConnector):
             config=config
         )
         self.base_url = "https://api.github.com"
+        self.blob_concurrency = int(config.get("blob_concurrency", 8))
         self.headers = {
             "Authorization": f"token {self.access_token}",
             "Accept": "application/vnd.github.v3+json"
@@ -40,7 +86,7 @@ class GitHubConnector(OAuthConnector):
     async def connect(self) -> bool:
         """التحقق من صحة التوكن والوصول للملف الشخصي."""
         try:
-            resp = requests.get(f"{self.base_url}/user", headers=self.headers)
+            resp = await self._request("GET", f"{self.base_url}/user", headers=self.headers)
             return resp.status_code == 200
         except Exception as e:
             logger.error(f"GitHub connection failed: {e}")
@@ -53,7 +99,12 @@ class GitHubConnector(OAuthConnector):
         """
         إنشاء ملف أو تحديثه في مستودع.
         payload: { "repo": "user/repo", "path": "file.md", "message": "commit msg", "content": "text" }
+        وضع الدفعة (commit واحد لعدة ملفات):
+        payload: { "repo": "user/repo", "message": "...", "files": [{"path": "a.md", "content": "text"}, ...] }
         """
+        if payload.get("files") or attachments:
+            return await self.send_batch(payload, attachments)
+        
         repo = payload.get("repo")
         path = payload.get("path")
         message = payload.get("message", "Update from mkh_Manus")
@@ -66,7 +117,7 @@ class GitHubConnector(OAuthConnector):
             
             # الحصول على sha للملف إذا كان موجوداً (للتحديث)
             sha = None
-            resp = requests.get(f"{self.base_url}/repos/{repo}/contents/{path}", headers=self.headers, params={"ref": branch})
+            resp = await self._request("GET", f"{self.base_url}/repos/{repo}/contents/{path}", headers=self.headers, params={"ref": branch})
             if resp.status_code == 200:
                 sha = resp.json().get("sha")
             
@@ -79,33 +130,160 @@ class GitHubConnector(OAuthConnector):
             if sha:
                 data["sha"] = sha
                 
-            resp = requests.put(f"{self.base_url}/repos/{repo}/contents/{path}", headers=self.headers, json=data)
+            resp = await self._request("PUT", f"{self.base_url}/repos/{repo}/contents/{path}", headers=self.headers, json=data)
             return resp.json()
         except Exception as e:
             logger.error(f"GitHub send failed: {e}")
             return {"success": False, "error": str(e)}
 
-    async def fetch(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    async def send_batch(self, payload: Dict[str, Any], attachments: Optional[List[str]] = None) -> Dict[str, Any]:
         """
-        جلب محتويات مستودع أو البحث.
-        params: { "repo": "user/repo", "path": "dir", "q": "search query" }
+        رفع عدة ملفات في commit واحد عبر Git Data API:
+        blobs (بالتوازي) → tree → commit → تحديث ref.
+        
+        payload["files"]: قائمة { "path", "content" } حيث content نص أو bytes،
+        و content=None يعني حذف الملف. المرفقات تُرفع باسمها داخل payload["path"] (إن وُجد).
+        """
+        repo = payload.get("repo")
+        message = payload.get("message", "Update from mkh_Manus")
+        branch = payload.get("branch", "main")
+        files = list(payload.get("files") or [])
+        for file_path in attachments or []:
+            with open(file_path, "rb") as f:
+                target = posixpath.join(payload.get("path", ""), os.path.basename(file_path))
+                files.append({"path": target, "content": f.read()})
+        
+        api = f"{self.base_url}/repos/{repo}/git"
+        try:
+            # 1. آخر commit على الفرع والشجرة الأساسية
+            resp = await self._request("GET", f"{api}/ref/heads/{branch}", headers=self.headers)
+            resp.raise_for_status()
+            parent_sha = resp.json()["object"]["sha"]
+            resp = await self._request("GET", f"{api}/commits/{parent_sha}", headers=self.headers)
+            resp.raise_for_status()
+            base_tree = resp.json()["tree"]["sha"]
+            
+            # 2. إنشاء الـ blobs بالتوازي (محدود بـ blob_concurrency)
+            semaphore = asyncio.Semaphore(self.blob_concurrency)
+            
+            async def create_blob(content: Any) -> Optional[str]:
+                if content is None:
+                    return None
+                raw = content if isinstance(content, bytes) else str(content).encode()
+                async with semaphore:
+                    # كائنات Git معنونة بمحتواها: تكرار الإنشاء يعيد نفس الكائن
+                    r = await self._request("POST", f"{api}/blobs", headers=self.headers, idempotent=True, json={
+                        "content": base64.b64encode(raw).decode(),
+                        "encoding": "base64"
+                    })
+                r.raise_for_status()
+                return r.json()["sha"]
+            
+            blob_shas = await asyncio.gather(*(create_blob(f.get("content")) for f in files))
+            
+            # 3. الشجرة الجديدة فوق الشجرة الأساسية
+            tree = [
+                {"path": f["path"], "mode": f.get("mode", "100644"), "type": "blob", "sha": sha}
+                for f, sha in zip(files, blob_shas)
+            ]
+            resp = await self._request("POST", f"{api}/trees", headers=self.headers, idempotent=True, json={"base_tree": base_tree, "tree": tree})
+            resp.raise_for_status()
+            tree_sha = resp.json()["sha"]
+            
+            # 4. الـ commit ثم تحريك الفرع إليه
+            # commit مكرر يبقى غير مرجعي حتى تحريك الفرع، فإعادة إنشائه آمنة
+            resp = await self._request("POST", f"{api}/commits", headers=self.headers, idempotent=True, json={
+                "message": message,
+                "tree": tree_sha,
+                "parents": [parent_sha]
+            })
+            resp.raise_for_status()
+            commit_sha = resp.json()["sha"]
+            resp = await self._request("PATCH", f"{api}/refs/heads/{branch}", headers=self.headers, json={"sha": commit_sha})
+            resp.raise_for_status()
+            
+            return {"success": True, "commit": commit_sha, "tree": tree_sha, "files": len(files)}
+        except Exception as e:
+            logger.error(f"GitHub batch send failed: {e}")
+            return {"success": False, "error": str(e)}
+
+    async def _conditional_get(self, url: str, params: Optional[Dict[str, Any]] = None) -> Tuple[Any, Optional[str]]:
+        """
+        GET شرطي مع ذاكرة ETag/Last-Modified.
+        استجابات 304 لا تُحتسب من حصة GitHub وتُخدم من الذاكرة.
+        
+        Returns:
+            (جسم الاستجابة JSON، رابط الصفحة التالية من ترويسة Link)
+        """
+        full_url = requests.Request("GET", url, params=params).prepare().url
+        key = (self._rate_limit_key(), full_url)
+        cached = _response_cache.get(key)
+        
+        headers = dict(self.headers)
+        if cached:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+        
+        resp = await self._request("GET", full_url, headers=headers)
+        if resp.status_code == 304 and cached:
+            return cached.body, cached.next_url
+        
+        body = resp.json()
+        next_url = resp.links.get("next", {}).get("url")
+        if resp.status_code == 200 and (resp.headers.get("ETag") or resp.headers.get("Last-Modified")):
+            _response_cache.put(key, _CachedResponse(
+                etag=resp.headers.get("ETag"),
+                last_modified=resp.headers.get("Last-Modified"),
+                body=body,
+                next_url=next_url,
+            ))
+        return body, next_url
+
+    async def iter_fetch(self, params: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        بث النتائج عنصراً بعنصر مع اتباع ترويسة Link (rel="next") تلقائياً.
+        params: { "repo": "user/repo", "path": "dir", "q": "search query", "per_page": 100 }
         """
         repo = params.get("repo")
         path = params.get("path", "")
         query = params.get("q")
+        per_page = int(params.get("per_page", 100))
         
-        try:
+        if query:
+            url = f"{self.base_url}/search/code"
+            page_params: Optional[Dict[str, Any]] = {"q": f"{query} repo:{repo}" if repo else query, "per_page": per_page}
+        else:
+            url = f"{self.base_url}/repos/{repo}/contents/{path}"
+            page_params = {"per_page": per_page}
+        
+        while url:
+            body, url = await self._conditional_get(url, page_params)
+            page_params = None  # رابط Link يحتوي المعاملات مسبقاً
             if query:
-                # بحث في الكود
-                resp = requests.get(f"{self.base_url}/search/code", headers=self.headers, params={"q": f"{query} repo:{repo}" if repo else query})
-                return resp.json().get("items", [])
+                items = body.get("items", [])
             else:
-                # سرد المحتويات
-                resp = requests.get(f"{self.base_url}/repos/{repo}/contents/{path}", headers=self.headers)
-                return resp.json() if isinstance(resp.json(), list) else [resp.json()]
+                items = body if isinstance(body, list) else [body]
+            for item in items:
+                yield item
+
+    async def fetch(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        جلب محتويات مستودع أو البحث (كل الصفحات حتى max_items).
+        params: { "repo": "user/repo", "path": "dir", "q": "search query", "max_items": 1000 }
+        """
+        max_items = int(params.get("max_items", 1000))
+        results: List[Dict[str, Any]] = []
+        try:
+            async for item in self.iter_fetch(params):
+                results.append(item)
+                if len(results) >= max_items:
+                    break
+            return results
         except Exception as e:
             logger.error(f"GitHub fetch failed: {e}")
-            return []
+            return results
 
     def get_authorization_url(self, state: Optional[str] = None) -> str:
         client_id = self.config.get("client_id")
@@ -120,5 +298,5 @@ class GitHubConnector(OAuthConnector):
             "code": code,
             "redirect_uri": self.config.get("redirect_uri")
         }
-        resp = requests.post("https://github.com/login/oauth/access_token", headers={"Accept": "application/json"}, data=data)
+        resp = await self._request("POST", "https://github.com/login/oauth/access_token", headers={"Accept": "application/json"}, data=data, max_retries=0)
         return resp.json()
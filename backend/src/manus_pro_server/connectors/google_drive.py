@@ -2,19 +2,56 @@
 # Google Drive Connector - موصل جوجل درايف (مُنفّذ بالكامل)
 # ═══════════════════════════════════════════════════════════════════════════════
 
+import asyncio
 import logging
+import mimetypes
+import os
+from typing import List, Dict, Any, Optional, Callable, BinaryIO, Iterator
+
 import requests
-from typing import List, Dict, Any, Optional
 
 from .base import OAuthConnector, ConnectorCapability
 
 logger = logging.getLogger(__name__)
 
+UPLOAD_URL = "https://www.googleapis.com/upload/drive/v3/files"
+SYNC_FILE_FIELDS = "id,name,mimeType,modifiedTime,md5Checksum,size,parents,trashed"
+
+# Drive يشترط أن يكون حجم الجزء من مضاعفات 256 KiB
+CHUNK_ALIGNMENT = 256 * 1024
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+# on_progress(bytes_done, bytes_total)
+ProgressCallback = Callable[[int, Optional[int]], None]
+
+def _align_chunk_size(chunk_size: int) -> int:
+    return max(CHUNK_ALIGNMENT, (int(chunk_size) // CHUNK_ALIGNMENT) * CHUNK_ALIGNMENT)
+
+def _committed_offset(resp: requests.Response) -> int:
+    """الإزاحة التالية من ترويسة Range في استجابة 308 (bytes=0-N)."""
+    committed = resp.headers.get("Range")
+    return int(committed.rsplit("-", 1)[1]) + 1 if committed else 0
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _write_next_chunk(chunks: Iterator[bytes], f: BinaryIO) -> Optional[int]:
+    """قراءة الجزء التالي من الاستجابة وكتابته (تُنفّذ في خيط منفصل)."""
+    for chunk in chunks:
+        if chunk:
+            f.write(chunk)
+            return len(chunk)
+    return None
+
 class GoogleDriveConnector(OAuthConnector):
     """
     موصل جوجل درايف باستخدام Google Drive API v3.
     يوفر إدارة الملفات، الرفع، التنزيل، والبحث.
     """
+    token_url = "https://oauth2.googleapis.com/token"
     
     def __init__(self, connector_id: str, name: str, config: Dict[str, Any]):
         super().__init__(
@@ -33,11 +70,13 @@ class GoogleDriveConnector(OAuthConnector):
         )
         self.base_url = "https://www.googleapis.com/drive/v3"
         self.headers = {"Authorization": f"Bearer {self.access_token}"}
+        self.chunk_size = int(config.get("chunk_size", DEFAULT_CHUNK_SIZE))
+        self.max_resume_attempts = int(config.get("max_resume_attempts", 5))
 
     async def connect(self) -> bool:
         """التحقق من صحة التوكن."""
         try:
-            resp = requests.get(f"{self.base_url}/about", headers=self.headers, params={"fields": "user"})
+            resp = await self._request("GET", f"{self.base_url}/about", headers=self.headers, params={"fields": "user"})
             return resp.status_code == 200
         except Exception as e:
             logger.error(f"GoogleDrive connection failed: {e}")
@@ -52,7 +91,7 @@ class GoogleDriveConnector(OAuthConnector):
         payload: { "name": "folder_name", "mimeType": "application/vnd.google-apps.folder" }
         """
         try:
-            resp = requests.post(f"{self.base_url}/files", headers=self.headers, json=payload)
+            resp = await self._request("POST", f"{self.base_url}/files", headers=self.headers, json=payload, max_retries=0)
             return resp.json()
         except Exception as e:
             logger.error(f"GoogleDrive send failed: {e}")
@@ -64,42 +103,252 @@ class GoogleDriveConnector(OAuthConnector):
         params: { "q": "name contains 'test'", "pageSize": 10 }
         """
         try:
-            resp = requests.get(f"{self.base_url}/files", headers=self.headers, params=params)
+            resp = await self._request("GET", f"{self.base_url}/files", headers=self.headers, params=params)
             return resp.json().get("files", [])
         except Exception as e:
             logger.error(f"GoogleDrive fetch failed: {e}")
             return []
 
+    async def sync(self, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        مزامنة تزايدية عبر changes.list.
+        بدون cursor: سرد كامل لكل الملفات مع startPageToken كمؤشر أساسي.
+        مع cursor (page token): جلب التغييرات منذ المؤشر فقط.
+        مؤشر منتهي أو غير صالح (400/404) أو رد بلا مؤشر تالٍ: مزامنة كاملة بمؤشر جديد.
+        """
+        if cursor is None:
+            resp = await self._request("GET", f"{self.base_url}/changes/startPageToken", headers=self.headers)
+            resp.raise_for_status()
+            start_token = resp.json()["startPageToken"]
+            
+            changes = []
+            params: Dict[str, Any] = {"pageSize": 1000, "fields": f"nextPageToken,files({SYNC_FILE_FIELDS})", "q": "trashed=false"}
+            while True:
+                resp = await self._request("GET", f"{self.base_url}/files", headers=self.headers, params=params)
+                resp.raise_for_status()
+                body = resp.json()
+                changes.extend({"id": f["id"], "removed": False, "item": f} for f in body.get("files", []))
+                if not body.get("nextPageToken"):
+                    break
+                params["pageToken"] = body["nextPageToken"]
+            return {"changes": changes, "cursor": start_token, "full": True}
+        
+        changes = []
+        page_token = cursor
+        while True:
+            resp = await self._request("GET", f"{self.base_url}/changes", headers=self.headers, params={
+                "pageToken": page_token,
+                "pageSize": 1000,
+                "includeRemoved": "true",
+                "fields": f"nextPageToken,newStartPageToken,changes(fileId,removed,file({SYNC_FILE_FIELDS}))",
+            })
+            if resp.status_code in (400, 404):
+                logger.warning(f"GoogleDrive page token rejected ({resp.status_code}); falling back to full sync")
+                return await self.sync(None)
+            resp.raise_for_status()
+            body = resp.json()
+            for change in body.get("changes", []):
+                item = change.get("file") or {}
+                changes.append({
+                    "id": change.get("fileId"),
+                    "removed": bool(change.get("removed") or item.get("trashed")),
+                    "item": item,
+                })
+            if body.get("newStartPageToken"):
+                return {"changes": changes, "cursor": body["newStartPageToken"], "full": False}
+            if not body.get("nextPageToken"):
+                logger.warning("GoogleDrive changes response has no page token; falling back to full sync")
+                return await self.sync(None)
+            page_token = body["nextPageToken"]
+
     async def upload(self, local_path: str, remote_path: str) -> bool:
-        """رفع ملف إلى جوجل درايف."""
+        """رفع ملف إلى جوجل درايف (جلسة رفع قابلة للاستئناف على أجزاء)."""
+        result = await self.upload_resumable(local_path, remote_path)
+        return result.get("success", False)
+
+    async def upload_resumable(
+        self,
+        local_path: str,
+        remote_path: str,
+        chunk_size: Optional[int] = None,
+        session_uri: Optional[str] = None,
+        on_progress: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """
+        رفع ملف بجلسة resumable على أجزاء ثابتة الحجم بذاكرة ثابتة.
+        
+        عند انقطاع جزء يُستعلم عن الإزاحة المحفوظة لدى الخادم ويُستأنف منها
+        (حتى max_resume_attempts مرة). يمكن تمرير session_uri لاستئناف جلسة سابقة.
+        
+        Returns:
+            { "success", "file" (بيانات الملف), "session_uri", "bytes_sent" }
+        """
+        chunk_size = _align_chunk_size(chunk_size or self.chunk_size)
+        total = os.path.getsize(local_path)
+        mime_type = mimetypes.guess_type(local_path)[0] or "application/octet-stream"
+        offset = 0
+        
         try:
-            metadata = {"name": remote_path}
-            files = {
-                "data": ("metadata", str(metadata), "application/json; charset=UTF-8"),
-                "file": open(local_path, "rb")
-            }
-            resp = requests.post(
-                "https://www.googleapis.com/upload/drive/v3/files?uploadType=multipart",
-                headers=self.headers,
-                files=files
-            )
-            return resp.status_code == 200
+            if session_uri:
+                offset = await self._query_upload_offset(session_uri, total)
+            else:
+                session_uri = await self._start_upload_session(remote_path, mime_type, total)
+            
+            resumes = 0
+            with open(local_path, "rb") as f:
+                while True:
+                    f.seek(offset)
+                    chunk = await asyncio.to_thread(f.read, chunk_size)
+                    end = offset + len(chunk) - 1
+                    headers = {
+                        **self.headers,
+                        "Content-Length": str(len(chunk)),
+                        "Content-Range": f"bytes {offset}-{end}/{total}" if chunk else f"bytes */{total}",
+                    }
+                    try:
+                        resp = await self._request(
+                            "PUT", session_uri, headers=headers, data=chunk,
+                            allow_redirects=False, max_retries=0,
+                        )
+                        if resp.status_code not in (200, 201, 308):
+                            resp.raise_for_status()
+                            raise requests.HTTPError(f"Unexpected status {resp.status_code}")
+                    except requests.RequestException as e:
+                        resumes += 1
+                        if resumes > self.max_resume_attempts:
+                            raise
+                        if isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code == 404:
+                            # الجلسة انتهت (أسبوع كحد أقصى): بدء جلسة جديدة من الصفر
+                            session_uri = await self._start_upload_session(remote_path, mime_type, total)
+                            offset = 0
+                        else:
+                            logger.warning(f"GoogleDrive chunk at {offset} failed ({e}); resuming")
+                            offset = await self._query_upload_offset(session_uri, total)
+                        continue
+                    
+                    if resp.status_code in (200, 201):
+                        if on_progress:
+                            on_progress(total, total)
+                        return {"success": True, "file": resp.json(), "session_uri": session_uri, "bytes_sent": total}
+                    
+                    offset = _committed_offset(resp)
+                    if on_progress:
+                        on_progress(offset, total)
         except Exception as e:
             logger.error(f"GoogleDrive upload failed: {e}")
-            return False
+            return {"success": False, "error": str(e), "session_uri": session_uri, "bytes_sent": offset}
+
+    async def _start_upload_session(self, name: str, mime_type: str, total: int) -> str:
+        """بدء جلسة رفع resumable وإرجاع رابط الجلسة."""
+        resp = await self._request(
+            "POST",
+            f"{UPLOAD_URL}?uploadType=resumable",
+            headers={
+                **self.headers,
+                "X-Upload-Content-Type": mime_type,
+                "X-Upload-Content-Length": str(total),
+            },
+            json={"name": name},
+        )
+        resp.raise_for_status()
+        return resp.headers["Location"]
+
+    async def _query_upload_offset(self, session_uri: str, total: int) -> int:
+        """الاستعلام عن عدد البايتات التي استلمها الخادم في الجلسة."""
+        resp = await self._request(
+            "PUT", session_uri,
+            headers={**self.headers, "Content-Length": "0", "Content-Range": f"bytes */{total}"},
+            allow_redirects=False,
+        )
+        if resp.status_code in (200, 201):
+            return total
+        if resp.status_code != 308:
+            resp.raise_for_status()
+        return _committed_offset(resp)
 
     async def download(self, remote_path: str, local_path: str) -> bool:
         """تنزيل ملف من جوجل درايف (remote_path هو file_id)."""
+        result = await self.download_stream(remote_path, local_path)
+        return result.get("success", False)
+
+    async def download_stream(
+        self,
+        file_id: str,
+        local_path: str,
+        chunk_size: Optional[int] = None,
+        on_progress: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """
+        تنزيل مُتدفق إلى القرص على أجزاء بذاكرة ثابتة.
+        
+        يُكتب إلى ملف مؤقت (.part) ثم يُنقل ذرّياً؛ وإذا وُجد ملف .part من محاولة
+        سابقة يُستأنف التنزيل عبر ترويسة Range مع If-Range بمُعرّف النسخة (ETag) المحفوظ
+        بجانبه، فإذا تغيّر الملف على الخادم يعيده كاملاً بدلاً من دمج نسختين.
+        """
+        chunk_size = chunk_size or self.chunk_size
+        part_path = f"{local_path}.part"
+        validator_path = f"{part_path}.etag"
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        validator = None
+        if offset and os.path.exists(validator_path):
+            with open(validator_path) as vf:
+                validator = vf.read().strip() or None
+        headers = dict(self.headers)
+        if offset and validator:
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = validator
+        else:
+            # جزء بلا مُعرّف نسخة لا يمكن التحقق من أنه من نفس الملف: تنزيل من البداية
+            offset = 0
+        
         try:
-            resp = requests.get(f"{self.base_url}/files/{remote_path}", headers=self.headers, params={"alt": "media"})
-            if resp.status_code == 200:
-                with open(local_path, "wb") as f:
-                    f.write(resp.content)
-                return True
-            return False
+            resp = await self._request(
+                "GET", f"{self.base_url}/files/{file_id}",
+                headers=headers, params={"alt": "media"}, stream=True,
+            )
+            try:
+                if resp.status_code == 416 and offset:
+                    # النطاق بعد نهاية الملف: الجزء مكتمل إذا طابق الحجم الكلي
+                    total = resp.headers.get("Content-Range", "").rpartition("/")[2]
+                    if total.isdigit() and int(total) == offset:
+                        os.replace(part_path, local_path)
+                        _remove_quietly(validator_path)
+                        return {"success": True, "path": local_path, "bytes": offset}
+                    # الملف تغيّر أو صغر: حذف الجزء والبدء من جديد
+                    _remove_quietly(part_path)
+                    _remove_quietly(validator_path)
+                    return await self.download_stream(file_id, local_path, chunk_size, on_progress)
+                if resp.status_code == 200:
+                    offset = 0  # الخادم تجاهل Range أو تغيّر الملف (If-Range): إعادة من البداية
+                    validator = resp.headers.get("ETag") or resp.headers.get("Last-Modified")
+                    if validator:
+                        with open(validator_path, "w") as vf:
+                            vf.write(validator)
+                    else:
+                        _remove_quietly(validator_path)
+                elif resp.status_code != 206:
+                    return {"success": False, "error": f"HTTP {resp.status_code}"}
+                
+                total = offset + int(resp.headers.get("Content-Length", 0)) or None
+                done = offset
+                chunks = resp.iter_content(chunk_size=chunk_size)
+                with open(part_path, "ab" if offset else "wb") as f:
+                    while True:
+                        written = await asyncio.to_thread(_write_next_chunk, chunks, f)
+                        if written is None:
+                            break
+                        done += written
+                        if on_progress:
+                            on_progress(done, total)
+            finally:
+                resp.close()
+            
+            os.replace(part_path, local_path)
+            _remove_quietly(validator_path)
+            return {"success": True, "path": local_path, "bytes": done}
         except Exception as e:
             logger.error(f"GoogleDrive download failed: {e}")
-            return False
+            return {"success": False, "error": str(e)}
 
     def get_authorization_url(self, state: Optional[str] = None) -> str:
         client_id = self.config.get("client_id")
@@ -115,5 +364,5 @@ class GoogleDriveConnector(OAuthConnector):
             "redirect_uri": self.config.get("redirect_uri"),
             "grant_type": "authorization_code"
         }
-        resp = requests.post("https://oauth2.googleapis.com/token", data=data)
+        resp = await self._request("POST", "https://oauth2.googleapis.com/token", data=data, max_retries=0)
         return resp.json()
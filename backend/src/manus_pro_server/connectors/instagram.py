@@ -3,7 +3,6 @@
 # ═══════════════════════════════════════════════════════════════════════════════
 
 import logging
-import requests
 from typing import List, Dict, Any, Optional
 from .base import OAuthConnector, ConnectorCapability
 
@@ -23,7 +22,7 @@ class InstagramConnector(OAuthConnector):
 
     async def connect(self) -> bool:
         try:
-            resp = requests.get(self.base_url, headers=self.headers)
+            resp = await self._request("GET", self.base_url, headers=self.headers)
             return resp.status_code == 200
         except Exception as e:
             logger.error(f"Instagram connection failed: {e}")
@@ -34,7 +33,7 @@ class InstagramConnector(OAuthConnector):
 
     async def send(self, payload: Dict[str, Any], attachments: Optional[List[str]] = None) -> Dict[str, Any]:
         try:
-            resp = requests.post(self.base_url, headers=self.headers, json=payload)
+            resp = await self._request("POST", self.base_url, headers=self.headers, json=payload)
             return resp.json()
         except Exception as e:
             logger.error(f"Instagram send failed: {e}")
@@ -42,7 +41,7 @@ class InstagramConnector(OAuthConnector):
 
     async def fetch(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
         try:
-            resp = requests.get(self.base_url, headers=self.headers, params=params)
+            resp = await self._request("GET", self.base_url, headers=self.headers, params=params)
             data = resp.json()
             return data if isinstance(data, list) else [data]
         except Exception as e:
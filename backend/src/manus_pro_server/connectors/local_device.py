@@ -2,16 +2,98 @@
 # Local Device Connector - موصل الجهاز المحلي (مُنفّذ بالكامل)
 # ═══════════════════════════════════════════════════════════════════════════════
 
+import asyncio
 import os
 import shutil
 import logging
-from typing import List, Dict, Any, Optional
+from fnmatch import fnmatchcase
+from typing import List, Dict, Any, Optional, Iterator, Tuple
 from pathlib import Path
 
 from .base import BaseConnector, ConnectorCapability, ConnectorAuthType
 
 logger = logging.getLogger(__name__)
 
+def _as_patterns(value: Any) -> List[str]:
+    if not value:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+def _matches(rel_path: str, name: str, patterns: List[str]) -> bool:
+    return any(fnmatchcase(rel_path, p) or fnmatchcase(name, p) for p in patterns)
+
+def _sorted_entries(dir_path: str) -> Iterator[os.DirEntry]:
+    try:
+        with os.scandir(dir_path) as it:
+            return iter(sorted(it, key=lambda e: e.name))
+    except OSError:
+        return iter(())
+
+def iter_directory(
+    root: str,
+    max_depth: Optional[int] = None,
+    include: Optional[List[str]] = None,
+    exclude: Optional[List[str]] = None,
+    cursor: Optional[str] = None,
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    مولّد كسول يمر على الشجرة بـ os.scandir بترتيب ثابت (DFS، أسماء مرتبة).
+    
+    - stat واحد لكل عنصر عبر ذاكرة DirEntry بدلاً من عدة استدعاءات.
+    - exclude يقص المجلدات المطابقة بالكامل؛ include يرشّح الملفات فقط.
+    - cursor (المسار النسبي لآخر عنصر مُعاد) يستأنف السرد بتخطي الفروع السابقة
+      دون المرور عليها.
+    - max_depth=0 يعني محتويات المجلد فقط (غير متكرر)، None بلا حد.
+    
+    Yields:
+        (المسار النسبي، بيانات العنصر)
+    """
+    include = include or []
+    exclude = exclude or []
+    cursor_parts = cursor.strip("/").split("/") if cursor else []
+    
+    # كل إطار: (عناصر المجلد المرتبة، المسار النسبي، العمق، بقية مكونات المؤشر على هذا الفرع)
+    stack: List[Tuple[Iterator[os.DirEntry], str, int, List[str]]] = [
+        (_sorted_entries(root), "", 0, cursor_parts)
+    ]
+    while stack:
+        entries, rel_dir, depth, resume = stack[-1]
+        entry = next(entries, None)
+        if entry is None:
+            stack.pop()
+            continue
+        
+        name = entry.name
+        on_cursor_path = bool(resume) and name == resume[0]
+        if resume and name < resume[0]:
+            continue
+        if resume and name > resume[0]:
+            # تجاوزنا فرع المؤشر: بقية هذا المجلد تُسرد بالكامل
+            stack[-1] = (entries, rel_dir, depth, [])
+        
+        rel_path = f"{rel_dir}/{name}" if rel_dir else name
+        if exclude and _matches(rel_path, name, exclude):
+            continue
+        try:
+            is_dir = entry.is_dir(follow_symlinks=False)
+            st = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        
+        # العنصر الواقع على مسار المؤشر أُعيد في صفحة سابقة
+        if not on_cursor_path and (is_dir or not include or _matches(rel_path, name, include)):
+            yield rel_path, {
+                "name": name,
+                "path": entry.path,
+                "type": "directory" if is_dir else "file",
+                "size": 0 if is_dir else st.st_size,
+                "modified": st.st_mtime
+            }
+        
+        if is_dir and (max_depth is None or depth < max_depth):
+            child_resume = resume[1:] if on_cursor_path else []
+            stack.append((_sorted_entries(entry.path), rel_path, depth + 1, child_resume))
+
 class LocalDeviceConnector(BaseConnector):
     """
     موصل للجهاز المحلي (Windows, Linux, Mac, Android, iOS).
@@ -85,39 +167,62 @@ class LocalDeviceConnector(BaseConnector):
     async def fetch(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
         """
         قراءة ملفات أو سرد مجلدات.
-        params: { "path": "relative/path", "recursive": false }
+        params: { "path": "relative/path", "recursive": false, "max_depth": null,
+                  "include": ["*.py"], "exclude": ["node_modules"], "limit": null, "cursor": null }
         """
-        search_path = self.root_path / params.get("path", "")
-        recursive = params.get("recursive", False)
+        page = await self.fetch_page(params)
+        return page["items"]
+
+    async def fetch_page(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        نفس fetch مع ترقيم الصفحات بالمؤشر.
         
+        Returns:
+            { "items": [...], "next_cursor": المسار النسبي لآخر عنصر أو None إذا انتهى السرد }
+        """
+        search_path = self.root_path / params.get("path", "")
         try:
             if not search_path.exists():
-                return []
-            
-            results = []
+                return {"items": [], "next_cursor": None}
             if search_path.is_file():
                 with open(search_path, "r", encoding="utf-8", errors="ignore") as f:
-                    results.append({
+                    item = {
                         "name": search_path.name,
                         "path": str(search_path),
                         "type": "file",
                         "content": f.read(10000), # أول 10 كيلو بايت
                         "size": search_path.stat().st_size
-                    })
-            else:
-                pattern = "**/*" if recursive else "*"
-                for p in search_path.glob(pattern):
-                    results.append({
-                        "name": p.name,
-                        "path": str(p),
-                        "type": "file" if p.is_file() else "directory",
-                        "size": p.stat().st_size if p.is_file() else 0,
-                        "modified": p.stat().st_mtime
-                    })
-            return results
+                    }
+                return {"items": [item], "next_cursor": None}
+            return await asyncio.to_thread(self._collect_page, search_path, params)
         except Exception as e:
             logger.error(f"LocalDevice fetch failed: {e}")
-            return []
+            return {"items": [], "next_cursor": None}
+
+    def _collect_page(self, search_path: Path, params: Dict[str, Any]) -> Dict[str, Any]:
+        limit = params.get("limit")
+        max_depth = params.get("max_depth")
+        if max_depth is None:
+            max_depth = None if params.get("recursive", False) else 0
+        walker = iter_directory(
+            str(search_path),
+            max_depth=max_depth,
+            include=_as_patterns(params.get("include")),
+            exclude=_as_patterns(params.get("exclude")),
+            cursor=params.get("cursor"),
+        )
+        items: List[Dict[str, Any]] = []
+        rel_path = None
+        for rel_path, item in walker:
+            items.append(item)
+            if limit is not None and len(items) >= int(limit):
+                # هل يوجد عنصر تالٍ؟ (لتجنب صفحة أخيرة فارغة)
+                if next(walker, None) is None:
+                    rel_path = None
+                break
+        else:
+            rel_path = None
+        return {"items": items, "next_cursor": rel_path}
 
     async def upload(self, local_path: str, remote_path: str) -> bool:
         """نسخ ملف من مكان آخر إلى مساحة العمل."""
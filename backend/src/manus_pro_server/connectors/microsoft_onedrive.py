@@ -3,19 +3,20 @@
 # ═══════════════════════════════════════════════════════════════════════════════
 
 import logging
-import requests
 from typing import List, Dict, Any, Optional
 from .base import OAuthConnector, ConnectorCapability
 
 logger = logging.getLogger(__name__)
 
 class MicrosoftOnedriveConnector(OAuthConnector):
+    token_url = "https://login.microsoftonline.com/common/oauth2/v2.0/token"
+
     def __init__(self, connector_id: str, name: str, config: Dict[str, Any]):
         super().__init__(
             connector_id=connector_id,
             name=name,
             connector_type="microsoft_onedrive",
-            capabilities=[ConnectorCapability.READ, ConnectorCapability.WRITE, ConnectorCapability.SEARCH],
+            capabilities=[ConnectorCapability.READ, ConnectorCapability.WRITE, ConnectorCapability.SEARCH, ConnectorCapability.SYNC],
             config=config
         )
         self.base_url = "https://graph.microsoft.com/v1.0/me/drive"
@@ -23,7 +24,7 @@ class MicrosoftOnedriveConnector(OAuthConnector):
 
     async def connect(self) -> bool:
         try:
-            resp = requests.get(self.base_url, headers=self.headers)
+            resp = await self._request("GET", self.base_url, headers=self.headers)
             return resp.status_code == 200
         except Exception as e:
             logger.error(f"MicrosoftOnedrive connection failed: {e}")
@@ -34,7 +35,7 @@ class MicrosoftOnedriveConnector(OAuthConnector):
 
     async def send(self, payload: Dict[str, Any], attachments: Optional[List[str]] = None) -> Dict[str, Any]:
         try:
-            resp = requests.post(self.base_url, headers=self.headers, json=payload)
+            resp = await self._request("POST", self.base_url, headers=self.headers, json=payload)
             return resp.json()
         except Exception as e:
             logger.error(f"MicrosoftOnedrive send failed: {e}")
@@ -42,13 +43,34 @@ class MicrosoftOnedriveConnector(OAuthConnector):
 
     async def fetch(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
         try:
-            resp = requests.get(self.base_url, headers=self.headers, params=params)
+            resp = await self._request("GET", self.base_url, headers=self.headers, params=params)
             data = resp.json()
             return data if isinstance(data, list) else [data]
         except Exception as e:
             logger.error(f"MicrosoftOnedrive fetch failed: {e}")
             return []
 
+    async def sync(self, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        مزامنة تزايدية عبر delta query.
+        cursor هو @odata.deltaLink من المزامنة السابقة؛ بدونه تُعيد delta كل العناصر.
+        """
+        url = cursor or f"{self.base_url}/root/delta"
+        changes = []
+        while True:
+            resp = await self._request("GET", url, headers=self.headers)
+            if resp.status_code == 410 and cursor:
+                # انتهت صلاحية الـ delta token: مزامنة كاملة من جديد
+                return await self.sync(None)
+            resp.raise_for_status()
+            body = resp.json()
+            for item in body.get("value", []):
+                changes.append({"id": item.get("id"), "removed": "deleted" in item, "item": item})
+            if body.get("@odata.nextLink"):
+                url = body["@odata.nextLink"]
+                continue
+            return {"changes": changes, "cursor": body.get("@odata.deltaLink"), "full": cursor is None}
+
     def get_authorization_url(self, state: Optional[str] = None) -> str:
         client_id = self.config.get("client_id")
         redirect_uri = self.config.get("redirect_uri")
@@ -2,8 +2,8 @@
 # Telegram Connector - موصل تيلجرام (مُنفّذ بالكامل)
 # ═══════════════════════════════════════════════════════════════════════════════
 
+import json
 import logging
-import requests
 from typing import List, Dict, Any, Optional
 
 from .base import BaseConnector, ConnectorCapability, ConnectorAuthType
@@ -37,7 +37,7 @@ class TelegramConnector(BaseConnector):
     async def connect(self) -> bool:
         """التحقق من صحة التوكن."""
         try:
-            response = requests.get(f"{self.base_url}/getMe")
+            response = await self._request("GET", f"{self.base_url}/getMe")
             return response.status_code == 200
         except Exception as e:
             logger.error(f"Telegram connection failed: {e}")
@@ -59,7 +59,7 @@ class TelegramConnector(BaseConnector):
             
             # إرسال النص
             if text:
-                resp = requests.post(f"{self.base_url}/sendMessage", json={
+                resp = await self._request("POST", f"{self.base_url}/sendMessage", max_retries=0, json={
                     "chat_id": chat_id,
                     "text": text,
                     "parse_mode": "HTML"
@@ -70,7 +70,7 @@ class TelegramConnector(BaseConnector):
             if attachments:
                 for file_path in attachments:
                     with open(file_path, "rb") as f:
-                        resp = requests.post(f"{self.base_url}/sendDocument", data={
+                        resp = await self._request("POST", f"{self.base_url}/sendDocument", max_retries=0, data={
                             "chat_id": chat_id
                         }, files={
                             "document": f
@@ -82,32 +82,52 @@ class TelegramConnector(BaseConnector):
             logger.error(f"Telegram send failed: {e}")
             return {"success": False, "error": str(e)}
 
+    async def get_updates(
+        self,
+        offset: int = 0,
+        limit: int = 100,
+        timeout: int = 0,
+        allowed_updates: Optional[List[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        استدعاء getUpdates (long polling عندما timeout > 0).
+        يُرجع التحديثات الخام كما أرسلها Bot API.
+        """
+        params: Dict[str, Any] = {"offset": offset, "limit": limit, "timeout": timeout}
+        if allowed_updates is not None:
+            params["allowed_updates"] = json.dumps(allowed_updates)
+        # مهلة HTTP يجب أن تتجاوز مهلة الـ long poll
+        resp = await self._request("GET", f"{self.base_url}/getUpdates", params=params, timeout=timeout + 10)
+        body = resp.json()
+        if not body.get("ok", True):
+            raise RuntimeError(body.get("description", "getUpdates failed"))
+        return body.get("result", [])
+
+    @staticmethod
+    def normalize_update(update: Dict[str, Any]) -> Dict[str, Any]:
+        """تحويل تحديث Bot API إلى الشكل المبسّط المستخدم في النظام."""
+        msg = update.get("message") or update.get("edited_message") or update.get("channel_post") or {}
+        return {
+            "update_id": update.get("update_id"),
+            "from": msg.get("from", {}).get("username"),
+            "from_id": msg.get("from", {}).get("id"),
+            "text": msg.get("text"),
+            "date": msg.get("date"),
+            "chat_id": msg.get("chat", {}).get("id")
+        }
+
     async def fetch(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
         """
         جلب آخر الرسائل (Updates).
-        params: { "offset": 0, "limit": 10 }
+        params: { "offset": 0, "limit": 10, "timeout": 0 }
         """
-        offset = params.get("offset", 0)
-        limit = params.get("limit", 10)
-        
         try:
-            resp = requests.get(f"{self.base_url}/getUpdates", params={
-                "offset": offset,
-                "limit": limit
-            })
-            updates = resp.json().get("result", [])
-            
-            results = []
-            for update in updates:
-                msg = update.get("message", {})
-                results.append({
-                    "update_id": update.get("update_id"),
-                    "from": msg.get("from", {}).get("username"),
-                    "text": msg.get("text"),
-                    "date": msg.get("date"),
-                    "chat_id": msg.get("chat", {}).get("id")
-                })
-            return results
+            updates = await self.get_updates(
+                offset=params.get("offset", 0),
+                limit=params.get("limit", 10),
+                timeout=params.get("timeout", 0),
+            )
+            return [self.normalize_update(update) for update in updates]
         except Exception as e:
             logger.error(f"Telegram fetch failed: {e}")
             return []
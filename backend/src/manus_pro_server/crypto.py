@@ -3,19 +3,29 @@
 # - يدير توليد وتخزين مفتاح التشفير الرئيسي بشكل آمن.
 # - يضمن أذونات ملفات صارمة (0o600) لحماية المفاتيح على القرص.
 # - يوفر وظائف بسيطة وآمنة لتشفير وفك تشفير النصوص (مثل مفاتيح API).
+# - يدعم تدوير المفاتيح دون توقف (MultiFernet): المفتاح الأول للتشفير، والبقية لفك التشفير فقط.
 # - مصمم ليكون تنفيذياً بنسبة 100% وجاهزاً للإنتاج الفعلي في ديسمبر 2025.
 
 from __future__ import annotations
+import hashlib
 import os
+import threading
+import time
 from pathlib import Path
-from typing import Optional
-from cryptography.fernet import Fernet
+from typing import List, Optional
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
 from .config import FERNET_KEY_PATH
 from .logging_config import get_logger
 
 logger = get_logger(__name__)
 
-_FERNET: Optional[Fernet] = None
+_FERNET: Optional[MultiFernet] = None
+_PRIMARY: Optional[Fernet] = None
+_PRIMARY_KEY_ID: Optional[str] = None
+_KEY_LOCK = threading.Lock()
+_KEY_MTIME_NS: Optional[int] = None
+_KEY_CHECKED_AT = 0.0
+KEY_RECHECK_INTERVAL_SEC = 1.0  # أقصى تأخير لالتقاط مفتاح أساسي دوّرته عملية أخرى
 
 def _ensure_file_permissions(path: Path) -> None:
     """تأمين الملف بأذونات صارمة (للمالك فقط)."""
@@ -24,26 +34,126 @@ def _ensure_file_permissions(path: Path) -> None:
     except Exception as e:
         logger.warning(f"Could not set strict permissions on {path}: {e}")
 
-def load_or_create_fernet() -> Fernet:
-    """تحميل مفتاح التشفير من القرص أو إنشاء مفتاح جديد إذا لم يوجد."""
+def _write_keys(path: Path, keys: List[bytes]) -> None:
+    """كتابة ذرية لملف المفاتيح (مفتاح في كل سطر، الأول هو الأساسي)."""
+    tmp = path.with_name(path.name + ".tmp")
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(b"\n".join(keys) + b"\n")
+    os.replace(tmp, path)
+    _ensure_file_permissions(path)
+
+def load_keys() -> List[bytes]:
+    """قراءة مفاتيح Fernet من القرص (إنشاء مفتاح جديد إذا لم يوجد الملف)."""
     path = FERNET_KEY_PATH
     if not path.exists():
         path.parent.mkdir(parents=True, exist_ok=True)
-        key = Fernet.generate_key()
-        path.write_bytes(key)
-        _ensure_file_permissions(path)
+        _write_keys(path, [Fernet.generate_key()])
         logger.info(f"New encryption key generated and secured at {path}")
     else:
         _ensure_file_permissions(path)
-    return Fernet(path.read_bytes())
+    return [line.strip() for line in path.read_bytes().splitlines() if line.strip()]
+
+def load_or_create_fernet() -> MultiFernet:
+    """تحميل مفاتيح التشفير من القرص كـ MultiFernet (المفتاح الأول للتشفير)."""
+    return MultiFernet([Fernet(k) for k in load_keys()])
+
+def _key_file_mtime() -> Optional[int]:
+    try:
+        return FERNET_KEY_PATH.stat().st_mtime_ns
+    except OSError:
+        return None
 
-def get_key() -> Fernet:
-    """تحميل أو إنشاء مفتاح Fernet وضمان تهيئة الكائن العام."""
-    global _FERNET
+def get_key() -> MultiFernet:
+    """
+    تحميل أو إنشاء مفاتيح Fernet وضمان تهيئة الكائن العام.
+    يُعاد التحميل إذا تغيّر ملف المفاتيح (فحص stat مرة كل KEY_RECHECK_INTERVAL_SEC على الأكثر)،
+    فتبدأ كل العمليات بالتشفير بالمفتاح الأساسي الجديد بعد التدوير.
+    """
+    global _KEY_CHECKED_AT
     if _FERNET is None:
-        _FERNET = load_or_create_fernet()
+        return reload_keys()
+    now = time.monotonic()
+    if now - _KEY_CHECKED_AT >= KEY_RECHECK_INTERVAL_SEC:
+        _KEY_CHECKED_AT = now
+        if _key_file_mtime() != _KEY_MTIME_NS:
+            return reload_keys()
     return _FERNET
 
+def reload_keys() -> MultiFernet:
+    """إعادة تحميل المفاتيح من القرص (بعد تدويرها من عملية أخرى)."""
+    global _FERNET, _PRIMARY, _PRIMARY_KEY_ID, _KEY_MTIME_NS, _KEY_CHECKED_AT
+    with _KEY_LOCK:
+        keys = load_keys()
+        fernets = [Fernet(k) for k in keys]
+        _FERNET, _PRIMARY = MultiFernet(fernets), fernets[0]
+        _PRIMARY_KEY_ID = hashlib.sha256(keys[0]).hexdigest()[:16]
+        _KEY_MTIME_NS = _key_file_mtime()
+        _KEY_CHECKED_AT = time.monotonic()
+    return _FERNET
+
+def rotate_key() -> int:
+    """
+    إضافة مفتاح أساسي جديد مع إبقاء المفاتيح القديمة لفك التشفير.
+    القيم الموجودة تبقى صالحة حتى تُعاد كتابتها بمهمة إعادة التشفير.
+
+    Returns:
+        عدد المفاتيح بعد التدوير
+    """
+    with _KEY_LOCK:
+        keys = [Fernet.generate_key()] + load_keys()
+        _write_keys(FERNET_KEY_PATH, keys)
+    reload_keys()
+    logger.info(f"Encryption key rotated; {len(keys)} keys active")
+    return len(keys)
+
+def retire_old_keys(expected_primary_id: Optional[str] = None) -> int:
+    """
+    إزالة كل المفاتيح عدا الأساسي. لا تتحقق من اكتمال إعادة التشفير:
+    استخدم key_rotation.retire_old_keys() التي تتحقق أولاً ثم تستدعي هذه الدالة.
+    المرفقات المشفرة تدفقياً (crypto_stream) تغلّف مفتاح بياناتها بالمفتاح الذي كان أساسياً
+    وقت رفعها، وتمر عليها key_rotation.reencrypt_objects قبل أن تسمح key_rotation بالحذف.
+
+    Args:
+        expected_primary_id: بصمة المفتاح الأساسي المتوقع؛ إن دوّرته عملية أخرى منذ التحقق يُرفض الحذف
+
+    Returns:
+        عدد المفاتيح المُزالة
+    """
+    with _KEY_LOCK:
+        keys = load_keys()
+        if expected_primary_id is not None and hashlib.sha256(keys[0]).hexdigest()[:16] != expected_primary_id:
+            raise RuntimeError("Primary key changed since re-encryption was verified; old keys kept")
+        _write_keys(FERNET_KEY_PATH, keys[:1])
+    reload_keys()
+    logger.info(f"Retired {len(keys) - 1} old encryption keys")
+    return len(keys) - 1
+
+def rotate_token(token: str) -> str:
+    """إعادة تشفير قيمة مشفرة بالمفتاح الأساسي الحالي (دون كشف النص الأصلي للمستدعي)."""
+    if not token: return token
+    token_bytes = token.encode("utf-8") if isinstance(token, str) else token
+    try:
+        return get_key().rotate(token_bytes).decode("utf-8")
+    except InvalidToken:
+        return reload_keys().rotate(token_bytes).decode("utf-8")
+
+def primary_key_id() -> str:
+    """بصمة قصيرة للمفتاح الأساسي (لربط نقاط تقدم إعادة التشفير بالمفتاح)."""
+    get_key()
+    return _PRIMARY_KEY_ID
+
+def is_primary(token: str) -> bool:
+    """هل القيمة مشفرة بالمفتاح الأساسي الحالي؟"""
+    if not token: return True
+    token_bytes = token.encode("utf-8") if isinstance(token, str) else token
+    get_key()
+    try:
+        _PRIMARY.decrypt(token_bytes)
+        return True
+    except InvalidToken:
+        return False
+
 def encrypt_str(value: str) -> str:
     """تشفير سلسلة نصية وإرجاعها كسلسلة نصية مشفرة (Base64)."""
     if not value: return ""
@@ -61,7 +171,11 @@ def decrypt_str(token: str) -> str:
     try:
         # دعم كل من str و bytes للمرونة
         token_bytes = token.encode("utf-8") if isinstance(token, str) else token
-        return f.decrypt(token_bytes).decode("utf-8")
+        try:
+            return f.decrypt(token_bytes).decode("utf-8")
+        except InvalidToken:
+            # ربما دُوّر المفتاح من عملية أخرى: إعادة تحميل المفاتيح مرة واحدة
+            return reload_keys().decrypt(token_bytes).decode("utf-8")
     except Exception as e:
         logger.error(f"Decryption failed: {e}")
         return "[DECRYPTION_FAILED]"
@@ -0,0 +1,253 @@
+# تشفير تدفقي للمرفقات الكبيرة (AES-256-GCM مقسّم إلى أجزاء):
+# - ذاكرة ثابتة مهما كان حجم الملف: يُشفّر ويُفك كل جزء على حدة.
+# - مفتاح بيانات عشوائي لكل ملف، مغلّف بمفاتيح Fernet من crypto (يُفك بأي مفتاح نشط بعد التدوير).
+# - nonce لكل جزء = بادئة عشوائية (7 بايت) + رقم الجزء (4 بايت) + علامة الجزء الأخير (1 بايت)،
+#   والترويسة كاملة بيانات مصادق عليها (AAD): أي تعديل أو إعادة ترتيب أو اقتطاع يُكتشف.
+# - حجم النص المشفر معروف مسبقاً من حجم الأصل (مطلوب لـ put_object دون تخزين مؤقت).
+# - بعد تدوير مفاتيح Fernet يُعاد تشفير الكائن كاملاً بمفتاح بيانات جديد (reencrypting_reader):
+#   الترويسة جزء من AAD كل جزء، فلا يكفي إعادة تغليف مفتاح البيانات وحده.
+#
+# الصيغة:
+#   MAGIC(4) | VERSION(1) | chunk_size(u32) | len(wrapped_key)(u16) | wrapped_key | nonce_prefix(7)
+#   ثم لكل جزء: ciphertext(len <= chunk_size) | tag(16)؛ آخر جزء دائماً أقصر من chunk_size (قد يكون فارغاً).
+
+from __future__ import annotations
+
+import os
+import struct
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from . import crypto
+from .logging_config import get_logger
+
+logger = get_logger(__name__)
+
+MAGIC = b"MKHE"
+VERSION = 1
+DEFAULT_CHUNK_SIZE = 64 * 1024
+TAG_SIZE = 16
+NONCE_PREFIX_SIZE = 7
+ENCRYPTION_SCHEME = "aes256gcm-stream-v1"
+_FIXED_HEADER = struct.Struct(">4sBIH")
+
+class StreamDecryptionError(ValueError):
+    """فشل فك التشفير: ترويسة غير صالحة أو محتوى معدّل أو مقتطع."""
+
+def _nonce(prefix: bytes, index: int, last: bool) -> bytes:
+    return prefix + struct.pack(">IB", index, 1 if last else 0)
+
+def _read_exact(src: BinaryIO, size: int) -> bytes:
+    """قراءة size بايت بالضبط (المصادر الشبكية قد تعيد أقل في كل استدعاء) أو أقل عند النهاية."""
+    buf = bytearray()
+    while len(buf) < size:
+        part = src.read(size - len(buf))
+        if not part:
+            break
+        buf += part
+    return bytes(buf)
+
+def ciphertext_size(plaintext_size: int, header_size: int, chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """حجم الناتج المشفر لأصل بحجم plaintext_size."""
+    return header_size + plaintext_size + (plaintext_size // chunk_size + 1) * TAG_SIZE
+
+def plaintext_size(total_size: int, header_size: int, chunk_size: int) -> int:
+    """عكس ciphertext_size: حجم الأصل من حجم الناتج المشفر."""
+    body = total_size - header_size - TAG_SIZE
+    if body < 0:
+        raise StreamDecryptionError("المحتوى المشفر مقتطع")
+    full_chunks, last = divmod(body, chunk_size + TAG_SIZE)
+    if last >= chunk_size:
+        raise StreamDecryptionError("حجم المحتوى المشفر غير متسق")
+    return full_chunks * chunk_size + last
+
+def is_encrypted(head: bytes) -> bool:
+    """هل تبدأ البيانات بترويسة هذه الصيغة؟"""
+    return head[:len(MAGIC)] == MAGIC
+
+class StreamEncryptor:
+    """
+    تشفير تدفق واحد. الترويسة جاهزة عند الإنشاء (لمعرفة الحجم النهائي قبل البدء)،
+    ثم تُنتج iter_encrypt الأجزاء المشفرة تباعاً.
+    """
+
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        if not 0 < chunk_size < 2 ** 32:
+            raise ValueError("chunk_size غير صالح")
+        self.chunk_size = chunk_size
+        key = AESGCM.generate_key(bit_length=256)
+        self._aead = AESGCM(key)
+        self._prefix = os.urandom(NONCE_PREFIX_SIZE)
+        wrapped = crypto.get_key().encrypt(key)
+        self.header = _FIXED_HEADER.pack(MAGIC, VERSION, chunk_size, len(wrapped)) + wrapped + self._prefix
+
+    def output_size(self, plaintext_size: int) -> int:
+        return ciphertext_size(plaintext_size, len(self.header), self.chunk_size)
+
+    def iter_encrypt(self, src: BinaryIO) -> Iterator[bytes]:
+        """الترويسة ثم الأجزاء المشفرة؛ القراءة المسبقة لجزء واحد تحدد الجزء الأخير."""
+        yield self.header
+        index = 0
+        chunk = _read_exact(src, self.chunk_size)
+        while True:
+            # الجزء الكامل لا يكون الأخير أبداً: بعده جزء أقصر أو فارغ
+            last = len(chunk) < self.chunk_size
+            nxt = b"" if last else _read_exact(src, self.chunk_size)
+            yield self._aead.encrypt(_nonce(self._prefix, index, last), chunk, self.header)
+            if last:
+                return
+            index += 1
+            chunk = nxt
+
+def encrypt_stream(src: BinaryIO, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    """تشفير تدفق مقروء إلى أجزاء مشفرة (ذاكرة ثابتة)."""
+    return StreamEncryptor(chunk_size).iter_encrypt(src)
+
+def _read_header(src: BinaryIO) -> Tuple[bytes, int, bytes]:
+    """قراءة الترويسة والتحقق منها؛ يعيد (الترويسة كاملة، chunk_size، مفتاح البيانات المغلّف)."""
+    fixed = _read_exact(src, _FIXED_HEADER.size)
+    if len(fixed) < _FIXED_HEADER.size:
+        raise StreamDecryptionError("ترويسة التشفير مقتطعة")
+    magic, version, chunk_size, wrapped_len = _FIXED_HEADER.unpack(fixed)
+    if magic != MAGIC or version != VERSION or chunk_size == 0:
+        raise StreamDecryptionError("صيغة تشفير غير مدعومة")
+    wrapped = _read_exact(src, wrapped_len)
+    prefix = _read_exact(src, NONCE_PREFIX_SIZE)
+    if len(wrapped) < wrapped_len or len(prefix) < NONCE_PREFIX_SIZE:
+        raise StreamDecryptionError("ترويسة التشفير مقتطعة")
+    return fixed + wrapped + prefix, chunk_size, wrapped
+
+def decrypt_stream(src: BinaryIO) -> Iterator[bytes]:
+    """
+    فك تشفير تدفق بهذه الصيغة وإنتاج النص الأصلي جزءاً جزءاً.
+
+    Raises:
+        StreamDecryptionError: عند أي تعديل أو اقتطاع أو مفتاح غير معروف
+    """
+    header, chunk_size, wrapped = _read_header(src)
+    prefix = header[-NONCE_PREFIX_SIZE:]
+    try:
+        key = crypto.get_key().decrypt(wrapped)
+    except Exception:
+        try:
+            key = crypto.reload_keys().decrypt(wrapped)
+        except Exception:
+            raise StreamDecryptionError("مفتاح البيانات غير قابل للفك بأي مفتاح متاح")
+    aead = AESGCM(key)
+
+    block_size = chunk_size + TAG_SIZE
+    index = 0
+    block = _read_exact(src, block_size)
+    while True:
+        last = len(block) < block_size
+        nxt = b"" if last else _read_exact(src, block_size)
+        if not last and not nxt:
+            # جزء كامل بلا لاحق: الأخير مفقود (اقتطاع)
+            raise StreamDecryptionError("المحتوى المشفر مقتطع")
+        try:
+            yield aead.decrypt(_nonce(prefix, index, last), block, header)
+        except InvalidTag:
+            raise StreamDecryptionError(f"فشل التحقق من الجزء {index}: المحتوى معدّل أو مقتطع")
+        if last:
+            return
+        index += 1
+        block = nxt
+
+class _ChunkReader:
+    """غلاف قابل للقراءة (read) فوق مولّد أجزاء."""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._buffer = b""
+
+    def read(self, size: int = -1) -> bytes:
+        parts = [self._buffer]
+        have = len(self._buffer)
+        while size is None or size < 0 or have < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            parts.append(chunk)
+            have += len(chunk)
+        data = b"".join(parts)
+        if size is None or size < 0:
+            self._buffer = b""
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+class EncryptingReader(_ChunkReader):
+    """
+    يُشفّر المصدر أثناء القراءة، لتمريره مباشرة إلى واجهات تتوقع ملفاً
+    وحجماً معروفاً مسبقاً مثل Minio.put_object.
+    """
+
+    def __init__(self, src: BinaryIO, plaintext_size: int, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        encryptor = StreamEncryptor(chunk_size)
+        super().__init__(encryptor.iter_encrypt(src))
+        self.size = encryptor.output_size(plaintext_size)
+
+class DecryptingReader(_ChunkReader):
+    """يفك تشفير المصدر أثناء القراءة."""
+
+    def __init__(self, src: BinaryIO):
+        super().__init__(decrypt_stream(src))
+
+def _iter_with_head(head: bytes, src: BinaryIO, block_size: int) -> Iterator[bytes]:
+    """إعادة ما قُرئ مسبقاً من التدفق ثم بقيته."""
+    yield head
+    while True:
+        block = src.read(block_size)
+        if not block:
+            return
+        yield block
+
+def reencrypting_reader(src: BinaryIO, total_size: int) -> Optional[EncryptingReader]:
+    """
+    قارئ يعيد تشفير كائن مشفر بمفتاح بيانات جديد مغلّف بالمفتاح الأساسي الحالي (بعد التدوير)،
+    بذاكرة ثابتة وبنفس حجم الجزء. يعيد None إن كان مفتاح البيانات مغلّفاً بالأساسي أصلاً.
+
+    Args:
+        src: تدفق الكائن المشفر من بدايته
+        total_size: حجم الكائن المشفر
+    """
+    header, chunk_size, wrapped = _read_header(src)
+    if crypto.is_primary(wrapped):
+        return None
+    size = plaintext_size(total_size, len(header), chunk_size)
+    original = _ChunkReader(_iter_with_head(header, src, chunk_size + TAG_SIZE))
+    return EncryptingReader(DecryptingReader(original), size, chunk_size)
+
+def encrypt_file(src_path: str, dst_path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """تشفير ملف إلى ملف آخر؛ يعيد حجم الناتج."""
+    written = 0
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        for part in encrypt_stream(src, chunk_size):
+            dst.write(part)
+            written += len(part)
+    return written
+
+def decrypt_file(src_path: str, dst_path: str) -> int:
+    """
+    فك تشفير ملف إلى ملف آخر عبر ملف مؤقت، فلا يظهر ناتج جزئي عند فشل التحقق.
+
+    Returns:
+        حجم الأصل
+    """
+    tmp = f"{dst_path}.part"
+    written = 0
+    try:
+        with open(src_path, "rb") as src, open(tmp, "wb") as dst:
+            for part in decrypt_stream(src):
+                dst.write(part)
+                written += len(part)
+        os.replace(tmp, dst_path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return written
@@ -1,5 +1,7 @@
 # طبقة إدارة قاعدة البيانات لنظام mkh_Manus:
 # - يستخدم SQLite مع تفعيل وضع WAL (Write-Ahead Logging) للأداء العالي.
+# - أو PostgreSQL عبر مجمّع asyncpg (MANUS_PRO_DB_BACKEND=postgres) لتشغيل عدة عقد على نفس الحالة؛
+#   نفس الاستعلامات تُترجم في db_postgres فيبقى سلوك db.* واحداً في الخلفيتين.
 # - يدير جداول المهام (Tasks)، الأحداث (Events)، والإعدادات (Settings).
 # - يتضمن آليات لمعالجة التزامن ومنع القفل (Locking).
 # - يوفر وظائف آمنة لتخزين واسترجاع البيانات الحساسة المشفرة.
@@ -7,19 +9,25 @@
 
 from __future__ import annotations
 import sqlite3
+import threading
 import time
 from contextlib import contextmanager
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 import orjson
-from .config import DB_PATH
+from .config import DB_BACKEND, DB_PATH, TASK_CLAIM_LEASE_SEC
 from . import crypto
+from .db_postgres import PostgresDatabase
 from .logging_config import get_logger
 
 logger = get_logger(__name__)
 
 def _now_iso() -> str:
     """الحصول على الوقت الحالي بتنسيق ISO 8601."""
-    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    return _iso_at(time.time())
+
+def _iso_at(ts: float) -> str:
+    """وقت epoch بنفس تنسيق ISO المخزّن (قابل للمقارنة نصياً)."""
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts))
 
 def _get_db_connection() -> sqlite3.Connection:
     """إنشاء اتصال بقاعدة البيانات مهيأ للإنتاج والتزامن العالي."""
@@ -32,9 +40,43 @@ def _get_db_connection() -> sqlite3.Connection:
     c.execute("PRAGMA busy_timeout = 5000;") # ✅ إضافة مهلة الانتظار المطلوبة
     return c
 
+# خلفية PostgreSQL النشطة (None = SQLite)
+_postgres: Optional[PostgresDatabase] = None
+
+def configure_backend(backend: str = DB_BACKEND, **options: Any) -> None:
+    """
+    اختيار خلفية التخزين ("sqlite" أو "postgres"). تُستدعى عند الاستيراد من الإعدادات،
+    ويمكن استدعاؤها لاحقاً (مثل الاختبارات) مع options لـ PostgresDatabase (dsn, schema, ...).
+    """
+    global _postgres
+    backend = backend.lower()
+    if backend not in ("sqlite", "postgres"):
+        raise ValueError(f"Unknown database backend '{backend}'")
+    if _postgres is not None:
+        _postgres.close()
+    _postgres = PostgresDatabase(**options) if backend == "postgres" else None
+    settings_cache.invalidate()
+
+def backend_name() -> str:
+    return "sqlite" if _postgres is None else "postgres"
+
+def close() -> None:
+    """إغلاق مجمّع PostgreSQL عند إيقاف التطبيق (لا شيء لـ SQLite: اتصال لكل معاملة)."""
+    if _postgres is not None:
+        _postgres.close()
+    settings_cache.close()
+
 @contextmanager
 def conn() -> sqlite3.Connection:
     """مدير سياق للاتصال بقاعدة البيانات مع commit/rollback الصحيح."""
+    if _postgres is not None:
+        try:
+            with _postgres.connection() as c:
+                yield c
+        except Exception as e:
+            logger.error(f"Database transaction failed: {e}")
+            raise
+        return
     c = _get_db_connection()
     # تغيير isolation_level لتفعيل المعاملات اليدوية
     c.isolation_level = 'DEFERRED'
@@ -63,10 +105,17 @@ def init_db() -> None:
             -- جدول الإعدادات (مفاتيح API وغيرها)
             CREATE TABLE IF NOT EXISTS settings (
               key TEXT PRIMARY KEY,
-              value BLOB NOT NULL,
+              value TEXT NOT NULL,
               updated_at TEXT NOT NULL
             );
 
+            -- عدّاد أجيال الإعدادات (يُزاد مع كل set_setting لإبطال الذاكرة المؤقتة في كل العمليات)
+            CREATE TABLE IF NOT EXISTS settings_generation (
+              id INTEGER PRIMARY KEY CHECK (id = 1),
+              generation INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO settings_generation(id, generation) VALUES (1, 0);
+
             -- جدول المهام الرئيسية
             CREATE TABLE IF NOT EXISTS tasks (
               id TEXT PRIMARY KEY,
@@ -88,7 +137,9 @@ def init_db() -> None:
               token_output INTEGER NOT NULL DEFAULT 0,
               token_total INTEGER NOT NULL DEFAULT 0,
               token_budget INTEGER NOT NULL DEFAULT 1000000,
-              state_json BLOB NOT NULL
+              state_json BLOB NOT NULL,
+              claimed_by TEXT,
+              claimed_until TEXT
             );
 
             -- جدول الأحداث لتتبع التقدم التفصيلي
@@ -103,16 +154,229 @@ def init_db() -> None:
               FOREIGN KEY(task_id) REFERENCES tasks(id) ON DELETE CASCADE
             );
 
+            -- الموصلات المُعدّة (config_json مشفر)
+            CREATE TABLE IF NOT EXISTS connectors (
+              id TEXT PRIMARY KEY,
+              owner_id TEXT,
+              name TEXT NOT NULL,
+              type TEXT NOT NULL,
+              status TEXT NOT NULL DEFAULT 'pending_auth',
+              config_json TEXT,
+              created_at TEXT NOT NULL,
+              updated_at TEXT NOT NULL,
+              last_used_at TEXT
+            );
+
+            -- رموز OAuth المشفرة لكل موصل
+            CREATE TABLE IF NOT EXISTS oauth_tokens (
+              connector_id TEXT PRIMARY KEY,
+              access_token_encrypted TEXT NOT NULL,
+              refresh_token_encrypted TEXT,
+              expires_at TEXT,
+              created_at TEXT NOT NULL,
+              updated_at TEXT NOT NULL,
+              refresh_claimed_by TEXT,
+              refresh_claimed_until TEXT,
+              FOREIGN KEY(connector_id) REFERENCES connectors(id) ON DELETE CASCADE
+            );
+
+            -- مؤشرات المزامنة التزايدية للموصلات (page token / delta link)
+            CREATE TABLE IF NOT EXISTS connector_cursors (
+              connector_id TEXT NOT NULL,
+              name TEXT NOT NULL DEFAULT 'default',
+              cursor TEXT NOT NULL,
+              updated_at TEXT NOT NULL,
+              PRIMARY KEY (connector_id, name)
+            );
+
+            -- بصمات SHA-256 لملفات الـ Workspace المرفوعة (إزالة التكرار)
+            CREATE TABLE IF NOT EXISTS workspace_blobs (
+              sha256 TEXT PRIMARY KEY,
+              path TEXT NOT NULL,
+              size_bytes INTEGER NOT NULL,
+              mtime_ns INTEGER NOT NULL,
+              created_at TEXT NOT NULL
+            );
+
+            -- لقطات الـ Workspace لكل نقطة تفتيش (المحتوى في مخزن الكتل، القائمة في ملف manifest)
+            CREATE TABLE IF NOT EXISTS workspace_snapshots (
+              id TEXT PRIMARY KEY,
+              task_id TEXT,
+              parent_id TEXT,
+              root TEXT NOT NULL,
+              label TEXT,
+              file_count INTEGER NOT NULL,
+              total_bytes INTEGER NOT NULL,
+              new_bytes INTEGER NOT NULL,
+              created_at TEXT NOT NULL,
+              seq INTEGER
+            );
+
+            -- نقاط تقدم إعادة التشفير بعد تدوير المفتاح (لكل جدول، مرتبطة ببصمة المفتاح الأساسي)
+            CREATE TABLE IF NOT EXISTS key_rotation_progress (
+              table_name TEXT PRIMARY KEY,
+              key_id TEXT NOT NULL,
+              last_key TEXT,
+              scanned INTEGER NOT NULL,
+              rotated INTEGER NOT NULL,
+              completed INTEGER NOT NULL,
+              updated_at TEXT NOT NULL
+            );
+
+            -- المستخدمون (مطابق لنموذج User في db_models)
+            CREATE TABLE IF NOT EXISTS users (
+              id TEXT PRIMARY KEY,
+              username TEXT NOT NULL UNIQUE,
+              email TEXT NOT NULL UNIQUE,
+              hashed_password TEXT NOT NULL,
+              full_name TEXT,
+              is_active INTEGER NOT NULL DEFAULT 1,
+              is_admin INTEGER NOT NULL DEFAULT 0,
+              role TEXT NOT NULL DEFAULT 'user',
+              permission_overrides TEXT,
+              created_at TEXT NOT NULL,
+              updated_at TEXT NOT NULL,
+              last_login TEXT
+            );
+
+            -- مفاتيح API: تُخزّن البادئة (للعرض) وبصمة SHA-256 فقط، والبصمة فريدة للبحث المباشر
+            CREATE TABLE IF NOT EXISTS api_keys (
+              id TEXT PRIMARY KEY,
+              user_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+              name TEXT,
+              prefix TEXT NOT NULL,
+              key_hash TEXT NOT NULL UNIQUE,
+              created_at TEXT NOT NULL,
+              revoked_at TEXT
+            );
+
+            -- سجل التدقيق (يُكتب بدفعات من audit_writer)
+            CREATE TABLE IF NOT EXISTS audit_logs (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              user_id TEXT,
+              action TEXT NOT NULL,
+              resource_type TEXT NOT NULL,
+              resource_id TEXT,
+              details_json TEXT,
+              ip_address TEXT,
+              user_agent TEXT,
+              timestamp TEXT NOT NULL
+            );
+
             -- فهارس لتحسين سرعة الاستعلام
             CREATE INDEX IF NOT EXISTS idx_events_task_id_id ON events(task_id, id);
             CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status);
+            CREATE INDEX IF NOT EXISTS idx_oauth_tokens_expires_at ON oauth_tokens(expires_at);
+            CREATE INDEX IF NOT EXISTS idx_workspace_snapshots_task_id ON workspace_snapshots(task_id, created_at);
+            CREATE INDEX IF NOT EXISTS idx_api_keys_user_id ON api_keys(user_id);
+            CREATE INDEX IF NOT EXISTS idx_audit_logs_user_timestamp ON audit_logs(user_id, timestamp);
+            CREATE INDEX IF NOT EXISTS idx_audit_logs_action ON audit_logs(action);
             """
         )
-    logger.info(f"Database initialized and optimized at {DB_PATH}")
+        # أعمدة أُضيفت بعد إنشاء الجدول في قواعد بيانات قائمة
+        _ensure_columns(c, "users", {
+            "role": "TEXT NOT NULL DEFAULT 'user'",
+            "permission_overrides": "TEXT",
+        })
+        _ensure_columns(c, "tasks", {"claimed_by": "TEXT", "claimed_until": "TEXT"})
+        _ensure_columns(c, "oauth_tokens", {"refresh_claimed_by": "TEXT", "refresh_claimed_until": "TEXT"})
+        # ترتيب الإدراج الصريح للقطات: تسلسل في PostgreSQL، و MAX(seq)+1 داخل INSERT في SQLite
+        if _postgres is not None:
+            c.execute("CREATE SEQUENCE IF NOT EXISTS workspace_snapshots_seq")
+        _ensure_columns(c, "workspace_snapshots", {"seq": "INTEGER"})
+        backfill = "rowid" if _postgres is None else "nextval('workspace_snapshots_seq')"
+        c.execute(f"UPDATE workspace_snapshots SET seq={backfill} WHERE seq IS NULL")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_workspace_snapshots_seq ON workspace_snapshots(seq)")
+    logger.info(f"Database initialized and optimized ({backend_name()}: {DB_PATH if _postgres is None else _postgres.schema})")
+
+def _ensure_columns(c: sqlite3.Connection, table: str, columns: Dict[str, str]) -> None:
+    if _postgres is not None:
+        for name, ddl in columns.items():
+            c.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {name} {ddl}")
+        return
+    existing = {row["name"] for row in c.execute(f"PRAGMA table_info({table})")}
+    for name, ddl in columns.items():
+        if name not in existing:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}")
 
 # --- Settings Operations ---
+class SettingsCache:
+    """
+    ذاكرة مؤقتة للإعدادات بعد فك تشفيرها.
+
+    - set_setting في نفس العملية يبطلها فوراً.
+    - الكتابات من عمليات أخرى تُكتشف عبر PRAGMA data_version على اتصال دائم
+      (فحص في الذاكرة دون قراءة جداول)، ثم يُقرأ عدّاد settings_generation
+      فقط عند حدوث أي commit خارجي، فلا تُبطل كتابات المهام والأحداث الذاكرة.
+    - مع PostgreSQL لا يوجد data_version: يُقرأ العدّاد (صف واحد بالمفتاح الأساسي) في كل استدعاء،
+      ويبقى توفير فك التشفير وقراءة الإعدادات نفسها.
+    """
+
+    def __init__(self):
+        self._values: Dict[str, Optional[str]] = {}
+        self._generation: Optional[int] = None
+        self._data_version: Optional[int] = None
+        self._watch: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+
+    def _current_generation(self) -> Optional[int]:
+        if _postgres is not None:
+            with conn() as c:
+                row = c.execute("SELECT generation FROM settings_generation WHERE id=1").fetchone()
+            return None if row is None else int(row[0])
+        try:
+            if self._watch is None:
+                self._watch = sqlite3.connect(str(DB_PATH), timeout=60, check_same_thread=False, isolation_level=None)
+            data_version = self._watch.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._data_version and self._generation is not None:
+                return self._generation
+            row = self._watch.execute("SELECT generation FROM settings_generation WHERE id=1").fetchone()
+            self._data_version = data_version
+            return None if row is None else int(row[0])
+        except sqlite3.Error as e:
+            logger.warning(f"Settings cache disabled for this read: {e}")
+            self.close()
+            return None
+
+    def get_many(self, keys: List[str]) -> Dict[str, Optional[str]]:
+        with self._lock:
+            generation = self._current_generation()
+            if generation is None or generation != self._generation:
+                self._values.clear()
+                self._generation = generation
+            missing = [k for k in keys if k not in self._values]
+            if missing:
+                marks = ",".join("?" * len(missing))
+                with conn() as c:
+                    rows = c.execute(f"SELECT key, value FROM settings WHERE key IN ({marks})", missing).fetchall()
+                found = {r["key"]: crypto.decrypt_str(r["value"]) for r in rows}
+                for k in missing:
+                    self._values[k] = found.get(k)
+            return {k: self._values[k] for k in keys}
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._values.clear()
+            self._generation = None
+
+    def close(self) -> None:
+        with self._lock:
+            if self._watch is not None:
+                try:
+                    self._watch.close()
+                except Exception:
+                    pass
+            self._watch = None
+            self._data_version = None
+            self._generation = None
+
+settings_cache = SettingsCache()
+
+# الخلفية المختارة في الإعدادات (MANUS_PRO_DB_BACKEND)
+configure_backend()
+
 def set_setting(key: str, value: str) -> None:
-    """حفظ إعداد مع تشفير القيمة آلياً."""
+    """حفظ إعداد مع تشفير القيمة آلياً وزيادة عدّاد الأجيال في نفس المعاملة."""
     encrypted_value = crypto.encrypt_str(value)
     with conn() as c:
         c.execute(
@@ -120,13 +384,387 @@ def set_setting(key: str, value: str) -> None:
             "ON CONFLICT(key) DO UPDATE SET value=excluded.value, updated_at=excluded.updated_at",
             (key, encrypted_value, _now_iso()),
         )
+        c.execute("UPDATE settings_generation SET generation = generation + 1 WHERE id=1")
+    settings_cache.invalidate()
+
+def get_settings(keys: List[str]) -> Dict[str, Optional[str]]:
+    """استرجاع عدة إعدادات (مفكوكة التشفير) من الذاكرة المؤقتة أو باستعلام واحد."""
+    return settings_cache.get_many(list(keys))
 
 def get_setting(key: str) -> Optional[str]:
     """استرجاع إعداد مع فك التشفير آلياً."""
+    return settings_cache.get_many([key])[key]
+
+# --- Connector & OAuth Token Operations ---
+def get_connector_record(connector_id: str) -> Optional[Dict[str, Any]]:
+    """الحصول على سجل موصل مع فك تشفير إعداداته."""
+    with conn() as c:
+        row = c.execute("SELECT * FROM connectors WHERE id=?", (connector_id,)).fetchone()
+    if row is None: return None
+    d = dict(row)
+    d["config"] = orjson.loads(crypto.decrypt_str(d.pop("config_json"))) if d.get("config_json") else {}
+    return d
+
+def get_connector_version(connector_id: str) -> Optional[Tuple[str, Optional[str]]]:
+    """
+    بصمة خفيفة لحالة الموصل (توقيت آخر تعديل للسجل وللرموز) دون فك أي تشفير.
+    تُستخدم لإبطال النسخ المخزنة في سجل الموصلات.
+    """
+    with conn() as c:
+        row = c.execute(
+            "SELECT c.updated_at, t.updated_at FROM connectors c "
+            "LEFT JOIN oauth_tokens t ON t.connector_id = c.id WHERE c.id=?",
+            (connector_id,),
+        ).fetchone()
+    return None if row is None else (row[0], row[1])
+
+def upsert_connector(connector_id: str, name: str, connector_type: str, config: Dict[str, Any],
+                     status: str = "pending_auth", owner_id: Optional[str] = None) -> None:
+    """إنشاء أو تحديث موصل (الإعدادات تُخزّن مشفرة)."""
+    now = _now_iso()
+    config_enc = crypto.encrypt_str(orjson.dumps(config).decode())
+    with conn() as c:
+        c.execute(
+            "INSERT INTO connectors(id,owner_id,name,type,status,config_json,created_at,updated_at) VALUES(?,?,?,?,?,?,?,?) "
+            "ON CONFLICT(id) DO UPDATE SET name=excluded.name, type=excluded.type, status=excluded.status, "
+            "config_json=excluded.config_json, updated_at=excluded.updated_at",
+            (connector_id, owner_id, name, connector_type, status, config_enc, now, now),
+        )
+
+def get_oauth_token(connector_id: str) -> Optional[Dict[str, Any]]:
+    """الحصول على رموز OAuth لموصل بعد فك تشفيرها."""
+    with conn() as c:
+        row = c.execute("SELECT * FROM oauth_tokens WHERE connector_id=?", (connector_id,)).fetchone()
+    if row is None: return None
+    return {
+        "connector_id": row["connector_id"],
+        "access_token": crypto.decrypt_str(row["access_token_encrypted"]),
+        "refresh_token": crypto.decrypt_str(row["refresh_token_encrypted"]) if row["refresh_token_encrypted"] else None,
+        "expires_at": row["expires_at"],
+    }
+
+def save_oauth_token(connector_id: str, access_token: str, refresh_token: Optional[str], expires_at: Optional[str]) -> None:
+    """حفظ رموز OAuth مشفرة (يُبقي refresh_token السابق إذا لم يُرسل المزوّد واحداً جديداً)."""
+    now = _now_iso()
+    with conn() as c:
+        c.execute(
+            "INSERT INTO oauth_tokens(connector_id,access_token_encrypted,refresh_token_encrypted,expires_at,created_at,updated_at) "
+            "VALUES(?,?,?,?,?,?) ON CONFLICT(connector_id) DO UPDATE SET "
+            "access_token_encrypted=excluded.access_token_encrypted, "
+            "refresh_token_encrypted=COALESCE(excluded.refresh_token_encrypted, oauth_tokens.refresh_token_encrypted), "
+            "expires_at=excluded.expires_at, updated_at=excluded.updated_at",
+            (connector_id, crypto.encrypt_str(access_token),
+             crypto.encrypt_str(refresh_token) if refresh_token else None, expires_at, now, now),
+        )
+
+def claim_oauth_refresh(connector_id: str, owner: str, lease_sec: float) -> bool:
+    """
+    حجز حق تحديث رمز الموصل بين كل العمليات (True لمن حصل عليه).
+
+    مزوّدون مثل Microsoft يدوّرون refresh_token مع كل تحديث، فالتحديث المزدوج بنفس الرمز
+    ينتهي بـ invalid_grant للثاني؛ الحجز مؤقت فلا يبقى معلقاً إن توقفت العملية الحاجزة.
+    """
+    now = time.time()
+    with conn() as c:
+        return c.execute(
+            "UPDATE oauth_tokens SET refresh_claimed_by=?, refresh_claimed_until=? "
+            "WHERE connector_id=? AND (refresh_claimed_until IS NULL OR refresh_claimed_until<=?)",
+            (owner, _iso_at(now + lease_sec), connector_id, _iso_at(now)),
+        ).rowcount == 1
+
+def release_oauth_refresh(connector_id: str, owner: str) -> None:
+    with conn() as c:
+        c.execute(
+            "UPDATE oauth_tokens SET refresh_claimed_by=NULL, refresh_claimed_until=NULL "
+            "WHERE connector_id=? AND refresh_claimed_by=?",
+            (connector_id, owner),
+        )
+
+def list_expiring_tokens(before: str, limit: int = 1000) -> List[Dict[str, Any]]:
+    """
+    سرد الموصلات التي تنتهي رموزها قبل الوقت المحدد (تستخدم فهرس expires_at).
+    لا تُفك الرموز هنا؛ يتم ذلك عند التحديث الفعلي فقط.
+    """
+    with conn() as c:
+        rows = c.execute(
+            "SELECT t.connector_id, t.expires_at, c.type FROM oauth_tokens t "
+            "JOIN connectors c ON c.id = t.connector_id "
+            "WHERE t.expires_at IS NOT NULL AND t.expires_at < ? AND t.refresh_token_encrypted IS NOT NULL "
+            "ORDER BY t.expires_at ASC LIMIT ?",
+            (before, limit),
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+# --- Connector Cursor Operations ---
+def get_connector_cursor(connector_id: str, name: str = "default") -> Optional[str]:
+    """استرجاع مؤشر المزامنة الأخير لموصل (None إذا لم تتم مزامنة سابقة)."""
+    with conn() as c:
+        row = c.execute(
+            "SELECT cursor FROM connector_cursors WHERE connector_id=? AND name=?", (connector_id, name)
+        ).fetchone()
+    return None if row is None else row["cursor"]
+
+def set_connector_cursor(connector_id: str, cursor: Optional[str], name: str = "default") -> None:
+    """حفظ مؤشر المزامنة (None يحذفه لإجبار مزامنة كاملة)."""
+    with conn() as c:
+        if cursor is None:
+            c.execute("DELETE FROM connector_cursors WHERE connector_id=? AND name=?", (connector_id, name))
+            return
+        c.execute(
+            "INSERT INTO connector_cursors(connector_id,name,cursor,updated_at) VALUES(?,?,?,?) "
+            "ON CONFLICT(connector_id,name) DO UPDATE SET cursor=excluded.cursor, updated_at=excluded.updated_at",
+            (connector_id, name, cursor, _now_iso()),
+        )
+
+# --- Key Rotation Operations ---
+# الجدول -> (المفتاح الأساسي، الأعمدة المشفرة)
+ENCRYPTED_COLUMNS: Dict[str, Tuple[str, Tuple[str, ...]]] = {
+    "settings": ("key", ("value",)),
+    "oauth_tokens": ("connector_id", ("access_token_encrypted", "refresh_token_encrypted")),
+    "connectors": ("id", ("config_json",)),
+}
+
+def fetch_encrypted_batch(table: str, after: Optional[str], limit: int) -> List[Dict[str, Any]]:
+    """دفعة من الصفوف المشفرة مرتبة بالمفتاح الأساسي بعد after (ترقيم keyset)."""
+    pk, columns = ENCRYPTED_COLUMNS[table]
+    cols = ",".join((pk,) + columns)
+    with conn() as c:
+        if after is None:
+            rows = c.execute(f"SELECT {cols} FROM {table} ORDER BY {pk} LIMIT ?", (limit,)).fetchall()
+        else:
+            rows = c.execute(
+                f"SELECT {cols} FROM {table} WHERE {pk} > ? ORDER BY {pk} LIMIT ?", (after, limit)
+            ).fetchall()
+    return [dict(r) for r in rows]
+
+def replace_encrypted_values(table: str, updates: List[Tuple[str, str, Any, Any]]) -> int:
+    """
+    استبدال قيم مشفرة (pk, column, old, new) في معاملة واحدة.
+    الاستبدال مشروط بعدم تغيّر القيمة منذ قراءتها، فلا تُفقد كتابة متزامنة؛
+    ولا يُلمس updated_at لأن النص الأصلي لم يتغير.
+
+    Returns:
+        عدد القيم المستبدلة فعلاً
+    """
+    pk, columns = ENCRYPTED_COLUMNS[table]
+    replaced = 0
+    with conn() as c:
+        for key, column, old, new in updates:
+            if column not in columns:
+                raise ValueError(f"Column '{column}' of '{table}' is not encrypted")
+            cur = c.execute(f"UPDATE {table} SET {column}=? WHERE {pk}=? AND {column}=?", (new, key, old))
+            replaced += cur.rowcount
+    return replaced
+
+def get_rotation_progress(table: str) -> Optional[Dict[str, Any]]:
+    """نقطة التقدم المحفوظة لإعادة تشفير جدول."""
+    with conn() as c:
+        row = c.execute("SELECT * FROM key_rotation_progress WHERE table_name=?", (table,)).fetchone()
+    return None if row is None else dict(row)
+
+def set_rotation_progress(table: str, key_id: str, last_key: Optional[str], scanned: int, rotated: int,
+                          completed: bool) -> None:
+    """حفظ نقطة التقدم بعد كل دفعة (للاستئناف بعد الانقطاع)."""
+    with conn() as c:
+        c.execute(
+            "INSERT INTO key_rotation_progress(table_name,key_id,last_key,scanned,rotated,completed,updated_at) "
+            "VALUES(?,?,?,?,?,?,?) ON CONFLICT(table_name) DO UPDATE SET key_id=excluded.key_id, "
+            "last_key=excluded.last_key, scanned=excluded.scanned, rotated=excluded.rotated, "
+            "completed=excluded.completed, updated_at=excluded.updated_at",
+            (table, key_id, last_key, scanned, rotated, int(completed), _now_iso()),
+        )
+
+# --- User & API Key Operations ---
+# يُستدعى كل مستمع بمعرّف المستخدم بعد أي تعديل عليه (auth يسجل إبطال ذاكرته المؤقتة هنا)
+_user_change_listeners: List[Callable[[str], None]] = []
+
+def add_user_change_listener(listener: Callable[[str], None]) -> None:
+    if listener not in _user_change_listeners:
+        _user_change_listeners.append(listener)
+
+def _user_row(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+    if row is None: return None
+    d = dict(row)
+    d["is_active"] = bool(d["is_active"])
+    d["is_admin"] = bool(d["is_admin"])
+    overrides = d.get("permission_overrides")
+    d["permission_overrides"] = orjson.loads(overrides) if overrides else None
+    return d
+
+def create_user(user_id: str, username: str, email: str, hashed_password: str,
+                full_name: Optional[str] = None, is_admin: bool = False, role: str = "user") -> None:
+    """إنشاء مستخدم (كلمة المرور مجزأة مسبقاً)."""
+    now = _now_iso()
+    with conn() as c:
+        c.execute(
+            "INSERT INTO users(id,username,email,hashed_password,full_name,is_active,is_admin,role,created_at,updated_at) "
+            "VALUES(?,?,?,?,?,1,?,?,?,?)",
+            (user_id, username, email, hashed_password, full_name, int(is_admin), role, now, now),
+        )
+
+def get_user_by_id(user_id: str) -> Optional[Dict[str, Any]]:
+    with conn() as c:
+        return _user_row(c.execute("SELECT * FROM users WHERE id=?", (user_id,)).fetchone())
+
+def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
+    with conn() as c:
+        return _user_row(c.execute("SELECT * FROM users WHERE email=?", (email,)).fetchone())
+
+def update_user_fields(user_id: str, **fields: Any) -> None:
+    """
+    تحديث حقول مستخدم (مثل is_active أو role) ثم إبلاغ مستمعي التعديل.
+
+    الإبطال فوري في هذه العملية فقط؛ العمليات الأخرى ترى التغيير خلال AUTH_CACHE_TTL_SECONDS على الأكثر.
+    """
+    if not fields: return
+    if "permission_overrides" in fields and fields["permission_overrides"] is not None:
+        fields["permission_overrides"] = orjson.dumps(fields["permission_overrides"]).decode()
+    fields["updated_at"] = _now_iso()
+    cols = ", ".join(f"{k}=?" for k in fields)
+    with conn() as c:
+        c.execute(f"UPDATE users SET {cols} WHERE id=?", (*fields.values(), user_id))
+    for listener in _user_change_listeners:
+        listener(user_id)
+
+def create_api_key(key_id: str, user_id: str, prefix: str, key_hash: str, name: Optional[str] = None) -> None:
+    """تخزين مفتاح API جديد (البادئة والبصمة فقط، لا المفتاح نفسه)."""
+    with conn() as c:
+        c.execute(
+            "INSERT INTO api_keys(id,user_id,name,prefix,key_hash,created_at) VALUES(?,?,?,?,?,?)",
+            (key_id, user_id, name, prefix, key_hash, _now_iso()),
+        )
+
+def get_user_by_api_key_hash(key_hash: str) -> Optional[Dict[str, Any]]:
+    """استعلام واحد عبر الفهرس الفريد: المستخدم صاحب المفتاح غير الملغى (أو None)."""
+    with conn() as c:
+        row = c.execute(
+            "SELECT u.*, k.id AS api_key_id FROM api_keys k JOIN users u ON u.id = k.user_id "
+            "WHERE k.key_hash=? AND k.revoked_at IS NULL",
+            (key_hash,),
+        ).fetchone()
+    return _user_row(row)
+
+def revoke_api_key(key_id: str) -> Optional[str]:
+    """
+    إلغاء مفتاح API.
+
+    Returns:
+        بصمة المفتاح الملغى (لإبطال الذاكرة المؤقتة)، أو None إذا لم يوجد
+    """
+    with conn() as c:
+        row = c.execute("SELECT key_hash FROM api_keys WHERE id=? AND revoked_at IS NULL", (key_id,)).fetchone()
+        if row is None:
+            return None
+        c.execute("UPDATE api_keys SET revoked_at=? WHERE id=?", (_now_iso(), key_id))
+    return row["key_hash"]
+
+def list_api_keys(user_id: str) -> List[Dict[str, Any]]:
+    with conn() as c:
+        rows = c.execute(
+            "SELECT id, name, prefix, created_at, revoked_at FROM api_keys WHERE user_id=? ORDER BY created_at",
+            (user_id,),
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+# --- Audit Log Operations ---
+def create_audit_logs(records: List[Dict[str, Any]]) -> int:
+    """إدخال دفعة من سجلات التدقيق في معاملة واحدة."""
+    if not records:
+        return 0
+    rows = [
+        (
+            r.get("user_id"), r["action"], r["resource_type"], r.get("resource_id"),
+            orjson.dumps(r["details"]).decode() if r.get("details") is not None else None,
+            r.get("ip_address"), r.get("user_agent"), r.get("timestamp") or _now_iso(),
+        )
+        for r in records
+    ]
+    with conn() as c:
+        c.executemany(
+            "INSERT INTO audit_logs(user_id,action,resource_type,resource_id,details_json,ip_address,user_agent,timestamp) "
+            "VALUES(?,?,?,?,?,?,?,?)",
+            rows,
+        )
+    return len(rows)
+
+def create_audit_log(user_id: Optional[str], action: str, resource_type: str, resource_id: Optional[str] = None,
+                     details: Optional[Dict[str, Any]] = None, ip_address: Optional[str] = None,
+                     user_agent: Optional[str] = None) -> None:
+    """إدخال سجل تدقيق واحد مباشرة (المسار المعتاد هو audit_writer)."""
+    create_audit_logs([{
+        "user_id": user_id, "action": action, "resource_type": resource_type, "resource_id": resource_id,
+        "details": details, "ip_address": ip_address, "user_agent": user_agent,
+    }])
+
+def list_audit_logs(user_id: Optional[str] = None, limit: int = 200) -> List[Dict[str, Any]]:
+    """أحدث سجلات التدقيق (لمستخدم محدد أو للجميع)."""
+    with conn() as c:
+        if user_id is None:
+            rows = c.execute("SELECT * FROM audit_logs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        else:
+            rows = c.execute(
+                "SELECT * FROM audit_logs WHERE user_id=? ORDER BY id DESC LIMIT ?", (user_id, limit)
+            ).fetchall()
+    out = []
+    for r in rows:
+        d = dict(r)
+        d["details"] = orjson.loads(d.pop("details_json")) if d.get("details_json") else None
+        out.append(d)
+    return out
+
+# --- Workspace Blob Operations ---
+def get_workspace_blob(sha256: str) -> Optional[Dict[str, Any]]:
+    """الحصول على الملف المسجل لبصمة SHA-256."""
+    with conn() as c:
+        row = c.execute("SELECT * FROM workspace_blobs WHERE sha256=?", (sha256,)).fetchone()
+        return dict(row) if row else None
+
+def set_workspace_blob(sha256: str, path: str, size_bytes: int, mtime_ns: int) -> None:
+    """تسجيل (أو تحديث) الملف المرتبط ببصمة SHA-256."""
+    with conn() as c:
+        c.execute(
+            "INSERT INTO workspace_blobs(sha256,path,size_bytes,mtime_ns,created_at) VALUES(?,?,?,?,?) "
+            "ON CONFLICT(sha256) DO UPDATE SET path=excluded.path, size_bytes=excluded.size_bytes, mtime_ns=excluded.mtime_ns",
+            (sha256, path, size_bytes, mtime_ns, _now_iso()),
+        )
+
+# --- Workspace Snapshot Operations ---
+def _next_snapshot_seq() -> str:
+    # في SQLite يُحسب داخل نفس أمر INSERT فيبقى ذرياً (كاتب واحد في كل لحظة)
+    if _postgres is None:
+        return "(SELECT COALESCE(MAX(seq), 0) + 1 FROM workspace_snapshots)"
+    return "nextval('workspace_snapshots_seq')"
+
+def add_workspace_snapshot(snapshot: Dict[str, Any]) -> None:
+    """تسجيل لقطة Workspace جديدة."""
+    with conn() as c:
+        c.execute(
+            "INSERT INTO workspace_snapshots(id,task_id,parent_id,root,label,file_count,total_bytes,new_bytes,created_at,seq) "
+            f"VALUES(?,?,?,?,?,?,?,?,?,{_next_snapshot_seq()})",
+            tuple(snapshot[k] for k in (
+                "id", "task_id", "parent_id", "root", "label", "file_count", "total_bytes", "new_bytes", "created_at",
+            )),
+        )
+
+def get_workspace_snapshot(snapshot_id: str) -> Optional[Dict[str, Any]]:
+    with conn() as c:
+        row = c.execute("SELECT * FROM workspace_snapshots WHERE id=?", (snapshot_id,)).fetchone()
+        return dict(row) if row else None
+
+def delete_workspace_snapshot(snapshot_id: str) -> bool:
+    """حذف سجل لقطة (الكتل غير المستخدمة تُزال لاحقاً بـ SnapshotStore.gc)."""
+    with conn() as c:
+        return c.execute("DELETE FROM workspace_snapshots WHERE id=?", (snapshot_id,)).rowcount > 0
+
+def list_workspace_snapshots(task_id: str, limit: int = 200) -> List[Dict[str, Any]]:
+    """سرد لقطات مهمة من الأحدث إلى الأقدم."""
+    # seq يحسم الترتيب عند تساوي created_at (ترتيب الإدراج)
     with conn() as c:
-        row = c.execute("SELECT value FROM settings WHERE key=?", (key,)).fetchone()
-        if row is None: return None
-        return crypto.decrypt_str(row["value"])
+        rows = c.execute(
+            "SELECT * FROM workspace_snapshots WHERE task_id=? ORDER BY created_at DESC, seq DESC LIMIT ?",
+            (task_id, limit),
+        ).fetchall()
+    return [dict(r) for r in rows]
 
 # --- Event Operations ---
 def add_event(task_id: str, level: str, event_type: str, message: str, data: Optional[Dict[str, Any]] = None) -> None:
@@ -175,6 +813,14 @@ def list_tasks(limit: int = 200) -> List[Dict[str, Any]]:
         rows = c.execute("SELECT * FROM tasks ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
     return [{**dict(r), "state_json": orjson.loads(r["state_json"])} for r in rows]
 
+def list_running_task_paths() -> List[Dict[str, Any]]:
+    """مجلدات المهام قيد التشغيل (غير المطلوب إلغاؤها) لمنع الاستعادة فوق عمل جارٍ."""
+    with conn() as c:
+        rows = c.execute(
+            "SELECT id, project_path FROM tasks WHERE status='running' AND cancel_requested=0"
+        ).fetchall()
+    return [dict(r) for r in rows]
+
 def update_task_fields(task_id: str, **fields: Any) -> None:
     if not fields: return
     fields["updated_at"] = _now_iso()
@@ -190,16 +836,35 @@ def request_cancel(task_id: str) -> None:
     """طلب إلغاء المهمة."""
     update_task_fields(task_id, cancel_requested=1)
 
-def fetch_next_runnable_task() -> Optional[Dict[str, Any]]:
-    """جلب المهمة التالية الجاهزة للتنفيذ من قبل العامل."""
+def fetch_next_runnable_task(worker_id: str = "", lease_sec: float = TASK_CLAIM_LEASE_SEC) -> Optional[Dict[str, Any]]:
+    """
+    حجز المهمة التالية الجاهزة للتنفيذ لهذا العامل.
+
+    الاختيار والحجز في أمر UPDATE واحد، فلا يأخذ عاملان نفس المهمة: في PostgreSQL
+    يتخطى FOR UPDATE SKIP LOCKED الصفوف المحجوزة في معاملات أخرى، وفي SQLite الأمر ذري
+    لأن الكتابة مسلسلة. الحجز مؤقت (claimed_until) فتعود مهمة العامل المتوقف بعد انتهائه.
+    """
+    now = time.time()
+    skip_locked = " FOR UPDATE SKIP LOCKED" if _postgres is not None else ""
     with conn() as c:
         row = c.execute(
-            "SELECT * FROM tasks "
+            "UPDATE tasks SET claimed_by=?, claimed_until=? WHERE id=("
+            "SELECT id FROM tasks "
             "WHERE cancel_requested=0 AND status IN ('queued','running') "
+            "AND (claimed_until IS NULL OR claimed_until<=?) "
             "ORDER BY CASE status WHEN 'queued' THEN 0 ELSE 1 END, updated_at ASC "
-            "LIMIT 1"
+            f"LIMIT 1{skip_locked}) RETURNING *",
+            (worker_id, _iso_at(now + lease_sec), _iso_at(now)),
         ).fetchone()
     if row is None: return None
     d = dict(row)
     d["state_json"] = orjson.loads(d["state_json"])
     return d
+
+def release_task_claim(task_id: str, worker_id: str = "") -> None:
+    """إنهاء حجز العامل للمهمة بعد دورته لتصبح متاحة للدورة التالية."""
+    with conn() as c:
+        c.execute(
+            "UPDATE tasks SET claimed_by=NULL, claimed_until=NULL WHERE id=? AND claimed_by=?",
+            (task_id, worker_id),
+        )
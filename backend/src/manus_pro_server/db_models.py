@@ -9,7 +9,7 @@ from datetime import datetime
 from typing import Optional
 from sqlalchemy import (
     Column, String, Integer, Float, Boolean, DateTime, Text, 
-    ForeignKey, Index, Enum as SQLEnum, JSON, LargeBinary
+    ForeignKey, Index, Enum as SQLEnum, JSON, LargeBinary, BigInteger, Sequence
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
@@ -74,6 +74,8 @@ class User(Base):
     full_name = Column(String(255))
     is_active = Column(Boolean, default=True, nullable=False)
     is_admin = Column(Boolean, default=False, nullable=False)
+    role = Column(String(32), default="user", nullable=False)
+    permission_overrides = Column(JSON)  # {"grant": [...], "deny": [...]}
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     last_login = Column(DateTime)
@@ -84,6 +86,37 @@ class User(Base):
     settings = relationship("Setting", back_populates="user", cascade="all, delete-orphan")
     audit_logs = relationship("AuditLog", back_populates="user", cascade="all, delete-orphan")
 
+class ApiKey(Base):
+    """مفتاح API: تُخزّن البادئة وبصمة SHA-256 فقط (البحث بالبصمة عبر فهرس فريد)"""
+    __tablename__ = "api_keys"
+    
+    id = Column(String(36), primary_key=True)
+    user_id = Column(String(36), ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    name = Column(String(255))
+    prefix = Column(String(16), nullable=False)
+    key_hash = Column(String(64), nullable=False, unique=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    revoked_at = Column(DateTime)
+
+class SettingsGeneration(Base):
+    """عدّاد أجيال الإعدادات (صف واحد) لإبطال الذاكرة المؤقتة عبر العمليات"""
+    __tablename__ = "settings_generation"
+    
+    id = Column(Integer, primary_key=True)
+    generation = Column(Integer, nullable=False, default=0)
+
+class KeyRotationProgress(Base):
+    """نقطة تقدم إعادة تشفير جدول بعد تدوير مفتاح Fernet"""
+    __tablename__ = "key_rotation_progress"
+    
+    table_name = Column(String(100), primary_key=True)
+    key_id = Column(String(32), nullable=False)
+    last_key = Column(String(255), nullable=True)
+    scanned = Column(Integer, nullable=False, default=0)
+    rotated = Column(Integer, nullable=False, default=0)
+    completed = Column(Boolean, nullable=False, default=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
 class Task(Base):
     """نموذج المهمة"""
     __tablename__ = "tasks"
@@ -122,6 +155,10 @@ class Task(Base):
     # الحالة (JSON)
     state_json = Column(JSON, nullable=False)
     
+    # حجز العامل (ينتهي عند claimed_until إن توقف العامل)
+    claimed_by = Column(String(255), nullable=True)
+    claimed_until = Column(DateTime, nullable=True)
+    
     # العلاقات
     owner = relationship("User", back_populates="tasks")
     events = relationship("Event", back_populates="task", cascade="all, delete-orphan")
@@ -206,15 +243,19 @@ class OAuthToken(Base):
     __tablename__ = "oauth_tokens"
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    connector_id = Column(String(36), ForeignKey("connectors.id", ondelete="CASCADE"), nullable=False, index=True)
+    connector_id = Column(String(36), ForeignKey("connectors.id", ondelete="CASCADE"), nullable=False, unique=True, index=True)
     
     # الرموز مشفرة باستخدام Fernet
     access_token_encrypted = Column(LargeBinary, nullable=False)
     refresh_token_encrypted = Column(LargeBinary, nullable=True)
     
-    expires_at = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=True, index=True)
     scopes = Column(Text, nullable=True)
     
+    # حجز التحديث بين العمليات (refresh_token يُدوَّر لدى بعض المزوّدين)
+    refresh_claimed_by = Column(String(255), nullable=True)
+    refresh_claimed_until = Column(DateTime, nullable=True)
+    
     # التوقيتات
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
@@ -222,6 +263,44 @@ class OAuthToken(Base):
     # العلاقات
     connector = relationship("Connector", back_populates="tokens")
 
+class ConnectorCursor(Base):
+    """مؤشر المزامنة التزايدية للموصل (Drive page token / OneDrive delta link)"""
+    __tablename__ = "connector_cursors"
+    
+    connector_id = Column(String(36), ForeignKey("connectors.id", ondelete="CASCADE"), primary_key=True)
+    name = Column(String(100), primary_key=True, default="default")
+    cursor = Column(Text, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+class WorkspaceBlob(Base):
+    """بصمة SHA-256 لملف مرفوع إلى الـ Workspace (لإزالة التكرار)"""
+    __tablename__ = "workspace_blobs"
+    
+    sha256 = Column(String(64), primary_key=True)
+    path = Column(Text, nullable=False)
+    size_bytes = Column(BigInteger, nullable=False)
+    mtime_ns = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+class WorkspaceSnapshot(Base):
+    """لقطة Workspace عند نقطة تفتيش (المحتوى في مخزن الكتل حسب SHA-256)"""
+    __tablename__ = "workspace_snapshots"
+    
+    id = Column(String(36), primary_key=True)
+    task_id = Column(String(36), ForeignKey("tasks.id", ondelete="CASCADE"), nullable=True)
+    parent_id = Column(String(36), nullable=True)
+    root = Column(Text, nullable=False)
+    label = Column(String(255), nullable=True)
+    file_count = Column(Integer, nullable=False)
+    total_bytes = Column(BigInteger, nullable=False)
+    new_bytes = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    seq = Column(BigInteger, Sequence("workspace_snapshots_seq"), nullable=False)  # ترتيب الإدراج
+    
+    __table_args__ = (
+        Index("idx_workspace_snapshots_task_id", "task_id", "created_at"),
+    )
+
 class Attachment(Base):
     """نموذج المرفق"""
     __tablename__ = "attachments"
@@ -0,0 +1,237 @@
+# خلفية PostgreSQL لطبقة db (MANUS_PRO_DB_BACKEND=postgres):
+# - مجمّع اتصالات asyncpg يعمل في حلقة أحداث مخصصة داخل خيط مستقل، فتبقى واجهة db.*
+#   متزامنة كما هي لكل المستدعين (API عبر to_thread، عمال Celery، المنفّذ) دون حجز حلقة التطبيق.
+# - PgConnection يحاكي ما تستخدمه db.py من sqlite3.Connection (execute/executemany/executescript
+#   و fetchone/fetchall/rowcount)، وكل كتلة conn() معاملة واحدة على اتصال واحد من المجمّع.
+# - ترجمة SQL: العلامات ? إلى $1..$n (خارج النصوص المقتبسة)، INSERT OR IGNORE إلى ON CONFLICT DO NOTHING،
+#   وأنواع DDL (INTEGER -> BIGINT، REAL -> DOUBLE PRECISION، BLOB -> BYTEA، AUTOINCREMENT -> BIGSERIAL)
+#   فيُنشأ نفس مخطط وقت التشغيل من init_db دون نسخة ثانية منه.
+# - الجداول في مخطط مستقل (DB_SCHEMA) عبر search_path، لأن جداول Alembic بنفس الأسماء مختلفة البنية.
+
+from __future__ import annotations
+
+import asyncio
+import re
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from .config import (
+    DATABASE_URL,
+    DB_COMMAND_TIMEOUT_SEC,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_MIN_SIZE,
+    DB_SCHEMA,
+)
+from .logging_config import get_logger
+
+logger = get_logger(__name__)
+
+try:
+    import asyncpg
+    ASYNCPG_AVAILABLE = True
+except ImportError:
+    asyncpg = None
+    ASYNCPG_AVAILABLE = False
+
+_SCHEMA_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_OR_IGNORE = re.compile(r"INSERT\s+OR\s+IGNORE\s+INTO\s+(.*?)\s*(;|$)", re.IGNORECASE | re.DOTALL)
+_DDL_TYPES = (
+    (re.compile(r"\bINTEGER\s+PRIMARY\s+KEY\s+AUTOINCREMENT\b", re.IGNORECASE), "BIGSERIAL PRIMARY KEY"),
+    (re.compile(r"\bINTEGER\b", re.IGNORECASE), "BIGINT"),
+    (re.compile(r"\bREAL\b", re.IGNORECASE), "DOUBLE PRECISION"),
+    (re.compile(r"\bBLOB\b", re.IGNORECASE), "BYTEA"),
+)
+_RETURNS_ROWS = ("SELECT", "WITH", "VALUES", "SHOW")
+
+# ═══ SQL Translation ═══
+@lru_cache(maxsize=1024)
+def translate_sql(sql: str) -> str:
+    """تحويل استعلام بصيغة sqlite3 (علامات ?) إلى صيغة asyncpg ($1..$n)."""
+    out = []
+    index = 0
+    quote: Optional[str] = None
+    for ch in sql:
+        if quote is not None:
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"'):
+            quote = ch
+        elif ch == "?":
+            index += 1
+            out.append(f"${index}")
+            continue
+        out.append(ch)
+    return _OR_IGNORE.sub(r"INSERT INTO \1 ON CONFLICT DO NOTHING\2", "".join(out))
+
+def translate_ddl(script: str) -> str:
+    """تحويل سكربت DDL من init_db إلى أنواع PostgreSQL."""
+    for pattern, replacement in _DDL_TYPES:
+        script = pattern.sub(replacement, script)
+    return _OR_IGNORE.sub(r"INSERT INTO \1 ON CONFLICT DO NOTHING\2", script)
+
+def _status_rowcount(status: str) -> int:
+    """عدد الصفوف من نص حالة الأمر ('UPDATE 3' / 'INSERT 0 1')."""
+    last = status.rsplit(" ", 1)[-1] if status else ""
+    return int(last) if last.isdigit() else -1
+
+# ═══ Connection Adapter ═══
+class PgCursor:
+    """نتيجة execute: الصفوف (asyncpg.Record تدعم r["col"] و r[0] و dict(r)) وعدد الصفوف المتأثرة."""
+
+    lastrowid = None
+
+    def __init__(self, rows: List[Any], rowcount: int):
+        self._rows = rows
+        self._pos = 0
+        self.rowcount = rowcount
+
+    def fetchone(self) -> Optional[Any]:
+        if self._pos >= len(self._rows):
+            return None
+        row = self._rows[self._pos]
+        self._pos += 1
+        return row
+
+    def fetchall(self) -> List[Any]:
+        rows = self._rows[self._pos:]
+        self._pos = len(self._rows)
+        return rows
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.fetchall())
+
+class PgConnection:
+    """اتصال مستعار من المجمّع داخل معاملة مفتوحة، بواجهة sqlite3 التي تستخدمها db.py."""
+
+    dialect = "postgres"
+
+    def __init__(self, database: "PostgresDatabase", con: Any):
+        self._db = database
+        self._con = con
+
+    def execute(self, sql: str, params: Sequence[Any] = ()) -> PgCursor:
+        sql = translate_sql(sql)
+        if sql.lstrip().split(None, 1)[0].upper() in _RETURNS_ROWS or " RETURNING " in sql.upper():
+            rows = self._db.run(self._con.fetch(sql, *params))
+            return PgCursor(rows, len(rows))
+        status = self._db.run(self._con.execute(sql, *params))
+        return PgCursor([], _status_rowcount(status))
+
+    def executemany(self, sql: str, seq_of_params: Sequence[Sequence[Any]]) -> PgCursor:
+        rows = [tuple(p) for p in seq_of_params]
+        if rows:
+            self._db.run(self._con.executemany(translate_sql(sql), rows))
+        return PgCursor([], len(rows))
+
+    def executescript(self, script: str) -> None:
+        # بروتوكول الاستعلام البسيط: عدة أوامر في استدعاء واحد دون معاملات
+        self._db.run(self._con.execute(translate_ddl(script)))
+
+# ═══ Pool ═══
+class PostgresDatabase:
+    """مجمّع asyncpg في حلقة أحداث خاصة مع واجهة معاملات متزامنة."""
+
+    def __init__(
+        self,
+        dsn: str = DATABASE_URL,
+        schema: str = DB_SCHEMA,
+        min_size: int = DB_POOL_MIN_SIZE,
+        max_size: int = DB_POOL_MAX_SIZE,
+        command_timeout: float = DB_COMMAND_TIMEOUT_SEC,
+    ):
+        if not _SCHEMA_NAME.match(schema):
+            raise ValueError(f"Invalid schema name '{schema}'")
+        self.dsn = dsn
+        self.schema = schema
+        self.min_size = min_size
+        self.max_size = max_size
+        self.command_timeout = command_timeout
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def run(self, coro) -> Any:
+        """تنفيذ coroutine في حلقة المجمّع وانتظار النتيجة من الخيط الحالي."""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(self.command_timeout + 5)
+
+    def _start(self) -> None:
+        if self._pool is not None:
+            return
+        with self._lock:
+            if self._pool is not None:
+                return
+            if not ASYNCPG_AVAILABLE:
+                raise RuntimeError("MANUS_PRO_DB_BACKEND=postgres requires the asyncpg package")
+            if not self.dsn:
+                raise RuntimeError("MANUS_PRO_DB_BACKEND=postgres requires MANUS_PRO_DATABASE_URL or DATABASE_URL")
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="postgres-pool", daemon=True)
+            thread.start()
+            self._loop, self._thread = loop, thread
+            try:
+                self._pool = self.run(self._create_pool())
+            except BaseException:
+                self._stop_loop()
+                raise
+            logger.info(f"PostgreSQL pool ready (schema={self.schema}, size={self.min_size}..{self.max_size})")
+
+    async def _create_pool(self):
+        # المخطط يُنشأ قبل المجمّع لأن search_path يُضبط لكل اتصال عند فتحه
+        bootstrap = await asyncpg.connect(self.dsn)
+        try:
+            await bootstrap.execute(f'CREATE SCHEMA IF NOT EXISTS "{self.schema}"')
+        finally:
+            await bootstrap.close()
+        return await asyncpg.create_pool(
+            self.dsn,
+            min_size=self.min_size,
+            max_size=self.max_size,
+            command_timeout=self.command_timeout,
+            server_settings={"search_path": self.schema},
+        )
+
+    @contextmanager
+    def connection(self) -> Iterator[PgConnection]:
+        """اتصال من المجمّع داخل معاملة: commit عند النجاح و rollback عند أي استثناء."""
+        self._start()
+        con = self.run(self._pool.acquire())
+        try:
+            tr = con.transaction()
+            self.run(tr.start())
+            try:
+                yield PgConnection(self, con)
+            except BaseException:
+                try:
+                    self.run(tr.rollback())
+                except Exception:
+                    pass
+                raise
+            self.run(tr.commit())
+        finally:
+            self.run(self._pool.release(con))
+
+    def stats(self) -> Dict[str, int]:
+        if self._pool is None:
+            return {"size": 0, "idle": 0, "max_size": self.max_size}
+        return {"size": self._pool.get_size(), "idle": self._pool.get_idle_size(), "max_size": self.max_size}
+
+    def _stop_loop(self) -> None:
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            self._loop.close()
+        self._loop = self._thread = None
+
+    def close(self) -> None:
+        """إغلاق المجمّع وحلقته (يُعاد إنشاؤهما عند أول استخدام لاحق)."""
+        with self._lock:
+            if self._pool is not None:
+                try:
+                    self.run(self._pool.close())
+                except Exception as e:
+                    logger.warning(f"PostgreSQL pool close failed: {e}")
+                self._pool = None
+            self._stop_loop()
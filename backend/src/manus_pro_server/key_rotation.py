@@ -0,0 +1,211 @@
+# إعادة التشفير بعد تدوير مفتاح Fernet دون توقف:
+# - crypto.rotate_key() يضيف مفتاحاً أساسياً جديداً، والمفاتيح القديمة تبقى لفك التشفير.
+# - هذه المهمة تمر على الجداول المشفرة بدفعات (ترقيم keyset) وتعيد تشفير ما ليس بالمفتاح الأساسي
+#   عبر MultiFernet.rotate، مع توقف قصير بين الدفعات كي لا ترفع حمل قاعدة البيانات.
+# - نقطة التقدم تُحفظ بعد كل دفعة (مرتبطة ببصمة المفتاح) فتُستأنف المهمة بعد أي انقطاع.
+# - مرفقات MinIO المشفرة (MINIO_ENCRYPT_AT_REST) يُعاد تشفيرها كذلك بمرور مستقل على الكائنات
+#   بنقطة تقدم باسم STORAGE_OBJECTS في نفس الجدول.
+# - retire_old_keys() تزيل المفاتيح القديمة فقط بعد اكتمال كل الجداول بالمفتاح الأساسي الحالي،
+#   وبعد مهلة التقاط المفتاح في العمليات الأخرى ومسح أخير يعيد تشفير ما كُتب بالمفتاح القديم أثناءها.
+
+from __future__ import annotations
+
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from cryptography.fernet import InvalidToken
+
+from . import crypto, db
+from .config import MINIO_ENCRYPT_AT_REST
+from .logging_config import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_PAUSE_SEC = 0.05
+STORAGE_OBJECTS = "storage_objects"  # اسم نقطة تقدم مرور الكائنات في key_rotation_progress
+
+def _rotate_rows(table: str, rows: List[Dict[str, Any]]) -> Tuple[int, int]:
+    """إعادة تشفير ما ليس بالمفتاح الأساسي في دفعة صفوف؛ يعيد (المستبدلة، الفاشلة)."""
+    pk, columns = db.ENCRYPTED_COLUMNS[table]
+    updates = []
+    failed = 0
+    for row in rows:
+        for column in columns:
+            token = row[column]
+            if not token or crypto.is_primary(token):
+                continue
+            try:
+                updates.append((row[pk], column, token, crypto.rotate_token(token)))
+            except InvalidToken:
+                failed += 1
+                logger.error(f"Cannot re-encrypt {table}.{column} for {row[pk]}: no matching key")
+    return (db.replace_encrypted_values(table, updates) if updates else 0), failed
+
+def reencrypt_table(table: str, batch_size: int = DEFAULT_BATCH_SIZE, pause: float = DEFAULT_PAUSE_SEC,
+                    max_batches: Optional[int] = None) -> Dict[str, Any]:
+    """
+    إعادة تشفير جدول واحد بالمفتاح الأساسي الحالي مع الاستئناف من آخر نقطة تقدم.
+
+    Args:
+        table: اسم جدول من db.ENCRYPTED_COLUMNS
+        batch_size: عدد الصفوف في كل دفعة
+        pause: ثوانٍ بين الدفعات
+        max_batches: حد أقصى لعدد الدفعات في هذا الاستدعاء (None = حتى النهاية)
+
+    Returns:
+        { "table", "scanned", "rotated", "failed", "completed" }
+    """
+    pk = db.ENCRYPTED_COLUMNS[table][0]
+    key_id = crypto.primary_key_id()
+    progress = db.get_rotation_progress(table)
+    if progress is not None and progress["key_id"] == key_id:
+        if progress["completed"]:
+            return {"table": table, "scanned": progress["scanned"], "rotated": progress["rotated"],
+                    "failed": 0, "completed": True}
+        after, scanned, rotated = progress["last_key"], progress["scanned"], progress["rotated"]
+    else:
+        # مفتاح جديد منذ آخر تشغيل: البدء من أول الجدول
+        after, scanned, rotated = None, 0, 0
+
+    failed = 0
+    batches = 0
+    completed = False
+    while max_batches is None or batches < max_batches:
+        rows = db.fetch_encrypted_batch(table, after, batch_size)
+        if not rows:
+            completed = True
+            db.set_rotation_progress(table, key_id, after, scanned, rotated, True)
+            break
+        batch_rotated, batch_failed = _rotate_rows(table, rows)
+        rotated += batch_rotated
+        failed += batch_failed
+        scanned += len(rows)
+        after = rows[-1][pk]
+        batches += 1
+        completed = len(rows) < batch_size
+        db.set_rotation_progress(table, key_id, after, scanned, rotated, completed)
+        if completed:
+            break
+        if pause:
+            time.sleep(pause)
+
+    logger.info(f"Re-encryption of {table}: scanned={scanned} rotated={rotated} failed={failed} completed={completed}")
+    return {"table": table, "scanned": scanned, "rotated": rotated, "failed": failed, "completed": completed}
+
+def reencrypt_objects(batch_size: int = DEFAULT_BATCH_SIZE, pause: float = DEFAULT_PAUSE_SEC,
+                      max_batches: Optional[int] = None) -> Dict[str, Any]:
+    """
+    إعادة تشفير مرفقات MinIO المشفرة بالمفتاح الأساسي الحالي مع الاستئناف من آخر كائن.
+
+    Returns:
+        { "table": STORAGE_OBJECTS, "scanned", "rotated", "failed", "completed" }
+    """
+    from .s3_storage import reencrypt_objects as reencrypt_bucket
+
+    key_id = crypto.primary_key_id()
+    progress = db.get_rotation_progress(STORAGE_OBJECTS)
+    if progress is not None and progress["key_id"] == key_id:
+        if progress["completed"]:
+            return {"table": STORAGE_OBJECTS, "scanned": progress["scanned"], "rotated": progress["rotated"],
+                    "failed": 0, "completed": True}
+        after, scanned, rotated = progress["last_key"], progress["scanned"], progress["rotated"]
+    else:
+        after, scanned, rotated = None, 0, 0
+
+    failed = 0
+    batches = 0
+    completed = False
+    while max_batches is None or batches < max_batches:
+        result = reencrypt_bucket(start_after=after, limit=batch_size)
+        scanned += result["scanned"]
+        rotated += result["rotated"]
+        failed += result["failed"]
+        after = result["last_key"]
+        completed = result["completed"]
+        batches += 1
+        db.set_rotation_progress(STORAGE_OBJECTS, key_id, after, scanned, rotated, completed)
+        if completed:
+            break
+        if pause:
+            time.sleep(pause)
+    return {"table": STORAGE_OBJECTS, "scanned": scanned, "rotated": rotated, "failed": failed, "completed": completed}
+
+def reencrypt_all(tables: Optional[Iterable[str]] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                  pause: float = DEFAULT_PAUSE_SEC) -> Dict[str, Any]:
+    """
+    إعادة تشفير كل الجداول المشفرة. completed=True يعني أن المفاتيح القديمة لم تعد لازمة
+    (ما لم تفشل بعض القيم في فك التشفير).
+    """
+    results = [reencrypt_table(t, batch_size, pause) for t in (tables or db.ENCRYPTED_COLUMNS)]
+    if tables is None and MINIO_ENCRYPT_AT_REST:
+        results.append(reencrypt_objects(batch_size, pause))
+    return {
+        "tables": results,
+        "completed": all(r["completed"] and not r["failed"] for r in results),
+    }
+
+def pending_tables(key_id: Optional[str] = None) -> List[str]:
+    """الجداول التي لم تكتمل إعادة تشفيرها بالمفتاح key_id (الأساسي الحالي افتراضياً)."""
+    key_id = key_id or crypto.primary_key_id()
+    pending = []
+    for table in list(db.ENCRYPTED_COLUMNS) + ([STORAGE_OBJECTS] if MINIO_ENCRYPT_AT_REST else []):
+        progress = db.get_rotation_progress(table)
+        if progress is None or progress["key_id"] != key_id or not progress["completed"]:
+            pending.append(table)
+    return pending
+
+def _wait_for_key_propagation() -> None:
+    """انتظار حتى تلتقط كل العمليات المفتاح الأساسي الجديد (فحص الملف كل KEY_RECHECK_INTERVAL_SEC)."""
+    try:
+        age = time.time() - crypto.FERNET_KEY_PATH.stat().st_mtime
+    except OSError:
+        return
+    remaining = crypto.KEY_RECHECK_INTERVAL_SEC - age
+    if remaining > 0:
+        time.sleep(remaining)
+
+def sweep_table(table: str, batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, Any]:
+    """مسح كامل لجدول وإعادة تشفير أي قيمة ما زالت بمفتاح قديم (دون الاعتماد على نقطة التقدم)."""
+    after = None
+    rotated = failed = 0
+    while True:
+        rows = db.fetch_encrypted_batch(table, after, batch_size)
+        if not rows:
+            break
+        batch_rotated, batch_failed = _rotate_rows(table, rows)
+        rotated += batch_rotated
+        failed += batch_failed
+        after = rows[-1][db.ENCRYPTED_COLUMNS[table][0]]
+    return {"table": table, "rotated": rotated, "failed": failed}
+
+def retire_old_keys(batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, Any]:
+    """
+    إزالة المفاتيح القديمة بأمان:
+    1. يجب أن تكون إعادة التشفير مكتملة بالمفتاح الأساسي الحالي لكل جداول db.ENCRYPTED_COLUMNS
+       (ولمرفقات MinIO عند تفعيل MINIO_ENCRYPT_AT_REST).
+    2. انتظار مهلة KEY_RECHECK_INTERVAL_SEC منذ التدوير، ثم مسح أخير يعيد تشفير ما كتبته
+       عمليات أخرى بالمفتاح القديم قبل أن تلتقط الجديد.
+    3. إعادة كتابة ملف المفاتيح بشرط ألا يكون المفتاح الأساسي قد تغيّر أثناء ذلك.
+
+    Raises:
+        RuntimeError: إذا لم تكتمل إعادة التشفير أو بقيت قيم لا يمكن فكها
+
+    Returns:
+        { "removed", "swept": [{ "table", "rotated", "failed" }] }
+    """
+    key_id = crypto.primary_key_id()
+    pending = pending_tables(key_id)
+    if pending:
+        raise RuntimeError(f"Re-encryption with key {key_id} is not complete for: {', '.join(pending)}")
+    _wait_for_key_propagation()
+    swept = [sweep_table(table, batch_size) for table in db.ENCRYPTED_COLUMNS]
+    if MINIO_ENCRYPT_AT_REST:
+        from .s3_storage import reencrypt_objects as reencrypt_bucket
+        objects = reencrypt_bucket()
+        swept.append({"table": STORAGE_OBJECTS, "rotated": objects["rotated"], "failed": objects["failed"]})
+    failed = sum(r["failed"] for r in swept)
+    if failed:
+        raise RuntimeError(f"{failed} encrypted values cannot be decrypted; old keys kept")
+    removed = crypto.retire_old_keys(expected_primary_id=key_id)
+    return {"removed": removed, "swept": swept}
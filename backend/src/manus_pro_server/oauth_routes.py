@@ -6,37 +6,24 @@ from fastapi import APIRouter, HTTPException, Query, Depends
 from fastapi.responses import RedirectResponse
 from typing import Optional
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
 
-from .connectors import (
-    GoogleConnector, GoogleDriveConnector, MicrosoftOneDriveConnector,
-    FacebookConnector, MessengerConnector, InstagramConnector,
-    ThreadsConnector, TikTokConnector, SnapchatConnector,
-    DiscordConnector, LinkedInConnector, GitHubConnector, RedditConnector
-)
+from .connectors import registry
 from .db_models import Connector as ConnectorModel, OAuthToken, ConnectorStatus
 from .auth import get_current_user
-from . import crypto
+from . import db
 from .db import conn
+from .token_refresh import expiry_iso
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/oauth", tags=["OAuth"])
 
-CONNECTOR_CLASSES = {
-    "google": GoogleConnector,
-    "google_drive": GoogleDriveConnector,
-    "microsoft_onedrive": MicrosoftOneDriveConnector,
-    "facebook": FacebookConnector,
-    "messenger": MessengerConnector,
-    "instagram": InstagramConnector,
-    "threads": ThreadsConnector,
-    "tiktok": TikTokConnector,
-    "snapchat": SnapchatConnector,
-    "discord": DiscordConnector,
-    "linkedin": LinkedInConnector,
-    "github": GitHubConnector,
-    "reddit": RedditConnector,
-}
+# أنواع الموصلات التي تدعم OAuth (تُستورد أصنافها عند أول استخدام فقط)
+OAUTH_CONNECTOR_TYPES = frozenset({
+    "google", "google_drive", "microsoft_onedrive", "facebook", "messenger",
+    "instagram", "threads", "tiktok", "snapchat", "discord", "linkedin",
+    "github", "reddit",
+})
 
 @router.get("/{connector_type}/authorize")
 async def oauth_authorize(
@@ -44,16 +31,15 @@ async def oauth_authorize(
     connector_id: str = Query(..., description="معرّف الموصل"),
     current_user = Depends(get_current_user),
 ):
-    if connector_type not in CONNECTOR_CLASSES:
+    if connector_type not in OAUTH_CONNECTOR_TYPES:
         raise HTTPException(status_code=400, detail=f"نوع الموصل '{connector_type}' غير مدعوم")
     
-    connector_class = CONNECTOR_CLASSES[connector_type]
     connector_config = {
         "client_id": f"{connector_type.upper()}_CLIENT_ID", # TODO: من الإعدادات
         "redirect_uri": f"http://localhost:8000/api/v1/oauth/{connector_type}/callback",
     }
     
-    connector = connector_class(connector_id=connector_id, name=f"{connector_type} Connector", config=connector_config)
+    connector = registry.create(connector_type, connector_id, f"{connector_type} Connector", connector_config)
     auth_url = connector.get_authorization_url(state=connector_id)
     return RedirectResponse(url=auth_url)
 
@@ -70,48 +56,37 @@ async def oauth_callback(
     connector_id = state
     if not connector_id:
         raise HTTPException(status_code=400, detail="Missing state/connector_id")
+    if connector_type not in OAUTH_CONNECTOR_TYPES:
+        raise HTTPException(status_code=400, detail=f"نوع الموصل '{connector_type}' غير مدعوم")
 
-    connector_class = CONNECTOR_CLASSES[connector_type]
     connector_config = {
         "client_id": f"{connector_type.upper()}_CLIENT_ID",
         "client_secret": f"{connector_type.upper()}_CLIENT_SECRET",
         "redirect_uri": f"http://localhost:8000/api/v1/oauth/{connector_type}/callback",
     }
     
-    connector = connector_class(connector_id=connector_id, name=f"{connector_type} Connector", config=connector_config)
+    connector = registry.create(connector_type, connector_id, f"{connector_type} Connector", connector_config)
     
     try:
         tokens = await connector.exchange_code_for_token(code)
         
-        # تشفير الرموز
-        access_token_enc = crypto.encrypt(tokens.get("access_token", "").encode())
-        refresh_token_enc = crypto.encrypt(tokens.get("refresh_token", "").encode()) if tokens.get("refresh_token") else None
-        
-        # حفظ في قاعدة البيانات
         with conn() as c:
-            
             c.execute(
                 "UPDATE connectors SET status = ?, updated_at = ? WHERE id = ?",
                 (ConnectorStatus.ACTIVE.value, datetime.utcnow().isoformat(), connector_id)
             )
-            # حفظ الرموز
-            c.execute(
-                """INSERT INTO oauth_tokens 
-                   (connector_id, access_token_encrypted, refresh_token_encrypted, expires_at, created_at, updated_at)
-                   VALUES (?, ?, ?, ?, ?, ?)
-                   ON CONFLICT(connector_id) DO UPDATE SET
-                   access_token_encrypted=excluded.access_token_encrypted,
-                   refresh_token_encrypted=excluded.refresh_token_encrypted,
-                   expires_at=excluded.expires_at,
-                   updated_at=excluded.updated_at""",
-                (
-                    connector_id, access_token_enc, refresh_token_enc,
-                    (datetime.utcnow() + timedelta(seconds=tokens.get("expires_in", 3600))).isoformat(),
-                    datetime.utcnow().isoformat(), datetime.utcnow().isoformat()
-                )
-            )
+        # حفظ الرموز مشفرة مع وقت انتهاء مفهرس للتحديث الاستباقي
+        db.save_oauth_token(
+            connector_id,
+            tokens.get("access_token", ""),
+            tokens.get("refresh_token"),
+            expiry_iso(tokens.get("expires_in", 3600)),
+        )
+        registry.invalidate(connector_id)
         
         return RedirectResponse(url=f"/dashboard?oauth_success=true&connector={connector_type}")
     except Exception as e:
         logger.error(f"OAuth callback failed: {e}")
         return RedirectResponse(url=f"/dashboard?oauth_error={str(e)}")
+    finally:
+        connector.close()
@@ -7,12 +7,13 @@
 from __future__ import annotations
 import os
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, Iterator, List
 from pathlib import Path
 import mimetypes
 
 from minio import Minio
 from minio.error import S3Error
+from .config import MINIO_ENCRYPT_AT_REST
 from .logging_config import get_logger
 
 logger = get_logger(__name__)
@@ -23,6 +24,9 @@ MINIO_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY", "minioadmin")
 MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY", "minioadmin")
 MINIO_BUCKET = os.getenv("MINIO_BUCKET", "mkh-attachments")
 MINIO_SECURE = os.getenv("MINIO_SECURE", "false").lower() == "true"
+# تشفير المرفقات قبل رفعها (crypto_stream: AES-256-GCM مقسّم، ذاكرة ثابتة) عبر MINIO_ENCRYPT_AT_REST
+ENCRYPTION_METADATA_KEY = "x-amz-meta-mkh-encryption"
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
 
 # ═══ MinIO Client ═══
 _minio_client: Optional[Minio] = None
@@ -66,7 +70,8 @@ def upload_file(
     file_path: str,
     object_name: Optional[str] = None,
     content_type: Optional[str] = None,
-    bucket_name: str = MINIO_BUCKET
+    bucket_name: str = MINIO_BUCKET,
+    encrypt: Optional[bool] = None
 ) -> Dict[str, Any]:
     """
     رفع ملف إلى MinIO/S3
@@ -76,9 +81,11 @@ def upload_file(
         object_name: اسم الكائن في S3 (اختياري)
         content_type: نوع المحتوى (اختياري)
         bucket_name: اسم Bucket
+        encrypt: تشفير المحتوى تدفقياً قبل الرفع (الافتراضي MINIO_ENCRYPT_AT_REST)
     
     Returns:
-        معلومات الملف المرفوع
+        معلومات الملف المرفوع (size هو حجم الأصل). url رابط موقّع للكائن غير المشفر فقط،
+        و None للمشفر لأن الرابط يقدّم النص المشفر؛ يُقرأ المشفر عبر iter_object/download_file
     """
     try:
         ensure_bucket_exists(bucket_name)
@@ -97,20 +104,35 @@ def upload_file(
         # الحصول على حجم الملف
         file_size = os.path.getsize(file_path)
         
-        # رفع الملف
-        with open(file_path, "rb") as file_data:
-            client.put_object(
-                bucket_name,
-                object_name,
-                file_data,
-                file_size,
-                content_type=content_type
-            )
-        
-        logger.info(f"File uploaded: {object_name} ({file_size} bytes)")
+        if encrypt is None:
+            encrypt = MINIO_ENCRYPT_AT_REST
         
-        # إنشاء signed URL
-        url = get_presigned_url(object_name, bucket_name, expires_hours=24)
+        # رفع الملف (مع التشفير أثناء القراءة دون تحميله في الذاكرة)
+        with open(file_path, "rb") as file_data:
+            if encrypt:
+                from .crypto_stream import ENCRYPTION_SCHEME, EncryptingReader
+                reader = EncryptingReader(file_data, file_size)
+                client.put_object(
+                    bucket_name,
+                    object_name,
+                    reader,
+                    reader.size,
+                    content_type=content_type,
+                    metadata={ENCRYPTION_METADATA_KEY: ENCRYPTION_SCHEME},
+                )
+            else:
+                client.put_object(
+                    bucket_name,
+                    object_name,
+                    file_data,
+                    file_size,
+                    content_type=content_type
+                )
+        
+        logger.info(f"File uploaded: {object_name} ({file_size} bytes{', encrypted' if encrypt else ''})")
+        
+        # إنشاء signed URL (لا معنى له للكائن المشفر)
+        url = None if encrypt else get_presigned_url(object_name, bucket_name, expires_hours=24)
         
         return {
             "bucket": bucket_name,
@@ -118,6 +140,7 @@ def upload_file(
             "size": file_size,
             "content_type": content_type,
             "url": url,
+            "encrypted": bool(encrypt),
             "uploaded_at": datetime.utcnow().isoformat()
         }
         
@@ -129,7 +152,8 @@ def upload_bytes(
     data: bytes,
     object_name: str,
     content_type: str = "application/octet-stream",
-    bucket_name: str = MINIO_BUCKET
+    bucket_name: str = MINIO_BUCKET,
+    encrypt: Optional[bool] = None
 ) -> Dict[str, Any]:
     """
     رفع بيانات bytes إلى MinIO/S3
@@ -139,9 +163,10 @@ def upload_bytes(
         object_name: اسم الكائن
         content_type: نوع المحتوى
         bucket_name: اسم Bucket
+        encrypt: تشفير المحتوى قبل الرفع (الافتراضي MINIO_ENCRYPT_AT_REST)
     
     Returns:
-        معلومات الملف المرفوع
+        معلومات الملف المرفوع (url هو None للكائن المشفر كما في upload_file)
     """
     try:
         ensure_bucket_exists(bucket_name)
@@ -152,17 +177,32 @@ def upload_bytes(
         data_stream = BytesIO(data)
         data_size = len(data)
         
-        client.put_object(
-            bucket_name,
-            object_name,
-            data_stream,
-            data_size,
-            content_type=content_type
-        )
+        if encrypt is None:
+            encrypt = MINIO_ENCRYPT_AT_REST
         
-        logger.info(f"Bytes uploaded: {object_name} ({data_size} bytes)")
+        if encrypt:
+            from .crypto_stream import ENCRYPTION_SCHEME, EncryptingReader
+            reader = EncryptingReader(data_stream, data_size)
+            client.put_object(
+                bucket_name,
+                object_name,
+                reader,
+                reader.size,
+                content_type=content_type,
+                metadata={ENCRYPTION_METADATA_KEY: ENCRYPTION_SCHEME},
+            )
+        else:
+            client.put_object(
+                bucket_name,
+                object_name,
+                data_stream,
+                data_size,
+                content_type=content_type
+            )
         
-        url = get_presigned_url(object_name, bucket_name, expires_hours=24)
+        logger.info(f"Bytes uploaded: {object_name} ({data_size} bytes{', encrypted' if encrypt else ''})")
+        
+        url = None if encrypt else get_presigned_url(object_name, bucket_name, expires_hours=24)
         
         return {
             "bucket": bucket_name,
@@ -170,6 +210,7 @@ def upload_bytes(
             "size": data_size,
             "content_type": content_type,
             "url": url,
+            "encrypted": bool(encrypt),
             "uploaded_at": datetime.utcnow().isoformat()
         }
         
@@ -195,9 +236,16 @@ def download_file(
         مسار الملف المحلي
     """
     try:
-        client = get_minio_client()
-        
-        client.fget_object(bucket_name, object_name, destination_path)
+        tmp_path = f"{destination_path}.part"
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in iter_object(object_name, bucket_name):
+                    f.write(chunk)
+            os.replace(tmp_path, destination_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
         
         logger.info(f"File downloaded: {object_name} -> {destination_path}")
         return destination_path
@@ -206,6 +254,38 @@ def download_file(
         logger.error(f"Failed to download file {object_name}: {e}")
         raise
 
+def iter_object(
+    object_name: str,
+    bucket_name: str = MINIO_BUCKET,
+    chunk_size: int = DOWNLOAD_CHUNK_SIZE
+) -> Iterator[bytes]:
+    """
+    تنزيل كائن كتدفق أجزاء (للردود المتدفقة)، مع فك التشفير آلياً للكائنات المشفرة
+    
+    Args:
+        object_name: اسم الكائن
+        bucket_name: اسم Bucket
+        chunk_size: حجم الجزء المقروء من الشبكة
+    
+    Yields:
+        محتوى الكائن الأصلي جزءاً جزءاً
+    
+    Raises:
+        StreamDecryptionError: إذا كان المحتوى المشفر معدّلاً أو مقتطعاً
+    """
+    client = get_minio_client()
+    response = client.get_object(bucket_name, object_name)
+    try:
+        encrypted = response.headers.get(ENCRYPTION_METADATA_KEY) is not None
+        if encrypted:
+            from .crypto_stream import decrypt_stream
+            yield from decrypt_stream(response)
+        else:
+            yield from response.stream(chunk_size)
+    finally:
+        response.close()
+        response.release_conn()
+
 def download_file_to_tmp(
     object_name: str,
     bucket_name: str = MINIO_BUCKET
@@ -253,12 +333,7 @@ def get_object_bytes(
         محتوى الملف
     """
     try:
-        client = get_minio_client()
-        
-        response = client.get_object(bucket_name, object_name)
-        data = response.read()
-        response.close()
-        response.release_conn()
+        data = b"".join(iter_object(object_name, bucket_name))
         
         logger.info(f"Object bytes retrieved: {object_name} ({len(data)} bytes)")
         return data
@@ -422,6 +497,64 @@ def get_object_info(
         logger.error(f"Failed to get object info {object_name}: {e}")
         raise
 
+def reencrypt_objects(
+    start_after: Optional[str] = None,
+    bucket_name: str = MINIO_BUCKET,
+    limit: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    إعادة تشفير الكائنات المشفرة التي غُلّف مفتاح بياناتها بمفتاح Fernet قديم (بعد التدوير)
+    
+    كل كائن يُقرأ ويُعاد تشفيره ويُرفع بنفس الاسم تدفقياً (ذاكرة ثابتة)؛ الاستبدال ذري في S3.
+    
+    Args:
+        start_after: الاستئناف بعد اسم الكائن هذا (ترتيب أبجدي)
+        bucket_name: اسم Bucket
+        limit: حد أقصى لعدد الكائنات في هذا الاستدعاء (None = حتى النهاية)
+    
+    Returns:
+        { "scanned", "rotated", "failed", "last_key", "completed" }
+    """
+    from .crypto_stream import ENCRYPTION_SCHEME, reencrypting_reader
+    
+    client = get_minio_client()
+    scanned = rotated = failed = 0
+    last_key = start_after
+    completed = True
+    for obj in client.list_objects(bucket_name, recursive=True, start_after=start_after):
+        if limit is not None and scanned >= limit:
+            completed = False
+            break
+        scanned += 1
+        last_key = obj.object_name
+        try:
+            stat = client.stat_object(bucket_name, obj.object_name)
+            if stat.metadata.get(ENCRYPTION_METADATA_KEY) is None:
+                continue
+            response = client.get_object(bucket_name, obj.object_name)
+            try:
+                reader = reencrypting_reader(response, stat.size)
+                if reader is None:
+                    continue
+                client.put_object(
+                    bucket_name,
+                    obj.object_name,
+                    reader,
+                    reader.size,
+                    content_type=stat.content_type,
+                    metadata={ENCRYPTION_METADATA_KEY: ENCRYPTION_SCHEME},
+                )
+                rotated += 1
+            finally:
+                response.close()
+                response.release_conn()
+        except Exception as e:
+            failed += 1
+            logger.error(f"Failed to re-encrypt object {obj.object_name}: {e}")
+    
+    logger.info(f"Object re-encryption in {bucket_name}: scanned={scanned} rotated={rotated} failed={failed}")
+    return {"scanned": scanned, "rotated": rotated, "failed": failed, "last_key": last_key, "completed": completed}
+
 # ═══ Cleanup Operations ═══
 def move_to_quarantine(
     object_name: str,
@@ -137,18 +137,24 @@ def connector_sync(self, connector_id: str, action: str, payload: Dict[str, Any]
         نتيجة المزامنة
     """
     try:
-        from .connectors import get_connector
+        from .connectors import get_fresh_connector
+        from . import db
         
         logger.info(f"Connector sync: {connector_id} - {action}")
         
-        connector = get_connector(connector_id)
+        connector = asyncio.run(get_fresh_connector(connector_id))
         
         if action == "send":
-            result = connector.send(payload)
+            result = asyncio.run(connector.send(payload))
         elif action == "fetch":
-            result = connector.fetch(payload)
+            result = asyncio.run(connector.fetch(payload))
         elif action == "sync":
-            result = connector.sync()
+            # مزامنة تزايدية: استئناف من آخر مؤشر محفوظ ما لم يُطلب full=True
+            cursor = None if payload.get("full") else db.get_connector_cursor(connector_id)
+            result = asyncio.run(connector.sync(cursor))
+            if result.get("cursor"):
+                db.set_connector_cursor(connector_id, result["cursor"])
+            logger.info(f"Connector {connector_id} synced {len(result['changes'])} changes (full={result['full']})")
         else:
             raise ValueError(f"Unknown action: {action}")
         
@@ -159,24 +165,80 @@ def connector_sync(self, connector_id: str, action: str, payload: Dict[str, Any]
         logger.error(f"Connector sync failed: {connector_id} - {exc}")
         raise
 
+@celery_app.task(
+    bind=True,
+    base=CallbackTask,
+    name="manus_pro_server.tasks.connector_fanout",
+)
+def connector_fanout(
+    self,
+    connector_ids: list,
+    payload: Dict[str, Any],
+    timeout: float = 30.0,
+    overrides: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """
+    نشر نفس الحمولة إلى عدة موصلات بالتوازي
+    
+    Args:
+        connector_ids: معرفات الموصلات الوجهة (تُزال المكررات)
+        payload: البيانات المشتركة
+        timeout: المهلة لكل موصل بالثواني
+        overrides: حقول خاصة لكل موصل تُدمج فوق payload
+    
+    Returns:
+        التقرير المُجمّع (نجاح/فشل/غير معروف عند انتهاء المهلة لكل موصل)
+    """
+    try:
+        from .connectors import get_fresh_connector
+        from .connectors.fanout import fan_out_send
+        
+        connector_ids = list(dict.fromkeys(connector_ids))
+        logger.info(f"Connector fan-out to {len(connector_ids)} connectors")
+        
+        async def run_fanout() -> Dict[str, Any]:
+            # كل معرّف يُحلّ داخل مهمة إرساله: موصل غير معروف أو فشل تحديث رمزه يظهر كفشل لوجهته فقط
+            return await fan_out_send(
+                connector_ids,
+                payload,
+                timeout=timeout,
+                overrides=overrides,
+                resolve=get_fresh_connector,
+                on_result=lambda r: logger.info(
+                    f"Fan-out {r['connector_id']}: {'ok' if r['success'] else r.get('error')} in {r['elapsed']:.2f}s"
+                ),
+            )
+        
+        report = asyncio.run(run_fanout())
+        
+        logger.info(f"Connector fan-out completed: {report['succeeded']}/{report['total']} in {report['elapsed']:.2f}s")
+        return report
+        
+    except Exception as exc:
+        logger.error(f"Connector fan-out failed: {exc}")
+        raise
+
 @celery_app.task(
     bind=True,
     base=CallbackTask,
     name="manus_pro_server.tasks.refresh_connector_tokens",
 )
-def refresh_connector_tokens(self) -> Dict[str, Any]:
+def refresh_connector_tokens(self, window_seconds: int = 600) -> Dict[str, Any]:
     """
-    تحديث رموز OAuth للموصلات
+    تحديث رموز OAuth للموصلات التي تنتهي خلال النافذة الزمنية فقط
+    
+    Args:
+        window_seconds: نافذة الانتهاء بالثواني (أكبر من فترة beat)
     
     Returns:
         عدد الموصلات المحدثة
     """
     try:
-        from .connectors import refresh_all_tokens
+        from .token_refresh import refresh_all_tokens
         
-        logger.info("Refreshing connector OAuth tokens")
+        logger.info(f"Refreshing connector OAuth tokens expiring within {window_seconds}s")
         
-        refreshed_count = refresh_all_tokens()
+        refreshed_count = refresh_all_tokens(window_seconds)
         
         logger.info(f"Refreshed {refreshed_count} connector tokens")
         return {"refreshed": refreshed_count}
@@ -185,6 +247,39 @@ def refresh_connector_tokens(self) -> Dict[str, Any]:
         logger.error(f"Token refresh failed: {exc}")
         raise
 
+@celery_app.task(
+    bind=True,
+    base=CallbackTask,
+    name="manus_pro_server.tasks.reencrypt_secrets",
+)
+def reencrypt_secrets(self, batch_size: int = 200, pause: float = 0.05, rotate: bool = False) -> Dict[str, Any]:
+    """
+    إعادة تشفير الإعدادات ورموز OAuth وإعدادات الموصلات بالمفتاح الأساسي الحالي
+    
+    Args:
+        batch_size: عدد الصفوف في كل دفعة
+        pause: ثوانٍ بين الدفعات (لتخفيف الحمل على قاعدة البيانات)
+        rotate: إنشاء مفتاح أساسي جديد قبل البدء
+    
+    Returns:
+        تقدم كل جدول وهل اكتملت إعادة التشفير
+    """
+    try:
+        from . import crypto
+        from .key_rotation import reencrypt_all
+        
+        if rotate:
+            crypto.rotate_key()
+        
+        result = reencrypt_all(batch_size=batch_size, pause=pause)
+        
+        logger.info(f"Secrets re-encryption finished: completed={result['completed']}")
+        return result
+        
+    except Exception as exc:
+        logger.error(f"Secrets re-encryption failed: {exc}")
+        raise
+
 # ═══ Cleanup Tasks ═══
 @celery_app.task(
     bind=True,
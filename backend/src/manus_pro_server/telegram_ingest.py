@@ -0,0 +1,216 @@
+# محرك استقبال تحديثات تيلجرام لنظام mkh_Manus:
+# - Long polling عبر getUpdates مع timeout بدلاً من الاستطلاع المتكرر من الخارج.
+# - حفظ الإزاحة (offset) في قاعدة البيانات بعد معالجة الدفعة فقط، للاستئناف بعد إعادة التشغيل.
+# - مستقبل Webhook بديل يغذي نفس الطابور.
+# - طابور محدود الحجم مع إزالة التكرار، ومستهلك يحوّل الرسائل إلى مهام.
+# - المهام تُنشأ فقط لمحادثات/مستخدمين في TELEGRAM_ALLOWED_CHAT_IDS/USER_IDS (الفارغ يرفض الجميع).
+
+from __future__ import annotations
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from . import db
+from .config import TELEGRAM_ALLOWED_CHAT_IDS, TELEGRAM_ALLOWED_USER_IDS
+from .connectors.telegram import TelegramConnector
+from .logging_config import get_logger
+from .workspace_fs import task_workspace
+
+logger = get_logger(__name__)
+
+OFFSET_CURSOR_NAME = "telegram_offset"
+TASK_COMMAND_PREFIX = "/task"
+
+def _is_allowed_sender(update: Dict[str, Any]) -> bool:
+    """المحادثة أو المرسل في قائمة السماح (المهام تشغّل الوكيل الذي ينفّذ الشيفرة)."""
+    return update.get("chat_id") in TELEGRAM_ALLOWED_CHAT_IDS or update.get("from_id") in TELEGRAM_ALLOWED_USER_IDS
+
+def _create_task_from_update(update: Dict[str, Any]) -> Optional[str]:
+    """إنشاء مهمة من رسالة تبدأ بـ /task (الافتراضي) من مرسل مسموح له فقط."""
+    text = (update.get("text") or "").strip()
+    if not text.startswith(TASK_COMMAND_PREFIX):
+        return None
+    goal = text[len(TASK_COMMAND_PREFIX):].strip()
+    if not goal:
+        return None
+    if not _is_allowed_sender(update):
+        logger.warning(
+            f"Dropped Telegram /task from chat {update.get('chat_id')} user {update.get('from_id')} "
+            f"(update {update.get('update_id')}): sender not in TELEGRAM_ALLOWED_CHAT_IDS/USER_IDS"
+        )
+        return None
+    task_id = f"task_{uuid.uuid4().hex[:12]}"
+    db.create_task(task_id, goal, str(task_workspace(task_id)), 1_000_000)
+    db.add_event(task_id, "info", "task.queued", "Task created from Telegram", data={
+        "chat_id": update.get("chat_id"),
+        "from": update.get("from"),
+        "update_id": update.get("update_id"),
+    })
+    return task_id
+
+class TelegramIngestor:
+    """
+    يجمع التحديثات من long polling أو webhook في طابور واحد ويستهلكها.
+
+    التسليم at-least-once: لا تُحفظ الإزاحة ولا يُطلب getUpdates التالي (الذي يؤكد الاستلام لتيلجرام)
+    إلا بعد معالجة الدفعة كاملة؛ التحديثات المكررة (إعادة إرسال webhook) تُزال عبر update_id.
+    التحديث الذي يفشل handler في معالجته يُسجَّل في stats["errors"] ولا يُعاد.
+    """
+
+    def __init__(
+        self,
+        connector_id: str,
+        connector: Optional[TelegramConnector] = None,
+        queue_size: int = 1000,
+        handler: Optional[Callable[[Dict[str, Any]], Optional[str]]] = _create_task_from_update,
+        dedupe_window: int = 10_000,
+    ):
+        self.connector_id = connector_id
+        self.connector = connector
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.handler = handler
+        self.dedupe_window = dedupe_window
+        self._seen: "OrderedDict[int, None]" = OrderedDict()
+        self._consumer: Optional[asyncio.Task] = None
+        self.stats = {"received": 0, "duplicates": 0, "handled": 0, "tasks_created": 0, "errors": 0}
+
+    # --- Queue ---
+    async def submit(self, update: Dict[str, Any]) -> bool:
+        """إدخال تحديث خام في الطابور (False إذا كان مكرراً)."""
+        update_id = update.get("update_id")
+        if update_id is not None:
+            if update_id in self._seen:
+                self.stats["duplicates"] += 1
+                return False
+            self._seen[update_id] = None
+            if len(self._seen) > self.dedupe_window:
+                self._seen.popitem(last=False)
+        self.stats["received"] += 1
+        await self.queue.put(TelegramConnector.normalize_update(update))
+        return True
+
+    async def run_consumer(self, stop: Optional[asyncio.Event] = None) -> None:
+        """استهلاك الطابور وتمرير كل تحديث إلى handler."""
+        while stop is None or not stop.is_set():
+            try:
+                update = await asyncio.wait_for(self.queue.get(), timeout=1.0)
+            except asyncio.TimeoutError:
+                continue
+            try:
+                if self.handler is not None and self.handler(update):
+                    self.stats["tasks_created"] += 1
+                self.stats["handled"] += 1
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Telegram update {update.get('update_id')} handling failed: {e}")
+            finally:
+                self.queue.task_done()
+
+    def ensure_consumer(self) -> None:
+        """تشغيل المستهلك في الخلفية إن لم يكن يعمل (لمسار الـ webhook)."""
+        if self._consumer is None or self._consumer.done():
+            self._consumer = asyncio.get_running_loop().create_task(self.run_consumer())
+
+    async def close(self) -> None:
+        if self._consumer is not None:
+            self._consumer.cancel()
+            try:
+                await self._consumer
+            except asyncio.CancelledError:
+                pass
+            self._consumer = None
+
+    # --- Long polling ---
+    def load_offset(self) -> int:
+        cursor = db.get_connector_cursor(self.connector_id, OFFSET_CURSOR_NAME)
+        return int(cursor) if cursor else 0
+
+    def commit_offset(self, offset: int) -> None:
+        db.set_connector_cursor(self.connector_id, str(offset), OFFSET_CURSOR_NAME)
+
+    async def poll_once(self, offset: int, timeout: int = 30, limit: int = 100) -> int:
+        """
+        دورة long poll واحدة: جلب دفعة، إدخالها في الطابور، انتظار معالجتها، ثم حفظ الإزاحة.
+
+        Returns:
+            الإزاحة التالية
+        """
+        self.ensure_consumer()
+        updates = await self.connector.get_updates(offset=offset, limit=limit, timeout=timeout)
+        for update in updates:
+            await self.submit(update)
+            offset = max(offset, int(update["update_id"]) + 1)
+        if updates:
+            # الإزاحة تعني "تمت المعالجة"، فلا تُحفظ قبل أن يفرغ المستهلك من الدفعة
+            await self.queue.join()
+            self.commit_offset(offset)
+        return offset
+
+    async def run_long_poll(self, stop: Optional[asyncio.Event] = None, timeout: int = 30, limit: int = 100) -> None:
+        """حلقة long polling مستمرة مع backoff عند الأخطاء."""
+        if self.connector is None:
+            raise ValueError("Long polling requires a TelegramConnector")
+        offset = self.load_offset()
+        backoff = 1.0
+        logger.info(f"Telegram long polling started for {self.connector_id} at offset {offset}")
+        while stop is None or not stop.is_set():
+            try:
+                offset = await self.poll_once(offset, timeout=timeout, limit=limit)
+                backoff = 1.0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Telegram long poll failed: {e}; retrying in {backoff:.0f}s")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60.0)
+
+# --- Webhook ingestors (per registered Telegram connector, lazily created) ---
+_ingestors: Dict[str, TelegramIngestor] = {}
+
+def get_ingestor(connector_id: str) -> TelegramIngestor:
+    """
+    الحصول على مستقبل webhook لموصل (يُنشأ عند أول استخدام).
+
+    Raises:
+        LookupError: إذا لم يكن connector_id موصل تيلجرام مسجلاً، فلا يُنشأ مستقبل لمعرّفات عشوائية
+    """
+    ingestor = _ingestors.get(connector_id)
+    if ingestor is None:
+        record = db.get_connector_record(connector_id)
+        if record is None or record.get("type") != "telegram":
+            raise LookupError(f"Telegram connector '{connector_id}' not found")
+        ingestor = _ingestors[connector_id] = TelegramIngestor(connector_id)
+    ingestor.ensure_consumer()
+    return ingestor
+
+async def shutdown() -> None:
+    """إيقاف جميع مستهلكي الـ webhook."""
+    for ingestor in list(_ingestors.values()):
+        await ingestor.close()
+    _ingestors.clear()
+
+async def main() -> None:
+    """تشغيل long polling لبوت TELEGRAM_BOT_TOKEN كعملية مستقلة."""
+    token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if not token:
+        raise SystemExit("TELEGRAM_BOT_TOKEN is not set")
+    connector_id = os.getenv("TELEGRAM_CONNECTOR_ID", "telegram_default")
+    db.init_db()
+
+    connector = TelegramConnector(connector_id, "Telegram", {"token": token})
+    ingestor = TelegramIngestor(connector_id, connector)
+    t0 = time.time()
+    try:
+        await ingestor.run_long_poll()
+    finally:
+        await ingestor.close()
+        logger.info(f"Telegram ingestor stopped after {time.time() - t0:.0f}s: {ingestor.stats}")
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("Telegram ingestor stopped by user.")
@@ -0,0 +1,165 @@
+# مجدول التحديث الاستباقي لرموز OAuth لنظام mkh_Manus:
+# - يستعلم فقط عن الرموز التي تنتهي خلال نافذة زمنية (فهرس oauth_tokens.expires_at).
+# - يجمع التحديثات حسب المزوّد وينفذها بالتوازي مع حد تزامن لكل مزوّد.
+# - Single-flight: المحاولات المتزامنة لتحديث نفس الموصل تشترك في طلب واحد.
+# - بين العمليات (beat وعمال uvicorn ومهام connector_sync): حجز مؤقت في oauth_tokens،
+#   ومن ينتظره يعيد قراءة الرمز الذي حدّثه غيره بدلاً من استخدام refresh_token القديم.
+
+from __future__ import annotations
+import asyncio
+import os
+import socket
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from . import db
+from .connectors import registry
+from .logging_config import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_REFRESH_WINDOW_SEC = 600  # ضعف فترة beat (5 دقائق) لتجنب تفويت أي رمز
+DEFAULT_PROVIDER_CONCURRENCY = 4
+REFRESH_LEASE_SEC = 60  # أطول من طلب التحديث HTTP مع إعادة المحاولة
+REFRESH_WAIT_INTERVAL_SEC = 0.2
+_OWNER_PREFIX = f"{socket.gethostname()}:{os.getpid()}"
+
+def expiry_iso(expires_in: float) -> str:
+    """وقت الانتهاء بنفس تنسيق ISO المخزّن في قاعدة البيانات (قابل للمقارنة نصياً)."""
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + float(expires_in)))
+
+class SingleFlight:
+    """
+    دمج الاستدعاءات المتزامنة لنفس المفتاح في تنفيذ واحد.
+    كل المنتظرين يحصلون على نفس النتيجة (أو نفس الاستثناء).
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            # تجنب تحذير "exception was never retrieved" عند عدم وجود منتظرين
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+_single_flight = SingleFlight()
+
+async def _do_refresh(connector_id: str) -> Dict[str, Any]:
+    before = db.get_oauth_token(connector_id)
+    if before is None or not before.get("refresh_token"):
+        raise ValueError(f"Connector {connector_id} has no refreshable token")
+
+    owner = f"{_OWNER_PREFIX}:{uuid.uuid4().hex[:8]}"
+    # حجز عملية متوقفة ينتهي خلال REFRESH_LEASE_SEC (+ تقريب الثواني في التخزين)
+    deadline = time.monotonic() + REFRESH_LEASE_SEC + 2
+    while not db.claim_oauth_refresh(connector_id, owner, REFRESH_LEASE_SEC):
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"OAuth refresh for connector {connector_id} is held by another process")
+        await asyncio.sleep(REFRESH_WAIT_INTERVAL_SEC)
+    try:
+        token = db.get_oauth_token(connector_id)
+        if token is not None and token["access_token"] != before["access_token"]:
+            # حدّثته عملية أخرى أثناء الانتظار؛ refresh_token الذي قرأناه ربما دُوّر وأُبطل
+            registry.invalidate(connector_id)
+            logger.info(f"OAuth token for connector {connector_id} was refreshed by another process")
+            return {"connector_id": connector_id, "access_token": token["access_token"], "expires_at": token["expires_at"]}
+        return await _refresh_with(connector_id, token)
+    finally:
+        db.release_oauth_refresh(connector_id, owner)
+
+async def _refresh_with(connector_id: str, token: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    record = db.get_connector_record(connector_id)
+    if record is None or token is None or not token.get("refresh_token"):
+        raise ValueError(f"Connector {connector_id} has no refreshable token")
+
+    config = {**record["config"], "access_token": token["access_token"], "refresh_token": token["refresh_token"]}
+    connector = registry.create(record["type"], connector_id, record["name"], config)
+    try:
+        tokens = await connector.refresh_access_token()
+    finally:
+        connector.close()
+
+    expires_at = expiry_iso(tokens.get("expires_in", 3600))
+    db.save_oauth_token(connector_id, tokens["access_token"], tokens.get("refresh_token"), expires_at)
+    registry.invalidate(connector_id)
+    logger.info(f"Refreshed OAuth token for connector {connector_id} (expires {expires_at})")
+    return {"connector_id": connector_id, "access_token": tokens["access_token"], "expires_at": expires_at}
+
+async def refresh_connector_token(connector_id: str) -> Dict[str, Any]:
+    """تحديث رمز موصل واحد؛ الطلبات المتزامنة لنفس الموصل تشترك في تحديث واحد."""
+    return await _single_flight.do(connector_id, lambda: _do_refresh(connector_id))
+
+async def ensure_fresh_token(connector_id: str, skew_seconds: float = 60) -> Optional[str]:
+    """
+    إرجاع Access Token صالح، مع تحديثه أولاً إذا كان سينتهي خلال skew_seconds.
+    مخصص لمسارات الطلبات (عبر connectors.get_fresh_connector): عند تزامن عدة طلبات لا يحدث إلا تحديث واحد.
+    """
+    token = db.get_oauth_token(connector_id)
+    if token is None:
+        return None
+    if token.get("expires_at") and token["expires_at"] < expiry_iso(skew_seconds) and token.get("refresh_token"):
+        return (await refresh_connector_token(connector_id))["access_token"]
+    return token["access_token"]
+
+async def refresh_expiring_tokens(
+    window_seconds: float = DEFAULT_REFRESH_WINDOW_SEC,
+    provider_concurrency: int = DEFAULT_PROVIDER_CONCURRENCY,
+    limit: int = 1000,
+) -> Dict[str, Any]:
+    """
+    تحديث الرموز التي تنتهي خلال window_seconds فقط، مجمّعة حسب المزوّد.
+
+    Returns:
+        { "candidates", "refreshed", "failed", "providers": {type: refreshed_count} }
+    """
+    expiring = db.list_expiring_tokens(expiry_iso(window_seconds), limit=limit)
+    by_provider: Dict[str, List[str]] = defaultdict(list)
+    for row in expiring:
+        by_provider[row["type"]].append(row["connector_id"])
+
+    async def refresh_provider(connector_ids: List[str]) -> List[bool]:
+        semaphore = asyncio.Semaphore(provider_concurrency)
+
+        async def one(connector_id: str) -> bool:
+            async with semaphore:
+                try:
+                    await refresh_connector_token(connector_id)
+                    return True
+                except Exception as e:
+                    logger.error(f"Token refresh failed for connector {connector_id}: {e}")
+                    return False
+
+        return await asyncio.gather(*(one(cid) for cid in connector_ids))
+
+    providers = list(by_provider)
+    outcomes = await asyncio.gather(*(refresh_provider(by_provider[p]) for p in providers))
+    per_provider = {p: sum(results) for p, results in zip(providers, outcomes)}
+    refreshed = sum(per_provider.values())
+    return {
+        "candidates": len(expiring),
+        "refreshed": refreshed,
+        "failed": len(expiring) - refreshed,
+        "providers": per_provider,
+    }
+
+def refresh_all_tokens(window_seconds: float = DEFAULT_REFRESH_WINDOW_SEC) -> int:
+    """نقطة دخول متزامنة (Celery beat): تحديث الرموز القريبة من الانتهاء وإرجاع عددها."""
+    report = asyncio.run(refresh_expiring_tokens(window_seconds))
+    if report["failed"]:
+        logger.warning(f"Token refresh: {report['failed']} of {report['candidates']} failed")
+    return report["refreshed"]
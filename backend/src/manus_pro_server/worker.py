@@ -7,6 +7,8 @@
 from __future__ import annotations
 import asyncio
 import math
+import os
+import socket
 import time
 import traceback
 from typing import Any, Dict, Optional
@@ -19,6 +21,8 @@ from .config import (
     API_KEY_SLOTS,
 )
 from .openmanus_bridge import run_openmanus_cycle
+from .workspace_fs import is_task_workspace
+from .workspace_snapshots import snapshot_store
 from .logging_config import get_logger
 
 logger = get_logger(__name__)
@@ -27,6 +31,18 @@ def _now_iso() -> str:
     """الحصول على الوقت الحالي بتنسيق ISO 8601."""
     return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
 
+async def _snapshot_workspace(task: Dict[str, Any], label: str) -> Optional[str]:
+    """لقطة لمجلد المهمة الخاص (لا تُفشل الدورة إذا تعذرت)."""
+    if not is_task_workspace(task["project_path"]):
+        # مهمة قديمة على الـ Workspace المشترك: لا لقطات لأن استعادتها تمس ملفات مهام أخرى
+        return None
+    try:
+        snapshot = await asyncio.to_thread(snapshot_store.create, task["project_path"], task["id"], label)
+        return snapshot["id"]
+    except Exception as e:
+        logger.warning(f"Workspace snapshot failed for task {task['id']}: {e}")
+        return None
+
 async def process_one_cycle(task: Dict[str, Any]) -> None:
     """معالجة دورة عمل واحدة لمهمة محددة."""
     task_id = task["id"]
@@ -39,10 +55,7 @@ async def process_one_cycle(task: Dict[str, Any]) -> None:
         return
 
     # 2. تحميل مفاتيح API
-    available_keys = {}
-    for slot in API_KEY_SLOTS:
-        val = db.get_setting(slot)
-        if val: available_keys[slot] = val
+    available_keys = {slot: val for slot, val in db.get_settings(API_KEY_SLOTS).items() if val}
     
     if not available_keys:
         db.update_task_fields(task_id, status="waiting", last_error="No API keys configured.")
@@ -51,13 +64,16 @@ async def process_one_cycle(task: Dict[str, Any]) -> None:
         return
 
     # 3. بدء أو استئناف المهمة
+    state = task["state_json"]
     if not task.get("started_at"):
         db.update_task_fields(task_id, status="running", started_at=_now_iso())
+        # لقطة أساس قبل أي تعديل من الوكيل
+        state["baseline_snapshot_id"] = await _snapshot_workspace(task, "baseline")
+        db.set_task_state(task_id, state)
         db.add_event(task_id, "info", "task.started", "Task execution started.")
         logger.info(f"Task {task_id} started.")
 
     # 4. تنفيذ دورة العمل عبر الجسر
-    state = task["state_json"]
     prior_messages = state.get("openmanus", {}).get("messages", [])
     
     t0 = time.time()
@@ -80,7 +96,8 @@ async def process_one_cycle(task: Dict[str, Any]) -> None:
 
     state.setdefault("checkpoints", [])
     state["openmanus"]["messages"] = res.messages
-    state["checkpoints"].append({"ts": _now_iso(), "duration": duration, "finished": res.finished})
+    snapshot_id = await _snapshot_workspace(task, f"checkpoint {len(state['checkpoints']) + 1}")
+    state["checkpoints"].append({"ts": _now_iso(), "duration": duration, "finished": res.finished, "snapshot_id": snapshot_id})
     
     token_total = int(task.get("token_total") or 0) + res.token_total_delta
     steps_done = int(task.get("steps_done") or 0) + CYCLE_STEPS_DEFAULT
@@ -114,16 +131,20 @@ async def process_one_cycle(task: Dict[str, Any]) -> None:
 async def main() -> None:
     """نقطة الدخول الرئيسية للعامل."""
     db.init_db()
-    logger.info("mkh_Manus Task Worker started and ready.")
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    logger.info(f"mkh_Manus Task Worker {worker_id} started and ready.")
     
     while True:
         try:
-            task = db.fetch_next_runnable_task()
+            task = db.fetch_next_runnable_task(worker_id)
             if not task:
                 await asyncio.sleep(RUNTIME_POLL_INTERVAL_SEC)
                 continue
             
-            await process_one_cycle(task)
+            try:
+                await process_one_cycle(task)
+            finally:
+                db.release_task_claim(task["id"], worker_id)
             
         except Exception as e:
             logger.error(f"Worker critical error: {str(e)}")
@@ -8,11 +8,16 @@
 
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import mmap
 import os
+import uuid
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import AsyncIterator, BinaryIO, Dict, Iterator, List, Optional, Tuple
 
-from .config import WORKSPACE_ROOT
+from . import db
+from .config import MAX_UPLOAD_SIZE, WORKSPACE_ROOT
 
 def _resolve_in_workspace(user_path: str) -> Path:
     """
@@ -23,6 +28,28 @@ def _resolve_in_workspace(user_path: str) -> Path:
         raise ValueError("محاولة وصول خارج الـ Workspace (مرفوض).")
     return p
 
+def workspace_rel_path(user_path: str) -> str:
+    """المسار النسبي الآمن (بصيغة POSIX، و"." للجذر) كما يُستخدم في فهرس الـ Workspace."""
+    p = _resolve_in_workspace(user_path)
+    return str(p.relative_to(WORKSPACE_ROOT)).replace("\\", "/")
+
+TASK_WORKSPACES_DIR = "tasks"
+
+def task_workspace(task_id: str) -> Path:
+    """مجلد عمل خاص بالمهمة داخل الـ Workspace (جذر لقطاتها واستعادتها)."""
+    p = _resolve_in_workspace(f"{TASK_WORKSPACES_DIR}/{task_id}")
+    p.mkdir(parents=True, exist_ok=True)
+    return p
+
+def is_task_workspace(path: str) -> bool:
+    """هل المسار مجلد مهمة خاص (لا الـ Workspace المشترك كله)؟"""
+    return Path(path).resolve().parent == WORKSPACE_ROOT / TASK_WORKSPACES_DIR
+
+def paths_overlap(a: str, b: str) -> bool:
+    """هل أحد المسارين هو الآخر أو داخله؟"""
+    pa, pb = Path(a).resolve(), Path(b).resolve()
+    return pa == pb or pa in pb.parents or pb in pa.parents
+
 def list_dir(user_path: str) -> Dict:
     p = _resolve_in_workspace(user_path)
     if not p.exists():
@@ -46,26 +73,121 @@ def list_dir(user_path: str) -> Dict:
         )
     return {"path": str(p.relative_to(WORKSPACE_ROOT)).replace("\\", "/"), "items": items}
 
-def read_file(user_path: str, max_bytes: int = 1_000_000) -> Dict:
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def _decode(data: bytes, partial: bool = False) -> str:
+    # نفترض UTF-8 مع fallback
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        if partial:
+            # حدود النطاق قد تقطع حرفاً متعدد البايتات
+            return data.decode("utf-8", errors="replace")
+        return data.decode("latin-1", errors="replace")
+
+def _read_range(p: Path, start: int, end: int) -> bytes:
+    """قراءة [start, end) عبر mmap: الذاكرة المستخدمة بحجم النطاق فقط وليس الملف."""
+    if end <= start:
+        return b""
+    with p.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return mm[start:end]
+
+def read_file(
+    user_path: str,
+    max_bytes: int = 1_000_000,
+    offset: int = 0,
+    length: Optional[int] = None,
+    tail: bool = False,
+) -> Dict:
+    """
+    قراءة ملف كاملاً أو نطاقاً منه.
+
+    Args:
+        max_bytes: الحد الأقصى للبايتات المُعادة (يُفحص من stat قبل أي قراءة)
+        offset: بداية النطاق (يُتجاهل مع tail)
+        length: طول النطاق؛ None مع offset=0 وبدون tail يعني الملف كاملاً
+        tail: قراءة آخر length بايت (لملفات السجلات) بدءاً من أول سطر كامل
+    """
     p = _resolve_in_workspace(user_path)
     if not p.exists():
         raise FileNotFoundError("الملف غير موجود.")
     if not p.is_file():
         raise IsADirectoryError("المسار ليس ملفاً.")
-    data = p.read_bytes()
-    if len(data) > max_bytes:
-        raise ValueError("حجم الملف كبير جداً للعرض عبر الواجهة (ارفع الحد أو استخدم RAG).")
-    # نفترض UTF-8 مع fallback
-    try:
-        text = data.decode("utf-8")
-    except UnicodeDecodeError:
-        text = data.decode("latin-1", errors="replace")
+    size = p.stat().st_size
+    ranged = tail or offset > 0 or length is not None
+    if not ranged:
+        if size > max_bytes:
+            raise ValueError("حجم الملف كبير جداً للعرض عبر الواجهة (ارفع الحد أو استخدم RAG).")
+        length = size
+    if offset < 0 or (length is not None and length < 0):
+        raise ValueError("نطاق غير صالح.")
+    length = min(max_bytes if length is None else length, max_bytes)
+
+    if tail:
+        start = max(0, size - length)
+        data = _read_range(p, start, size)
+        if start > 0:
+            # تجاهل السطر المقطوع في البداية
+            newline = data.find(b"\n")
+            if newline != -1:
+                start += newline + 1
+                data = data[newline + 1:]
+    else:
+        start = min(offset, size)
+        data = _read_range(p, start, min(size, start + length))
+
     return {
         "path": str(p.relative_to(WORKSPACE_ROOT)).replace("\\", "/"),
-        "size_bytes": len(data),
-        "content": text,
+        "size_bytes": size,
+        "offset": start,
+        "length": len(data),
+        "eof": start + len(data) >= size,
+        "content": _decode(data, partial=ranged),
     }
 
+def parse_range_header(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    تحليل ترويسة Range بصيغة bytes=start-end أو bytes=start- أو bytes=-suffix.
+
+    Returns:
+        (start, end) شاملاً للنهاية، أو None إذا لم تُرسل ترويسة
+
+    Raises:
+        ValueError: نطاق غير صالح أو غير قابل للتحقيق (416)
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        raise ValueError("Unsupported range")
+    first, _, last = spec.strip().partition("-")
+    if not first:
+        suffix = int(last)
+        if suffix <= 0:
+            raise ValueError("Unsatisfiable range")
+        start, end = max(0, size - suffix), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("Unsatisfiable range")
+    return start, end
+
+def iter_file_range(user_path: str, start: int = 0, end: Optional[int] = None,
+                    chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """بث [start, end] شاملاً على دفعات بذاكرة ثابتة."""
+    p = _resolve_in_workspace(user_path)
+    with p.open("rb") as f:
+        f.seek(start)
+        remaining = None if end is None else end - start + 1
+        while remaining is None or remaining > 0:
+            chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
 def write_file(user_path: str, content: str, create_dirs: bool = True) -> Dict:
     p = _resolve_in_workspace(user_path)
     if create_dirs:
@@ -77,3 +199,116 @@ def make_dir(user_path: str) -> Dict:
     p = _resolve_in_workspace(user_path)
     p.mkdir(parents=True, exist_ok=True)
     return {"path": str(p.relative_to(WORKSPACE_ROOT)).replace("\\", "/"), "ok": True}
+
+class UploadTooLarge(ValueError):
+    """تجاوز الملف المرفوع الحد الأقصى المسموح."""
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+def _write_chunk(f: BinaryIO, digest: "hashlib._Hash", chunk: bytes) -> None:
+    digest.update(chunk)
+    f.write(chunk)
+
+FICLONE = 0x40049409  # ioctl لينكس لنسخ reflink
+
+def reflink_file(src: Path, dst: Path) -> bool:
+    """
+    نسخ reflink (مشاركة الكتل copy-on-write على btrfs/xfs)؛ False دون أي نسخ إن لم يدعمه نظام الملفات.
+    """
+    try:
+        import fcntl
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return True
+    except (ImportError, OSError):
+        dst.unlink(missing_ok=True)
+        return False
+
+def _existing_blob(sha256: str, size: int) -> Optional[str]:
+    """مسار ملف موجود بنفس البصمة، بشرط ألا يكون قد تغيّر منذ تسجيله."""
+    blob = db.get_workspace_blob(sha256)
+    if blob is None or blob["size_bytes"] != size:
+        return None
+    try:
+        st = _resolve_in_workspace(blob["path"]).stat()
+    except (OSError, ValueError):
+        return None
+    if st.st_size != size or st.st_mtime_ns != blob["mtime_ns"]:
+        return None
+    return blob["path"]
+
+async def stream_upload(
+    chunks: AsyncIterator[bytes],
+    filename: str,
+    directory: str = "uploads",
+    max_bytes: int = MAX_UPLOAD_SIZE,
+    dedupe: bool = True,
+) -> Dict:
+    """
+    حفظ رفع متدفق داخل الـ Workspace دون حجب حلقة الأحداث.
+
+    - الكتابة إلى ملف مؤقت في نفس المجلد مع حساب SHA-256 أثناء التدفق (في خيط منفصل)
+    - رفض الرفع فور تجاوز max_bytes (UploadTooLarge) وحذف الملف المؤقت
+    - نقل ذري إلى المسار النهائي (os.replace)؛ الملف المطلوب يُنشأ دائماً
+    - إذا كان نفس المحتوى موجوداً مسبقاً يُعاد مساره في duplicate_of، ويُنشأ الملف كنسخة reflink منه
+      (كتل مشتركة copy-on-write: تعديل إحدى النسختين لا يغيّر الأخرى)؛ deduplicated=True فقط عندها.
+      بدون دعم reflink تبقى النسخة المكتوبة كاملة، ويبقى سجل البصمة على النسخة الأصلية
+    """
+    name = Path(filename or "").name
+    if not name or name in (".", ".."):
+        raise ValueError("اسم ملف غير صالح.")
+    target = _resolve_in_workspace(f"{directory.strip('/')}/{name}")
+    await asyncio.to_thread(target.parent.mkdir, parents=True, exist_ok=True)
+    tmp = target.parent / f".{name}.{uuid.uuid4().hex}.part"
+    clone = target.parent / f".{name}.{uuid.uuid4().hex}.part"
+
+    digest = hashlib.sha256()
+    size = 0
+    deduplicated = False
+    f = await asyncio.to_thread(tmp.open, "wb")
+    try:
+        try:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"الملف يتجاوز الحد الأقصى ({max_bytes} بايت).")
+                await asyncio.to_thread(_write_chunk, f, digest, chunk)
+        finally:
+            await asyncio.to_thread(f.close)
+
+        sha256 = digest.hexdigest()
+        rel = str(target.relative_to(WORKSPACE_ROOT)).replace("\\", "/")
+        existing = _existing_blob(sha256, size) if dedupe else None
+        if existing is not None and existing != rel:
+            source = _resolve_in_workspace(existing)
+            # الأصل قد يتغير أثناء النسخ: تُقبل النسخة فقط إن بقي مطابقاً لسجله بعدها
+            deduplicated = await asyncio.to_thread(reflink_file, source, clone) and _existing_blob(sha256, size) == existing
+        if deduplicated:
+            await asyncio.to_thread(os.replace, clone, target)
+            await asyncio.to_thread(tmp.unlink)
+        else:
+            await asyncio.to_thread(os.replace, tmp, target)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    finally:
+        clone.unlink(missing_ok=True)
+
+    if existing is None or existing == rel:
+        # نسخة جديدة، أو استُبدل الملف المسجل نفسه فتغيّر وقت تعديله
+        db.set_workspace_blob(sha256, rel, size, target.stat().st_mtime_ns)
+        existing = None
+    result = {"ok": True, "path": rel, "sha256": sha256, "size_bytes": size, "deduplicated": deduplicated}
+    if existing is not None:
+        result["duplicate_of"] = existing
+    return result
+
+async def iter_upload_file(upload, chunk_size: int = UPLOAD_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """تحويل UploadFile إلى دفعات غير حاجبة."""
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
@@ -0,0 +1,316 @@
+# فهرس شجرة ملفات الـ Workspace في الذاكرة:
+# - يُبنى مرة واحدة عند بدء التشغيل (os.scandir) ثم يُحدّث تدريجياً.
+# - يراقب التغييرات عبر watchdog (inotify على لينكس)، أو بإعادة مسح دورية إن لم تتوفر.
+# - يجيب عن استعراض المجلد والسرد التكراري من الذاكرة مع ترقيم الصفحات.
+# - عدّاد إصدار يزداد مع كل تغيير ليكتشف العميل التغييرات بطلب خفيف.
+
+from __future__ import annotations
+
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from .config import WORKSPACE_ROOT
+from .logging_config import get_logger
+
+logger = get_logger(__name__)
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+    WATCHDOG_AVAILABLE = True
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+    WATCHDOG_AVAILABLE = False
+
+ROOT_KEY = "."
+DEFAULT_RESCAN_INTERVAL_SEC = 5.0
+
+class IndexEntry(NamedTuple):
+    type: str  # "dir" | "file"
+    size_bytes: int
+    mtime: int
+
+def _join(parent: str, name: str) -> str:
+    return name if parent == ROOT_KEY else f"{parent}/{name}"
+
+def _split(rel: str) -> Tuple[str, str]:
+    parent, _, name = rel.rpartition("/")
+    return (parent or ROOT_KEY), name
+
+class _WatchHandler(FileSystemEventHandler):
+    def __init__(self, index: "WorkspaceIndex"):
+        super().__init__()
+        self._index = index
+
+    def on_any_event(self, event) -> None:
+        if event.event_type in ("opened", "closed", "closed_no_write"):
+            return
+        for path in (event.src_path, getattr(event, "dest_path", None)):
+            if path:
+                self._index.refresh_abs(path)
+
+class WorkspaceIndex:
+    """
+    فهرس في الذاكرة: المسار النسبي -> (النوع، الحجم، وقت التعديل).
+    آمن للاستخدام من عدة خيوط (مراقب الملفات + معالجات الطلبات).
+    """
+
+    def __init__(self, root: Path = WORKSPACE_ROOT, rescan_interval: float = DEFAULT_RESCAN_INTERVAL_SEC):
+        self.root = Path(root).resolve()
+        self.rescan_interval = rescan_interval
+        self.version = 0
+        self._entries: Dict[str, IndexEntry] = {}
+        self._children: Dict[str, Set[str]] = {}
+        self._sorted: Dict[str, List[Tuple[str, IndexEntry]]] = {}
+        self._lock = threading.RLock()
+        self._built = False
+        self._observer = None
+        self._stop = threading.Event()
+        self._poller: Optional[threading.Thread] = None
+        self._listeners: List[Callable[[Optional[str]], None]] = []
+
+    def subscribe(self, listener: Callable[[Optional[str]], None]) -> None:
+        """
+        تسجيل مستمع للتغييرات: يُستدعى بالمسار النسبي المتغير،
+        أو بـ None بعد إعادة بناء كاملة غيّرت المحتوى.
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, rel: Optional[str]) -> None:
+        for listener in self._listeners:
+            try:
+                listener(rel)
+            except Exception as e:
+                logger.error(f"Workspace index listener failed: {e}")
+
+    # --- Building ---
+    def _scan(self, rel: str, abs_path: str, entries: Dict[str, IndexEntry], children: Dict[str, Set[str]]) -> None:
+        """مسح تكراري لمجلد (بدون اتباع الروابط الرمزية للمجلدات)."""
+        stack = [(rel, abs_path)]
+        while stack:
+            dir_rel, dir_abs = stack.pop()
+            names = children.setdefault(dir_rel, set())
+            try:
+                it = os.scandir(dir_abs)
+            except OSError:
+                continue
+            with it:
+                for entry in it:
+                    try:
+                        st = entry.stat()
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        continue
+                    child_rel = _join(dir_rel, entry.name)
+                    names.add(entry.name)
+                    entries[child_rel] = IndexEntry("dir" if is_dir else "file", int(st.st_size), int(st.st_mtime))
+                    if is_dir and not entry.is_symlink():
+                        stack.append((child_rel, entry.path))
+
+    def build(self) -> None:
+        """بناء الفهرس كاملاً (يُزاد الإصدار فقط إذا تغيّر المحتوى)."""
+        entries: Dict[str, IndexEntry] = {}
+        children: Dict[str, Set[str]] = {}
+        self._scan(ROOT_KEY, str(self.root), entries, children)
+        with self._lock:
+            changed = entries != self._entries or children != self._children
+            self._entries, self._children = entries, children
+            if changed:
+                self._sorted.clear()
+                self.version += 1
+            self._built = True
+        if changed:
+            self._notify(None)
+        logger.info(f"Workspace index built: {len(entries)} entries (version {self.version})")
+
+    def ensure_built(self) -> None:
+        if not self._built:
+            self.build()
+
+    # --- Incremental updates ---
+    def _remove_locked(self, rel: str) -> None:
+        """حذف مسار وشجرته الفرعية بالمرور على _children (بحجم الشجرة الفرعية لا الفهرس كله)."""
+        stack = [rel]
+        while stack:
+            key = stack.pop()
+            self._entries.pop(key, None)
+            self._sorted.pop(key, None)
+            names = self._children.pop(key, None)
+            if names:
+                stack.extend(_join(key, name) for name in names)
+
+    def refresh(self, rel: str) -> bool:
+        """
+        إعادة قراءة مسار واحد من القرص وتحديث الفهرس.
+
+        Returns:
+            True إذا تغيّر الفهرس
+        """
+        if rel in ("", ROOT_KEY):
+            # تغييرات الأبناء تصل كأحداث مستقلة
+            return False
+        parent, name = _split(rel)
+        if parent != ROOT_KEY and parent not in self._children:
+            # الأب غير مفهرس بعد (مجلد جديد): مسحه يشمل هذا المسار
+            return self.refresh(parent)
+        abs_path = self.root / rel
+        try:
+            st = abs_path.stat()
+            is_dir = abs_path.is_dir()
+        except OSError:
+            st = None
+
+        with self._lock:
+            old = self._entries.get(rel)
+            if st is None:
+                if old is None:
+                    return False
+                self._remove_locked(rel)
+                self._children.get(parent, set()).discard(name)
+            else:
+                new = IndexEntry("dir" if is_dir else "file", int(st.st_size), int(st.st_mtime))
+                if is_dir and (old is None or old.type != "dir") and not abs_path.is_symlink():
+                    # مجلد جديد (أو نُقل إلى هنا): مسح محتواه
+                    self._remove_locked(rel)
+                    entries: Dict[str, IndexEntry] = {}
+                    children: Dict[str, Set[str]] = {}
+                    self._scan(rel, str(abs_path), entries, children)
+                    self._entries.update(entries)
+                    self._children.update(children)
+                elif old == new:
+                    return False
+                elif old is not None and old.type == "dir" and not is_dir:
+                    self._remove_locked(rel)
+                self._entries[rel] = new
+                self._children.setdefault(parent, set()).add(name)
+            self._sorted.pop(parent, None)
+            self._sorted.pop(rel, None)
+            self.version += 1
+        self._notify(rel)
+        return True
+
+    def refresh_abs(self, abs_path: str) -> bool:
+        """تحديث من مسار مطلق (أحداث المراقب)؛ المسارات خارج الجذر تُتجاهل."""
+        try:
+            rel = Path(abs_path).resolve().relative_to(self.root).as_posix()
+        except (ValueError, OSError):
+            return False
+        return self.refresh(rel)
+
+    # --- Queries ---
+    def _sorted_children(self, rel: str) -> List[Tuple[str, IndexEntry]]:
+        cached = self._sorted.get(rel)
+        if cached is None:
+            names = self._children.get(rel, ())
+            cached = sorted(
+                ((_join(rel, n), self._entries[_join(rel, n)]) for n in names if _join(rel, n) in self._entries),
+                key=lambda item: (item[1].type != "dir", _split(item[0])[1].lower()),
+            )
+            self._sorted[rel] = cached
+        return cached
+
+    def _check_dir(self, rel: str) -> None:
+        if rel == ROOT_KEY:
+            return
+        entry = self._entries.get(rel)
+        if entry is None:
+            raise FileNotFoundError("المسار غير موجود.")
+        if entry.type != "dir":
+            raise NotADirectoryError("المسار ليس مجلداً.")
+
+    @staticmethod
+    def _item(rel: str, entry: IndexEntry, depth: Optional[int] = None) -> Dict:
+        item = {
+            "name": _split(rel)[1],
+            "path": rel,
+            "type": entry.type,
+            "size_bytes": entry.size_bytes,
+            "mtime": entry.mtime,
+        }
+        if depth is not None:
+            item["depth"] = depth
+        return item
+
+    def list_dir(self, rel: str = ROOT_KEY, offset: int = 0, limit: Optional[int] = None) -> Dict:
+        """استعراض محتوى مجلد واحد (مجلدات أولاً ثم أبجدياً) مع ترقيم الصفحات."""
+        self.ensure_built()
+        with self._lock:
+            self._check_dir(rel)
+            children = self._sorted_children(rel)
+            page = children[offset:] if limit is None else children[offset:offset + limit]
+            return {
+                "path": rel,
+                "items": [self._item(p, e) for p, e in page],
+                "total": len(children),
+                "offset": offset,
+                "version": self.version,
+            }
+
+    def _iter_tree(self, rel: str, max_depth: Optional[int]) -> Iterator[Tuple[str, IndexEntry, int]]:
+        stack = [iter(self._sorted_children(rel))]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+                continue
+            path, entry = child
+            depth = len(stack)
+            yield path, entry, depth
+            if entry.type == "dir" and (max_depth is None or depth < max_depth):
+                stack.append(iter(self._sorted_children(path)))
+
+    def walk(self, rel: str = ROOT_KEY, offset: int = 0, limit: int = 1000, max_depth: Optional[int] = None) -> Dict:
+        """سرد تكراري (ترتيب عمق أولاً) مع ترقيم الصفحات؛ has_more يدل على وجود صفحة تالية."""
+        self.ensure_built()
+        with self._lock:
+            self._check_dir(rel)
+            items = []
+            for i, (path, entry, depth) in enumerate(self._iter_tree(rel, max_depth)):
+                if i < offset:
+                    continue
+                if len(items) == limit:
+                    return {"path": rel, "items": items, "offset": offset, "has_more": True, "version": self.version}
+                items.append(self._item(path, entry, depth))
+            return {"path": rel, "items": items, "offset": offset, "has_more": False, "version": self.version}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # --- Watching ---
+    def _poll_loop(self) -> None:
+        while not self._stop.wait(self.rescan_interval):
+            try:
+                self.build()
+            except Exception as e:
+                logger.error(f"Workspace rescan failed: {e}")
+
+    def start(self) -> None:
+        """بناء الفهرس وبدء مراقبة التغييرات (watchdog أو إعادة مسح دورية)."""
+        self.build()
+        self._stop.clear()
+        if WATCHDOG_AVAILABLE:
+            self._observer = Observer()
+            self._observer.schedule(_WatchHandler(self), str(self.root), recursive=True)
+            self._observer.daemon = True
+            self._observer.start()
+            logger.info(f"Workspace watcher started on {self.root}")
+        else:
+            self._poller = threading.Thread(target=self._poll_loop, name="workspace-index-rescan", daemon=True)
+            self._poller.start()
+            logger.warning(f"watchdog not installed; rescanning workspace every {self.rescan_interval:.0f}s")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=5)
+            self._observer = None
+        if self._poller is not None:
+            self._poller.join(timeout=5)
+            self._poller = None
+
+# الفهرس العام للـ Workspace
+workspace_index = WorkspaceIndex()
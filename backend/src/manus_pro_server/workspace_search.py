@@ -0,0 +1,300 @@
+# فهرس البحث النصي الكامل في الـ Workspace:
+# - SQLite FTS5 في ملف مستقل (لا يزاحم قاعدة بيانات الحالة على الأقفال) مع ترتيب bm25 ومقتطفات.
+# - تحديث تدريجي: يُعاد فهرسة الملف فقط إذا تغيّر حجمه أو mtime_ns، وتُحذف الملفات المختفية.
+# - يتابع فهرس الشجرة (workspace_index) لتحديث المسارات المتغيرة فور وصول أحداث المراقب.
+# - تُتجاهل الملفات الثنائية والكبيرة ومجلدات الأدوات (.git, node_modules, ...).
+# - الروابط الرمزية لا تُتبع (قد تشير خارج الـ Workspace فيتسرب محتواها عبر المقتطفات).
+
+from __future__ import annotations
+
+import os
+import queue
+import sqlite3
+import stat as stat_mod
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .config import SEARCH_INDEX_PATH, WORKSPACE_ROOT
+from .logging_config import get_logger
+
+logger = get_logger(__name__)
+
+MAX_INDEXED_FILE_SIZE = 2 * 1024 * 1024
+BINARY_SNIFF_BYTES = 8192
+COMMIT_BATCH_SIZE = 500
+IGNORED_DIRS = frozenset({".git", ".hg", ".svn", "node_modules", "__pycache__", ".venv", "venv", ".mypy_cache", ".pytest_cache"})
+IGNORED_SUFFIXES = (".part", ".pyc", ".sqlite3", ".sqlite3-wal", ".sqlite3-shm")
+
+def _fts_query(text: str) -> str:
+    """
+    تحويل نص المستخدم إلى استعلام FTS5 آمن: كل كلمة عبارة مقتبسة (AND ضمني)،
+    والكلمة المنتهية بـ * تبقى بحثاً بالبادئة.
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*").replace('"', '""')
+        if word:
+            terms.append(f'"{word}"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+def _ignored(rel: str) -> bool:
+    parts = rel.split("/")
+    return rel.endswith(IGNORED_SUFFIXES) or any(part in IGNORED_DIRS for part in parts)
+
+def _prefix_range(prefix: str) -> Tuple[str, str]:
+    """نطاق مسارات تحت مجلد ('a/b' -> ['a/b/', 'a/b0')) يستفيد من فهرس المفتاح الأساسي."""
+    prefix = prefix.strip("/") + "/"
+    return prefix, prefix[:-1] + "0"
+
+class WorkspaceSearchIndex:
+    """فهرس FTS5 تدريجي لمحتوى ملفات الـ Workspace النصية."""
+
+    def __init__(self, db_path: Path = SEARCH_INDEX_PATH, root: Path = WORKSPACE_ROOT):
+        self.db_path = Path(db_path)
+        self.root = Path(root).resolve()
+        self._write_lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._initialized = False
+
+    # --- Storage ---
+    @contextmanager
+    def _conn(self) -> Iterator[sqlite3.Connection]:
+        c = sqlite3.connect(str(self.db_path), timeout=60, check_same_thread=False)
+        c.row_factory = sqlite3.Row
+        c.execute("PRAGMA journal_mode=WAL;")
+        c.execute("PRAGMA synchronous=NORMAL;")
+        try:
+            yield c
+            c.commit()
+        except Exception:
+            c.rollback()
+            raise
+        finally:
+            c.close()
+
+    def init(self) -> None:
+        if self._initialized:
+            return
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._conn() as c:
+            c.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS files (
+                  id INTEGER PRIMARY KEY,
+                  path TEXT NOT NULL UNIQUE,
+                  size_bytes INTEGER NOT NULL,
+                  mtime_ns INTEGER NOT NULL,
+                  indexed INTEGER NOT NULL
+                );
+                CREATE VIRTUAL TABLE IF NOT EXISTS docs USING fts5(
+                  path, body, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+                );
+                """
+            )
+        self._initialized = True
+
+    # --- Scanning ---
+    def _iter_files(self, rel: str = "") -> Iterator[Tuple[str, os.stat_result]]:
+        start = self.root / rel if rel else self.root
+        stack = [(rel, str(start))]
+        while stack:
+            dir_rel, dir_abs = stack.pop()
+            try:
+                it = os.scandir(dir_abs)
+            except OSError:
+                continue
+            with it:
+                for entry in it:
+                    child_rel = f"{dir_rel}/{entry.name}" if dir_rel else entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name not in IGNORED_DIRS:
+                                stack.append((child_rel, entry.path))
+                        elif entry.is_file(follow_symlinks=False) and not entry.name.endswith(IGNORED_SUFFIXES):
+                            yield child_rel, entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+
+    def _is_direct(self, rel: str) -> bool:
+        """المسار داخل الجذر دون أي رابط رمزي في مكوّناته."""
+        path = self.root / rel
+        return path.resolve() == path
+
+    def _read_text(self, rel: str, size: int) -> Optional[str]:
+        """نص الملف للفهرسة، أو None للملفات الثنائية/الكبيرة."""
+        if size > MAX_INDEXED_FILE_SIZE:
+            return None
+        try:
+            # O_NOFOLLOW: ملف استُبدل برابط بعد المسح لا يُقرأ عبره
+            fd = os.open(self.root / rel, os.O_RDONLY | getattr(os, "O_NOFOLLOW", 0))
+            with os.fdopen(fd, "rb") as f:
+                data = f.read(MAX_INDEXED_FILE_SIZE + 1)
+        except OSError:
+            return None
+        if b"\0" in data[:BINARY_SNIFF_BYTES]:
+            return None
+        return data.decode("utf-8", errors="replace")
+
+    def _upsert(self, c: sqlite3.Connection, rel: str, st: os.stat_result, file_id: Optional[int]) -> None:
+        body = self._read_text(rel, st.st_size)
+        if file_id is None:
+            file_id = c.execute(
+                "INSERT INTO files(path,size_bytes,mtime_ns,indexed) VALUES(?,?,?,?)",
+                (rel, st.st_size, st.st_mtime_ns, int(body is not None)),
+            ).lastrowid
+        else:
+            c.execute("DELETE FROM docs WHERE rowid=?", (file_id,))
+            c.execute(
+                "UPDATE files SET size_bytes=?, mtime_ns=?, indexed=? WHERE id=?",
+                (st.st_size, st.st_mtime_ns, int(body is not None), file_id),
+            )
+        if body is not None:
+            c.execute("INSERT INTO docs(rowid,path,body) VALUES(?,?,?)", (file_id, rel, body))
+
+    def _delete_ids(self, c: sqlite3.Connection, ids: List[int]) -> None:
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            c.execute(f"DELETE FROM docs WHERE rowid IN ({marks})", chunk)
+            c.execute(f"DELETE FROM files WHERE id IN ({marks})", chunk)
+
+    def sync(self, rel: str = "") -> Dict[str, int]:
+        """
+        مزامنة الفهرس مع القرص (كامل الـ Workspace أو مسار/مجلد واحد).
+
+        Returns:
+            { "scanned", "updated", "removed" }
+        """
+        self.init()
+        rel = rel.strip("/")
+        if rel in (".",):
+            rel = ""
+        stats = {"scanned": 0, "updated": 0, "removed": 0}
+        with self._write_lock, self._conn() as c:
+            if rel:
+                low, high = _prefix_range(rel)
+                rows = c.execute(
+                    "SELECT id, path, size_bytes, mtime_ns FROM files WHERE path=? OR (path>=? AND path<?)",
+                    (rel, low, high),
+                ).fetchall()
+            else:
+                rows = c.execute("SELECT id, path, size_bytes, mtime_ns FROM files").fetchall()
+            known = {row["path"]: (row["id"], row["size_bytes"], row["mtime_ns"]) for row in rows}
+
+            target = self.root / rel
+            try:
+                target_st = target.lstat() if rel else None
+            except OSError:
+                target_st = None
+            if rel and (_ignored(rel) or not self._is_direct(rel)):
+                files = iter(())
+            elif target_st is not None and stat_mod.S_ISREG(target_st.st_mode):
+                files = iter([(rel, target_st)])
+            elif rel and (target_st is None or not stat_mod.S_ISDIR(target_st.st_mode)):
+                files = iter(())
+            else:
+                files = self._iter_files(rel)
+
+            pending = 0
+            for path, st in files:
+                stats["scanned"] += 1
+                old = known.pop(path, None)
+                if old is not None and old[1] == st.st_size and old[2] == st.st_mtime_ns:
+                    continue
+                self._upsert(c, path, st, old[0] if old else None)
+                stats["updated"] += 1
+                pending += 1
+                if pending >= COMMIT_BATCH_SIZE:
+                    c.commit()
+                    pending = 0
+
+            if known:
+                self._delete_ids(c, [v[0] for v in known.values()])
+                stats["removed"] = len(known)
+        if stats["updated"] or stats["removed"]:
+            logger.info(f"Workspace search index synced '{rel or '.'}': {stats}")
+        return stats
+
+    # --- Queries ---
+    def search(self, query: str, limit: int = 20, offset: int = 0, path_prefix: Optional[str] = None) -> Dict:
+        """
+        بحث نصي مرتب بـ bm25 (المطابقة في المسار تُرجّح أعلى) مع مقتطف حول المطابقة.
+        """
+        self.init()
+        t0 = time.perf_counter()
+        match = _fts_query(query)
+        if not match:
+            return {"query": query, "results": [], "took_ms": 0.0}
+        sql = (
+            "SELECT path, snippet(docs, 1, '[', ']', '…', 16) AS snippet, bm25(docs, 5.0, 1.0) AS score "
+            "FROM docs WHERE docs MATCH ?"
+        )
+        params: List = [match]
+        if path_prefix and path_prefix.strip("/") not in ("", "."):
+            low, high = _prefix_range(path_prefix)
+            sql += " AND path >= ? AND path < ?"
+            params += [low, high]
+        sql += " ORDER BY score LIMIT ? OFFSET ?"
+        params += [limit, offset]
+        with self._conn() as c:
+            try:
+                rows = c.execute(sql, params).fetchall()
+            except sqlite3.OperationalError as e:
+                raise ValueError(f"استعلام بحث غير صالح: {e}")
+        return {
+            "query": query,
+            "results": [{"path": r["path"], "snippet": r["snippet"], "score": round(-r["score"], 4)} for r in rows],
+            "offset": offset,
+            "took_ms": round((time.perf_counter() - t0) * 1000, 2),
+        }
+
+    # --- Background updates ---
+    def enqueue(self, rel: Optional[str]) -> None:
+        """جدولة مزامنة مسار (None = الـ Workspace كاملاً)؛ مناسب كمستمع لـ workspace_index."""
+        self._queue.put("" if rel is None else rel)
+
+    def _run(self) -> None:
+        while True:
+            rel = self._queue.get()
+            if rel is _STOP:
+                return
+            # دمج الأحداث المتراكمة: مزامنة كاملة واحدة تغني عن الباقي
+            batch = {rel}
+            while True:
+                try:
+                    more = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if more is _STOP:
+                    self._queue.put(_STOP)
+                    break
+                batch.add(more)
+            try:
+                for path in ([""] if "" in batch else sorted(batch)):
+                    self.sync(path)
+            except Exception as e:
+                logger.error(f"Workspace search sync failed: {e}")
+
+    def start(self) -> None:
+        """بدء عامل الخلفية وجدولة مزامنة أولية كاملة."""
+        self.init()
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="workspace-search-indexer", daemon=True)
+            self._worker.start()
+        self.enqueue(None)
+
+    def stop(self) -> None:
+        if self._worker is not None:
+            self._queue.put(_STOP)
+            self._worker.join(timeout=10)
+            self._worker = None
+
+_STOP = object()
+
+# فهرس البحث العام
+workspace_search = WorkspaceSearchIndex()
@@ -0,0 +1,299 @@
+# لقطات الـ Workspace لكل نقطة تفتيش في المهام:
+# - مخزن كتل حسب المحتوى (SHA-256): كل محتوى يُخزّن مرة واحدة مهما تكرر بين اللقطات.
+# - النسخ إلى المخزن عبر reflink (FICLONE على btrfs/xfs) مع fallback إلى نسخ عادي؛
+#   لا تُستخدم الروابط الصلبة لأن تعديل الملف في مكانه سيُفسد الكتلة المخزنة.
+# - الملفات التي لم يتغير حجمها و mtime_ns منذ اللقطة السابقة لا يُعاد حسابها ولا نسخها.
+# - الاستعادة تكتب فقط الملفات المختلفة وتحذف الزائدة، والمقارنة بين لقطتين أو مع الحالة الحالية.
+# - جذر اللقطة هو مجلد المهمة الخاص (workspace_fs.task_workspace) فلا تمس الاستعادة ملفات مهام أخرى.
+# - حذف لقطة يزيل قائمتها، و gc يحذف الكتل التي لم تعد أي قائمة تشير إليها (mark-and-sweep).
+
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+import stat as stat_mod
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import orjson
+
+from . import db
+from .config import SNAPSHOT_DIR
+from .logging_config import get_logger
+from .workspace_fs import reflink_file
+
+logger = get_logger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+GC_GRACE_SEC = 3600  # كتل أحدث من هذا قد تخص لقطة قيد الإنشاء لم تُحفظ قائمتها بعد
+SKIPPED_SUFFIXES = (".part",)
+
+# manifest: {"files": {path: [sha256, size, mtime_ns, mode]}, "dirs": [path, ...]}
+Manifest = Dict[str, Any]
+
+def _clone_file(src: Path, dst: Path) -> None:
+    """نسخ reflink إن دعمه نظام الملفات، وإلا نسخ عادي."""
+    if not reflink_file(src, dst):
+        shutil.copyfile(src, dst)
+
+def _hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class SnapshotStore:
+    """مخزن اللقطات: الكتل في blobs/aa/<sha256> والقوائم في manifests/<id>.json"""
+
+    def __init__(self, base_dir: Path = SNAPSHOT_DIR):
+        self.base_dir = Path(base_dir)
+        self.blob_dir = self.base_dir / "blobs"
+        self.manifest_dir = self.base_dir / "manifests"
+
+    # --- Storage ---
+    def _blob_path(self, sha256: str) -> Path:
+        return self.blob_dir / sha256[:2] / sha256
+
+    def _store_blob(self, src: Path) -> Tuple[str, int]:
+        """
+        نسخ الملف إلى المخزن ثم حساب البصمة من النسخة (لا من الملف الحي الذي قد يتغير أثناء القراءة).
+
+        Returns:
+            (sha256, عدد البايتات الجديدة المضافة للمخزن)
+        """
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.blob_dir / f".{uuid.uuid4().hex}.part"
+        try:
+            _clone_file(src, tmp)
+            sha256 = _hash_file(tmp)
+            final = self._blob_path(sha256)
+            if final.exists():
+                tmp.unlink()
+                # تحديث mtime يحمي الكتلة المعاد استخدامها من gc متزامن (مهلة GC_GRACE_SEC)
+                os.utime(final)
+                return sha256, 0
+            final.parent.mkdir(exist_ok=True)
+            size = tmp.stat().st_size
+            os.chmod(tmp, 0o444)
+            os.replace(tmp, final)
+            return sha256, size
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    def load_manifest(self, snapshot_id: str) -> Manifest:
+        path = self.manifest_dir / f"{snapshot_id}.json"
+        if not path.exists():
+            raise FileNotFoundError(f"Snapshot '{snapshot_id}' not found")
+        return orjson.loads(path.read_bytes())
+
+    def _save_manifest(self, snapshot_id: str, manifest: Manifest) -> None:
+        self.manifest_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.manifest_dir / f".{snapshot_id}.json.part"
+        tmp.write_bytes(orjson.dumps(manifest))
+        os.replace(tmp, self.manifest_dir / f"{snapshot_id}.json")
+
+    # --- Scanning ---
+    def _scan(self, root: Path, previous: Optional[Manifest], store: bool) -> Tuple[Manifest, int]:
+        """
+        بناء manifest للمجلد. الملفات المطابقة للقطة السابقة (حجم + mtime_ns) تُعاد بصمتها دون قراءة.
+
+        Returns:
+            (manifest, البايتات الجديدة المضافة للمخزن)
+        """
+        prev_files = (previous or {}).get("files", {})
+        files: Dict[str, list] = {}
+        dirs = []
+        new_bytes = 0
+        stack = [("", str(root))]
+        while stack:
+            dir_rel, dir_abs = stack.pop()
+            try:
+                it = os.scandir(dir_abs)
+            except OSError:
+                continue
+            with it:
+                for entry in it:
+                    rel = f"{dir_rel}/{entry.name}" if dir_rel else entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            dirs.append(rel)
+                            stack.append((rel, entry.path))
+                            continue
+                        if not entry.is_file(follow_symlinks=False) or entry.name.endswith(SKIPPED_SUFFIXES):
+                            continue
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    mode = stat_mod.S_IMODE(st.st_mode)
+                    prev = prev_files.get(rel)
+                    if (prev is not None and prev[1] == st.st_size and prev[2] == st.st_mtime_ns
+                            and (not store or self._blob_path(prev[0]).exists())):
+                        # (كتلة اللقطة السابقة قد تكون أُزيلت بـ gc بعد حذفها: تُخزّن من جديد)
+                        files[rel] = [prev[0], st.st_size, st.st_mtime_ns, mode]
+                        continue
+                    if store:
+                        sha256, added = self._store_blob(Path(entry.path))
+                        new_bytes += added
+                    else:
+                        sha256 = _hash_file(Path(entry.path))
+                    files[rel] = [sha256, st.st_size, st.st_mtime_ns, mode]
+        return {"files": files, "dirs": sorted(dirs)}, new_bytes
+
+    # --- Public API ---
+    def create(self, root: str, task_id: Optional[str] = None, label: Optional[str] = None,
+               parent_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        إنشاء لقطة للمجلد root. إذا لم يُحدد parent_id تُستخدم آخر لقطة للمهمة كأساس للمسار السريع.
+        """
+        t0 = time.perf_counter()
+        if parent_id is None and task_id is not None:
+            latest = db.list_workspace_snapshots(task_id, limit=1)
+            parent_id = latest[0]["id"] if latest else None
+        previous = None
+        if parent_id is not None:
+            try:
+                previous = self.load_manifest(parent_id)
+            except FileNotFoundError:
+                parent_id = None
+
+        manifest, new_bytes = self._scan(Path(root), previous, store=True)
+        snapshot_id = f"snap_{uuid.uuid4().hex[:12]}"
+        self._save_manifest(snapshot_id, manifest)
+        record = {
+            "id": snapshot_id,
+            "task_id": task_id,
+            "parent_id": parent_id,
+            "root": str(root),
+            "label": label,
+            "file_count": len(manifest["files"]),
+            "total_bytes": sum(f[1] for f in manifest["files"].values()),
+            "new_bytes": new_bytes,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+        db.add_workspace_snapshot(record)
+        logger.info(
+            f"Snapshot {snapshot_id} of {root}: {record['file_count']} files, "
+            f"{new_bytes} new bytes in {time.perf_counter() - t0:.2f}s"
+        )
+        return record
+
+    @staticmethod
+    def _diff(old: Manifest, new: Manifest) -> Dict[str, list]:
+        old_files, new_files = old["files"], new["files"]
+        return {
+            "added": sorted(set(new_files) - set(old_files)),
+            "removed": sorted(set(old_files) - set(new_files)),
+            "modified": sorted(p for p in set(old_files) & set(new_files) if old_files[p][0] != new_files[p][0]),
+        }
+
+    def diff(self, snapshot_id: str, against: Optional[str] = None) -> Dict[str, Any]:
+        """
+        الفرق بين لقطة وأخرى، أو بين اللقطة والحالة الحالية للمجلد (against=None).
+        """
+        old = self.load_manifest(snapshot_id)
+        if against is None:
+            record = db.get_workspace_snapshot(snapshot_id)
+            if record is None:
+                raise FileNotFoundError(f"Snapshot '{snapshot_id}' not found")
+            new, _ = self._scan(Path(record["root"]), old, store=False)
+        else:
+            new = self.load_manifest(against)
+        return {"from": snapshot_id, "to": against or "current", **self._diff(old, new)}
+
+    def restore(self, snapshot_id: str) -> Dict[str, Any]:
+        """
+        إعادة المجلد إلى حالة اللقطة: كتابة الملفات المختلفة فقط وحذف الملفات والمجلدات الزائدة.
+        """
+        t0 = time.perf_counter()
+        record = db.get_workspace_snapshot(snapshot_id)
+        if record is None:
+            raise FileNotFoundError(f"Snapshot '{snapshot_id}' not found")
+        root = Path(record["root"])
+        target = self.load_manifest(snapshot_id)
+        current, _ = self._scan(root, target, store=False)
+        changes = self._diff(target, current)
+        # في _diff: الإضافات في الحالة الحالية = ملفات زائدة يجب حذفها
+        for rel in changes["added"]:
+            (root / rel).unlink(missing_ok=True)
+
+        for rel in changes["removed"] + changes["modified"]:
+            sha256, _, mtime_ns, mode = target["files"][rel]
+            dest = root / rel
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            tmp = dest.parent / f".{dest.name}.{uuid.uuid4().hex}.part"
+            _clone_file(self._blob_path(sha256), tmp)
+            os.chmod(tmp, mode)
+            os.utime(tmp, ns=(mtime_ns, mtime_ns))
+            os.replace(tmp, dest)
+
+        keep_dirs = set(target["dirs"])
+        for rel in sorted(set(current["dirs"]) - keep_dirs, key=lambda d: d.count("/"), reverse=True):
+            try:
+                (root / rel).rmdir()
+            except OSError:
+                pass
+        for rel in target["dirs"]:
+            (root / rel).mkdir(parents=True, exist_ok=True)
+
+        result = {
+            "snapshot_id": snapshot_id,
+            "written": len(changes["removed"]) + len(changes["modified"]),
+            "deleted": len(changes["added"]),
+            "elapsed": round(time.perf_counter() - t0, 3),
+        }
+        logger.info(f"Restored {root} to snapshot {snapshot_id}: {result}")
+        return result
+
+    def delete(self, snapshot_id: str) -> bool:
+        """حذف لقطة (السجل والقائمة)؛ كتلها تُزال في gc إن لم تشر إليها لقطة أخرى."""
+        deleted = db.delete_workspace_snapshot(snapshot_id)
+        path = self.manifest_dir / f"{snapshot_id}.json"
+        if path.exists():
+            path.unlink()
+            deleted = True
+        return deleted
+
+    def gc(self, grace_sec: float = GC_GRACE_SEC) -> Dict[str, int]:
+        """
+        حذف الكتل التي لا تشير إليها أي قائمة محفوظة (وبقايا .part القديمة).
+        الكتل الأحدث من grace_sec تُترك لأن لقطة قيد الإنشاء قد تكون نسختها ولم تحفظ قائمتها بعد.
+        """
+        t0 = time.perf_counter()
+        live = set()
+        for path in self.manifest_dir.glob("*.json") if self.manifest_dir.exists() else ():
+            try:
+                live.update(f[0] for f in orjson.loads(path.read_bytes())["files"].values())
+            except (OSError, orjson.JSONDecodeError, KeyError):
+                # قائمة تالفة: لا حذف لأي كتلة قد تخصها
+                logger.warning(f"Unreadable snapshot manifest {path.name}; skipping blob GC")
+                return {"deleted": 0, "freed_bytes": 0}
+        cutoff = time.time() - grace_sec
+        deleted = freed = 0
+        for path in self.blob_dir.glob("*/*") if self.blob_dir.exists() else ():
+            if path.name in live:
+                continue
+            try:
+                st = path.stat()
+                if st.st_mtime > cutoff:
+                    continue
+                path.unlink()
+            except OSError:
+                continue
+            deleted += 1
+            freed += st.st_size
+        for path in self.blob_dir.glob(".*.part") if self.blob_dir.exists() else ():
+            try:
+                if path.stat().st_mtime <= cutoff:
+                    path.unlink()
+            except OSError:
+                pass
+        logger.info(f"Snapshot GC: {deleted} blobs, {freed} bytes freed in {time.perf_counter() - t0:.2f}s")
+        return {"deleted": deleted, "freed_bytes": freed}
+
+# المخزن العام للقطات
+snapshot_store = SnapshotStore()
@@ -0,0 +1,21 @@
+"""
+إعدادات مشتركة للاختبارات
+"""
+
+import pytest
+
+
+@pytest.fixture
+def isolated_db(tmp_path, monkeypatch):
+    """قاعدة بيانات وملف مفاتيح مؤقتان، فلا تكتب الاختبارات في data/ الحقيقي."""
+    from manus_pro_server import crypto, db
+
+    monkeypatch.setattr(crypto, "FERNET_KEY_PATH", tmp_path / "fernet.key")
+    # تفريغ المفاتيح المحمّلة؛ monkeypatch يعيدها كما كانت بعد الاختبار
+    for name in ("_FERNET", "_PRIMARY", "_PRIMARY_KEY_ID", "_KEY_MTIME_NS"):
+        monkeypatch.setattr(crypto, name, None)
+    monkeypatch.setattr(db, "DB_PATH", tmp_path / "state.sqlite3")
+    monkeypatch.setattr(db, "settings_cache", db.SettingsCache())
+    db.init_db()
+    yield db
+    db.settings_cache.close()
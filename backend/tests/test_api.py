@@ -14,6 +14,7 @@ from fastapi.testclient import TestClient
 
 from manus_pro_server import db
 from manus_pro_server import crypto
+from manus_pro_server import telegram_ingest
 from manus_pro_server.api import app
 from manus_pro_server.config import WORKSPACE_ROOT, FERNET_KEY_PATH
 
@@ -107,6 +108,32 @@ def test_db_settings_storage():
     # التحقق من أن db.get_setting يفك التشفير تلقائياً
     assert crypto.decrypt_str(db_value) == value
 
+def test_db_settings_cache_invalidation(monkeypatch):
+    """
+    الإعدادات تُقرأ مرة واحدة ثم من الذاكرة، وتُبطل عند الكتابة من عملية أخرى فقط
+    """
+    keys = [f"cache_slot_{i}_{uuid.uuid4().hex[:6]}" for i in range(3)]
+    for i, key in enumerate(keys[:2]):
+        db.set_setting(key, f"value-{i}")
+
+    decrypts = []
+    real_decrypt = crypto.decrypt_str
+    monkeypatch.setattr(crypto, "decrypt_str", lambda v: decrypts.append(v) or real_decrypt(v))
+
+    assert db.get_settings(keys) == {keys[0]: "value-0", keys[1]: "value-1", keys[2]: None}
+    assert len(decrypts) == 2
+    # كتابات غير متعلقة بالإعدادات لا تُبطل الذاكرة
+    db.create_task(f"task_{uuid.uuid4().hex[:12]}", "cache test", str(WORKSPACE_ROOT), 1000)
+    assert db.get_setting(keys[0]) == "value-0" and len(decrypts) == 2
+
+    # محاكاة كتابة من عملية أخرى (اتصال مستقل يزيد عدّاد الأجيال)
+    other = db._get_db_connection()
+    other.execute("UPDATE settings SET value=? WHERE key=?", (crypto.encrypt_str("rotated"), keys[0]))
+    other.execute("UPDATE settings_generation SET generation = generation + 1 WHERE id=1")
+    other.commit()
+    other.close()
+    assert db.get_setting(keys[0]) == "rotated"
+
 def test_db_task_lifecycle():
     """
     اختبار دورة حياة المهمة في قاعدة البيانات
@@ -160,3 +187,128 @@ def test_db_task_lifecycle():
     events_after = db.list_events(task_id, after_id=events[0]["id"])
     assert len(events_after) == 1
     assert events_after[0]["event_type"] == "test.event2"
+
+def test_db_connector_cursor():
+    """
+    اختبار حفظ مؤشر المزامنة التزايدية للموصلات
+    """
+    connector_id = f"conn_{uuid.uuid4().hex[:8]}"
+    assert db.get_connector_cursor(connector_id) is None
+    
+    db.set_connector_cursor(connector_id, "token-1")
+    db.set_connector_cursor(connector_id, "token-2")
+    assert db.get_connector_cursor(connector_id) == "token-2"
+    
+    db.set_connector_cursor(connector_id, None)
+    assert db.get_connector_cursor(connector_id) is None
+
+@pytest.fixture
+def app_client(isolated_db, tmp_path, monkeypatch):
+    """
+    TestClient مع تشغيل lifespan على Workspace وفهارس مؤقتة بدلاً من WORKSPACE_ROOT و DATA_DIR الحقيقيين
+    """
+    from manus_pro_server import api, workspace_fs
+    from manus_pro_server.workspace_index import WorkspaceIndex
+    from manus_pro_server.workspace_search import WorkspaceSearchIndex
+    from manus_pro_server.workspace_snapshots import SnapshotStore
+
+    root = tmp_path / "workspace"
+    root.mkdir()
+    monkeypatch.setattr(workspace_fs, "WORKSPACE_ROOT", root)
+    monkeypatch.setattr(api, "WORKSPACE_ROOT", root)
+    monkeypatch.setattr(api, "workspace_index", WorkspaceIndex(root))
+    monkeypatch.setattr(api, "workspace_search", WorkspaceSearchIndex(tmp_path / "search.sqlite3", root))
+    monkeypatch.setattr(api.audit_writer, "journal_path", tmp_path / "audit.journal")
+    monkeypatch.setattr(api, "snapshot_store", SnapshotStore(tmp_path / "snapshots"))
+    with TestClient(app) as c:
+        yield c
+
+def test_workspace_endpoints_reject_escaping_paths(app_client):
+    for url in ("/api/v1/workspace/search?q=x&path=../../etc", "/api/v1/workspace/tree?path=../..",
+                "/api/v1/workspace/file/stream?path=../../etc/passwd", "/api/v1/workspace/file?path=../../etc/passwd"):
+        assert app_client.get(url).status_code == 400, url
+    assert app_client.get("/api/v1/workspace/tree?path=missing").status_code == 404
+
+def test_workspace_read_file_maps_client_errors(app_client):
+    from manus_pro_server import api
+
+    (api.WORKSPACE_ROOT / "app.log").write_text("line\n" * 10)
+    (api.WORKSPACE_ROOT / "logs").mkdir()
+    assert app_client.get("/api/v1/workspace/file?path=app.log&offset=5&length=5").json()["content"]["content"] == "line\n"
+    # نطاق خارج الحدود أو مسار ليس ملفاً: خطأ من العميل لا 500
+    assert app_client.get("/api/v1/workspace/file?path=app.log&offset=-1").status_code == 400
+    assert app_client.get("/api/v1/workspace/file?path=app.log&length=-5").status_code == 400
+    assert app_client.get("/api/v1/workspace/file?path=logs").status_code == 400
+    assert app_client.get("/api/v1/workspace/file?path=missing.txt").status_code == 404
+
+def test_task_snapshots_use_task_workspace_and_guard_restore(app_client):
+    from manus_pro_server import api
+
+    task = app_client.post("/api/v1/tasks", json={"goal": "snapshots"}).json()["task"]
+    root = Path(task["project_path"])
+    assert root.parent == api.WORKSPACE_ROOT / "tasks" and root.is_dir()
+    (root / "a.txt").write_text("v1")
+    snap = app_client.post(f"/api/v1/tasks/{task['id']}/snapshots").json()
+    assert snap["root"] == str(root) and snap["file_count"] == 1
+
+    # مهمة أخرى تعمل على الـ Workspace المشترك (يتداخل مع مجلد المهمة) تمنع الاستعادة
+    db.create_task("task_legacy", "legacy", str(api.WORKSPACE_ROOT), 1000)
+    db.update_task_fields("task_legacy", status="running")
+    r = app_client.post("/api/v1/tasks/task_legacy/snapshots")
+    assert r.status_code == 409
+    (root / "a.txt").write_text("v2")
+    r = app_client.post(f"/api/v1/tasks/{task['id']}/snapshots/{snap['id']}/restore")
+    assert r.status_code == 409 and "task_legacy" in r.json()["detail"]
+
+    db.request_cancel("task_legacy")
+    r = app_client.post(f"/api/v1/tasks/{task['id']}/snapshots/{snap['id']}/restore")
+    assert r.status_code == 200 and (root / "a.txt").read_text() == "v1"
+
+    r = app_client.delete(f"/api/v1/tasks/{task['id']}/snapshots/{snap['id']}")
+    assert r.status_code == 200 and r.json()["ok"]
+    assert app_client.get(f"/api/v1/tasks/{task['id']}/snapshots").json()["snapshots"] == []
+
+def test_telegram_webhook_creates_task(app_client, monkeypatch):
+    """
+    اختبار مستقبل Webhook لتيلجرام: مغلق بدون سر، يقبل موصلات تيلجرام المسجلة فقط،
+    والتحديث يدخل الطابور ويُنشئ مهمة لمرسل في قائمة السماح فقط
+    """
+    from manus_pro_server import api
+
+    monkeypatch.setattr(telegram_ingest, "TELEGRAM_ALLOWED_CHAT_IDS", frozenset({1}))
+    monkeypatch.setattr(telegram_ingest, "TELEGRAM_ALLOWED_USER_IDS", frozenset())
+
+    db.upsert_connector("tg_test", "Telegram", "telegram", {"token": "123:abc"}, status="active")
+    db.upsert_connector("drive_test", "Drive", "google_drive", {})
+    update = {"update_id": 501, "message": {"text": "/task من تيلجرام", "chat": {"id": 1}}}
+    headers = {"X-Telegram-Bot-Api-Secret-Token": "s3cret"}
+    monkeypatch.setattr(api, "TELEGRAM_WEBHOOK_SECRET", "")
+    assert app_client.post("/api/v1/connectors/telegram/tg_test/webhook", json=update, headers=headers).status_code == 403
+
+    monkeypatch.setattr(api, "TELEGRAM_WEBHOOK_SECRET", "s3cret")
+    assert app_client.post("/api/v1/connectors/telegram/tg_test/webhook", json=update).status_code == 401
+    # معرّفات غير مسجلة أو من نوع آخر لا تُنشئ مستقبلات
+    for unknown in ("tg_missing", "drive_test"):
+        r = app_client.post(f"/api/v1/connectors/telegram/{unknown}/webhook", json=update, headers=headers)
+        assert r.status_code == 404
+    assert set(telegram_ingest._ingestors) <= {"tg_test"}
+
+    r = app_client.post("/api/v1/connectors/telegram/tg_test/webhook", json=update, headers=headers)
+    assert r.status_code == 200
+    assert r.json()["accepted"] is True
+    # التكرار يُرفض بدون إنشاء مهمة ثانية
+    r = app_client.post("/api/v1/connectors/telegram/tg_test/webhook", json=update, headers=headers)
+    assert r.json()["accepted"] is False
+    
+    # مرسل خارج قائمة السماح: يُقبل التحديث ويُسقط دون إنشاء مهمة
+    stranger = {"update_id": 502, "message": {"text": "/task rm -rf", "chat": {"id": 2}, "from": {"id": 99}}}
+    r = app_client.post("/api/v1/connectors/telegram/tg_test/webhook", json=stranger, headers=headers)
+    assert r.json()["accepted"] is True
+
+    ingestor = telegram_ingest._ingestors["tg_test"]
+    for _ in range(50):
+        if ingestor.stats["handled"] == 2:
+            break
+        time.sleep(0.05)
+    assert ingestor.stats["handled"] == 2 and ingestor.stats["tasks_created"] == 1
+    assert [t["goal"] for t in db.list_tasks()] == ["من تيلجرام"]
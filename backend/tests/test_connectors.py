@@ -1,7 +1,14 @@
+import asyncio
+import io
+import json
 import pytest
 import os
 from manus_pro_server.connectors.local_device import LocalDeviceConnector
-from manus_pro_server.connectors.base import ConnectorCapability
+import requests
+from manus_pro_server.connectors.base import (
+    ConnectorCapability, TokenBucket, CircuitBreaker, CircuitOpenError,
+    ConnectorMiddleware, RetryPolicy, RateLimit, compute_retry_delay,
+)
 
 @pytest.mark.asyncio
 async def test_local_device_connector(tmp_path):
@@ -34,3 +41,560 @@ def test_connector_capabilities():
     connector = LocalDeviceConnector(connector_id="test", name="Test", config=config)
     assert ConnectorCapability.READ in connector.capabilities
     assert ConnectorCapability.WRITE in connector.capabilities
+
+# ═══ Connector Middleware ═══
+
+def _fake_response(status_code, headers=None):
+    resp = requests.Response()
+    resp.status_code = status_code
+    resp.headers.update(headers or {})
+    return resp
+
+def test_token_bucket_reserve():
+    now = [0.0]
+    bucket = TokenBucket(rate=2.0, capacity=2, clock=lambda: now[0])
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    # الرصيد نفد: الطلب الثالث ينتظر نصف ثانية (معدل 2/ث)
+    assert bucket.reserve() == pytest.approx(0.5)
+    now[0] = 10.0
+    assert bucket.reserve() == 0.0
+
+def test_middleware_token_buckets_are_bounded():
+    mw = ConnectorMiddleware(max_buckets=3)
+    provider = mw.bucket("github")
+    for i in range(10):
+        # كل تحديث OAuth يأتي بتوكن جديد؛ المزوّد المستخدم باستمرار يبقى في الذاكرة
+        mw.bucket("github", f"token-{i}")
+        assert mw.bucket("github") is provider
+    assert len(mw._buckets) == 3
+    assert ("github", "token-9") in mw._buckets and ("github", "token-0") not in mw._buckets
+
+def test_compute_retry_delay_honors_headers():
+    policy = RetryPolicy(base_delay=1.0, max_delay=60.0)
+    assert compute_retry_delay(0, policy, {"Retry-After": "7"}) == 7.0
+    assert compute_retry_delay(0, policy, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "1012"}, now=1000) == 12.0
+    # انتظار أطول من الحد الأقصى → لا إعادة محاولة
+    assert compute_retry_delay(0, policy, {"Retry-After": "3600"}) is None
+    # jitter كامل ضمن [0, base * 2^attempt]
+    assert compute_retry_delay(3, policy, {}, rng=lambda: 0.5) == 4.0
+
+def test_circuit_breaker_opens_and_recovers():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+    breaker.record_failure()
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+    now[0] = 11.0
+    assert breaker.allow_request()        # طلب تجريبي واحد
+    assert not breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+@pytest.mark.asyncio
+async def test_middleware_retries_on_429_with_retry_after():
+    responses = [_fake_response(429, {"Retry-After": "2"}), _fake_response(200)]
+    sleeps = []
+
+    async def fake_sleep(seconds):
+        sleeps.append(seconds)
+
+    mw = ConnectorMiddleware(transport=lambda *a, **k: responses.pop(0), sleep=fake_sleep)
+    resp = await mw.request("github", "tok", "GET", "https://api.github.com/user", rate_limit=RateLimit(1000, 1000))
+    assert resp.status_code == 200
+    assert 2.0 in [round(s, 1) for s in sleeps]
+
+@pytest.mark.asyncio
+async def test_middleware_circuit_breaker_trips_on_5xx():
+    async def fake_sleep(seconds):
+        pass
+
+    mw = ConnectorMiddleware(
+        retry_policy=RetryPolicy(max_retries=1),
+        transport=lambda *a, **k: _fake_response(503),
+        sleep=fake_sleep,
+        failure_threshold=2,
+    )
+    # محاولات الطلب الواحد تُحسب إخفاقاً واحداً
+    resp = await mw.request("discord", "tok", "GET", "https://discord.com/api")
+    assert resp.status_code == 503 and mw.breaker("discord").state == CircuitBreaker.CLOSED
+    await mw.request("discord", "tok", "GET", "https://discord.com/api")
+    with pytest.raises(CircuitOpenError):
+        await mw.request("discord", "tok", "GET", "https://discord.com/api")
+
+@pytest.mark.asyncio
+async def test_middleware_does_not_retry_non_idempotent_requests():
+    calls = []
+
+    async def fake_sleep(seconds):
+        pass
+
+    def transport(method, url, **kwargs):
+        calls.append(method)
+        raise requests.ConnectionError("reset")
+
+    mw = ConnectorMiddleware(transport=transport, sleep=fake_sleep)
+    with pytest.raises(requests.ConnectionError):
+        await mw.request("telegram", "tok", "POST", "https://api.telegram.org/sendMessage")
+    assert calls == ["POST"]
+    with pytest.raises(requests.ConnectionError):
+        await mw.request("telegram", "tok", "POST", "https://api.telegram.org/x", idempotent=True, max_retries=2)
+    assert calls == ["POST"] * 4
+
+@pytest.mark.asyncio
+async def test_middleware_releases_half_open_probe_on_unexpected_error():
+    now = [0.0]
+    mw = ConnectorMiddleware(failure_threshold=1, reset_timeout=10)
+    breaker = mw._breakers["github"] = CircuitBreaker(1, 10, clock=lambda: now[0])
+    breaker.record_failure()
+    now[0] = 11.0
+
+    def bad_transport(*a, **k):
+        raise requests.exceptions.InvalidURL("bad url")
+
+    mw._transport = bad_transport
+    with pytest.raises(requests.exceptions.InvalidURL):
+        await mw.request("github", "tok", "GET", "bad://")
+    # الطلب التجريبي حُرر: طلب لاحق ناجح يغلق الدائرة
+    mw._transport = lambda *a, **k: _fake_response(200)
+    assert (await mw.request("github", "tok", "GET", "https://api.github.com")).status_code == 200
+    assert breaker.state == CircuitBreaker.CLOSED
+
+@pytest.mark.asyncio
+async def test_github_batch_send_single_commit(monkeypatch):
+    from manus_pro_server.connectors import base
+    from manus_pro_server.connectors.github import GitHubConnector
+
+    calls = []
+
+    def fake_transport(method, url, **kwargs):
+        calls.append((method, url.replace("https://api.github.com/repos/o/r/git", "")))
+        resp = _fake_response(201 if method in ("POST", "PATCH") else 200)
+        if url.endswith("/ref/heads/main"):
+            body = {"object": {"sha": "parent"}}
+        elif "/commits/" in url:
+            body = {"tree": {"sha": "base-tree"}}
+        elif url.endswith("/blobs"):
+            body = {"sha": f"blob{len(calls)}"}
+        else:
+            body = {"sha": "new-" + url.rsplit("/", 1)[-1]}
+        resp._content = json.dumps(body).encode()
+        return resp
+
+    monkeypatch.setattr(base.connector_middleware, "_transport", fake_transport)
+    connector = GitHubConnector("gh", "GH", {"access_token": "t", "rate_limit": (1000, 1000)})
+    files = [{"path": f"out/{i}.txt", "content": f"file {i}"} for i in range(5)]
+    result = await connector.send({"repo": "o/r", "message": "batch", "files": files})
+
+    assert result["success"] is True
+    assert result["files"] == 5
+    assert len([c for c in calls if c[1] == "/blobs"]) == 5
+    assert ("POST", "/trees") in calls and ("POST", "/commits") in calls
+    assert calls[-1] == ("PATCH", "/refs/heads/main")
+    # قراءتان + blob لكل ملف + tree + commit + ref، و commit واحد فقط
+    assert len(calls) == 10
+
+@pytest.mark.asyncio
+async def test_github_fetch_etag_cache_and_link_pagination(monkeypatch):
+    from manus_pro_server.connectors import base, github
+
+    pages = {
+        1: ([{"name": "a"}, {"name": "b"}], '<https://api.github.com/search/code?q=x&page=2>; rel="next"'),
+        2: ([{"name": "c"}], None),
+    }
+    seen = []
+
+    def fake_transport(method, url, headers=None, **kwargs):
+        page = 2 if "page=2" in url else 1
+        seen.append((page, headers.get("If-None-Match")))
+        if headers.get("If-None-Match") == f'"etag-{page}"':
+            return _fake_response(304)
+        items, link = pages[page]
+        resp = _fake_response(200, {"ETag": f'"etag-{page}"', **({"Link": link} if link else {})})
+        resp._content = json.dumps({"items": items}).encode()
+        return resp
+
+    github._response_cache.clear()
+    monkeypatch.setattr(base.connector_middleware, "_transport", fake_transport)
+    connector = github.GitHubConnector("gh", "GH", {"access_token": "t", "rate_limit": (1000, 1000)})
+
+    first = await connector.fetch({"q": "x"})
+    assert [i["name"] for i in first] == ["a", "b", "c"]
+
+    # الجلب الثاني يرسل If-None-Match ويُخدم بالكامل من الذاكرة عبر 304
+    second = await connector.fetch({"q": "x"})
+    assert second == first
+    assert seen[2:] == [(1, '"etag-1"'), (2, '"etag-2"')]
+
+@pytest.mark.asyncio
+async def test_google_drive_resumable_upload_resumes_after_failure(tmp_path, monkeypatch):
+    from manus_pro_server.connectors import base
+    from manus_pro_server.connectors.google_drive import GoogleDriveConnector, CHUNK_ALIGNMENT
+
+    payload = os.urandom(CHUNK_ALIGNMENT * 2 + 1000)
+    src = tmp_path / "big.bin"
+    src.write_bytes(payload)
+    received = bytearray()
+    failed = []
+
+    def fake_transport(method, url, headers=None, data=None, **kwargs):
+        if method == "POST":
+            return _fake_response(200, {"Location": "https://upload.example/session/1"})
+        content_range = headers["Content-Range"]
+        if content_range.startswith("bytes */"):
+            return _fake_response(308, {"Range": f"bytes=0-{len(received) - 1}"})
+        if len(received) == CHUNK_ALIGNMENT and not failed:
+            failed.append(True)
+            raise requests.ConnectionError("connection reset")
+        received.extend(data)
+        if len(received) == len(payload):
+            resp = _fake_response(200)
+            resp._content = json.dumps({"id": "file-1"}).encode()
+            return resp
+        return _fake_response(308, {"Range": f"bytes=0-{len(received) - 1}"})
+
+    monkeypatch.setattr(base.connector_middleware, "_transport", fake_transport)
+    connector = GoogleDriveConnector("gd", "GD", {"access_token": "t", "rate_limit": (1000, 1000)})
+    progress = []
+    result = await connector.upload_resumable(str(src), "big.bin", chunk_size=CHUNK_ALIGNMENT,
+                                              on_progress=lambda done, total: progress.append(done))
+
+    assert result["success"] is True
+    assert result["file"]["id"] == "file-1"
+    assert failed and bytes(received) == payload
+    assert progress[-1] == len(payload)
+
+@pytest.mark.asyncio
+async def test_google_drive_streaming_download(tmp_path, monkeypatch):
+    from manus_pro_server.connectors import base
+    from manus_pro_server.connectors.google_drive import GoogleDriveConnector
+
+    data = os.urandom(100_000)
+
+    def fake_transport(method, url, stream=False, **kwargs):
+        assert stream is True
+        resp = _fake_response(200, {"Content-Length": str(len(data))})
+        resp.raw = io.BytesIO(data)
+        return resp
+
+    monkeypatch.setattr(base.connector_middleware, "_transport", fake_transport)
+    connector = GoogleDriveConnector("gd", "GD", {"access_token": "t", "rate_limit": (1000, 1000)})
+    progress = []
+    dest = tmp_path / "out.bin"
+    result = await connector.download_stream("file-1", str(dest), chunk_size=16_384,
+                                             on_progress=lambda done, total: progress.append((done, total)))
+
+    assert result["success"] is True
+    assert dest.read_bytes() == data
+    assert not (tmp_path / "out.bin.part").exists()
+    assert len(progress) > 1 and progress[-1] == (len(data), len(data))
+
+@pytest.mark.asyncio
+async def test_google_drive_download_resume_validates_etag(tmp_path, monkeypatch):
+    from manus_pro_server.connectors import base
+    from manus_pro_server.connectors.google_drive import GoogleDriveConnector
+
+    data = os.urandom(50_000)
+    current = {"etag": '"v1"', "data": data}
+    seen = []
+
+    def fake_transport(method, url, headers=None, stream=False, **kwargs):
+        seen.append(dict(headers))
+        body, etag = current["data"], current["etag"]
+        if "Range" in headers and headers.get("If-Range") == etag:
+            start = int(headers["Range"][len("bytes="):-1])
+            if start >= len(body):
+                resp = _fake_response(416, {"Content-Range": f"bytes */{len(body)}"})
+                resp.raw = io.BytesIO(b"")
+                return resp
+            resp = _fake_response(206, {"Content-Length": str(len(body) - start), "ETag": etag})
+            resp.raw = io.BytesIO(body[start:])
+            return resp
+        resp = _fake_response(200, {"Content-Length": str(len(body)), "ETag": etag})
+        resp.raw = io.BytesIO(body)
+        return resp
+
+    monkeypatch.setattr(base.connector_middleware, "_transport", fake_transport)
+    connector = GoogleDriveConnector("gd", "GD", {"access_token": "t", "rate_limit": (1000, 1000)})
+    dest = tmp_path / "out.bin"
+    part = tmp_path / "out.bin.part"
+
+    # استئناف جزء من نفس النسخة
+    part.write_bytes(data[:20_000])
+    (tmp_path / "out.bin.part.etag").write_text('"v1"')
+    assert (await connector.download_stream("f", str(dest)))["success"]
+    assert dest.read_bytes() == data and seen[-1]["If-Range"] == '"v1"'
+    assert not (tmp_path / "out.bin.part.etag").exists()
+
+    # الملف تغيّر منذ الجزء: يُعاد كاملاً بدلاً من الدمج
+    part.write_bytes(data[:20_000])
+    (tmp_path / "out.bin.part.etag").write_text('"v1"')
+    current.update(etag='"v2"', data=os.urandom(30_000))
+    assert (await connector.download_stream("f", str(dest)))["success"]
+    assert dest.read_bytes() == current["data"]
+
+    # جزء مكتمل: 416 يُعد نجاحاً
+    part.write_bytes(current["data"])
+    (tmp_path / "out.bin.part.etag").write_text('"v2"')
+    dest.unlink()
+    result = await connector.download_stream("f", str(dest))
+    assert result["success"] and dest.read_bytes() == current["data"] and not part.exists()
+
+    # جزء بلا مُعرّف نسخة لا يُستأنف
+    part.write_bytes(b"junk")
+    assert (await connector.download_stream("f", str(dest)))["success"]
+    assert "Range" not in seen[-1] and dest.read_bytes() == current["data"]
+
+def _json_response(body, status_code=200, headers=None):
+    resp = _fake_response(status_code, headers)
+    resp._content = json.dumps(body).encode()
+    return resp
+
+@pytest.mark.asyncio
+async def test_google_drive_incremental_sync(monkeypatch):
+    from manus_pro_server.connectors import base
+    from manus_pro_server.connectors.google_drive import GoogleDriveConnector
+
+    def fake_transport(method, url, params=None, **kwargs):
+        if url.endswith("/changes/startPageToken"):
+            return _json_response({"startPageToken": "100"})
+        if url.endswith("/files"):
+            if params.get("pageToken"):
+                return _json_response({"files": [{"id": "b"}]})
+            return _json_response({"files": [{"id": "a"}], "nextPageToken": "p2"})
+        if url.endswith("/changes"):
+            if params["pageToken"] == "expired":
+                return _json_response({"error": {"code": 404}}, status_code=404)
+            if params["pageToken"] == "truncated":
+                return _json_response({"changes": [{"fileId": "a", "removed": True}]})
+            assert params["pageToken"] == "100"
+            return _json_response({"changes": [{"fileId": "a", "removed": True}], "newStartPageToken": "105"})
+        raise AssertionError(url)
+
+    monkeypatch.setattr(base.connector_middleware, "_transport", fake_transport)
+    connector = GoogleDriveConnector("gd", "GD", {"access_token": "t", "rate_limit": (1000, 1000)})
+
+    full = await connector.sync()
+    assert full["full"] is True and full["cursor"] == "100"
+    assert [c["id"] for c in full["changes"]] == ["a", "b"]
+
+    delta = await connector.sync(full["cursor"])
+    assert delta == {"changes": [{"id": "a", "removed": True, "item": {}}], "cursor": "105", "full": False}
+
+    # مؤشر منتهي الصلاحية أو رد بلا مؤشر تالٍ: مزامنة كاملة بمؤشر جديد بدلاً من التعلق
+    for stale in ("expired", "truncated"):
+        recovered = await connector.sync(stale)
+        assert recovered["full"] is True and recovered["cursor"] == "100"
+        assert [c["id"] for c in recovered["changes"]] == ["a", "b"]
+
+@pytest.mark.asyncio
+async def test_onedrive_delta_sync(monkeypatch):
+    from manus_pro_server.connectors import base
+    from manus_pro_server.connectors.microsoft_onedrive import MicrosoftOnedriveConnector
+
+    delta_link = "https://graph.microsoft.com/v1.0/me/drive/root/delta?token=abc"
+
+    def fake_transport(method, url, **kwargs):
+        if url == delta_link:
+            return _json_response({"value": [{"id": "x", "deleted": {}}], "@odata.deltaLink": delta_link + "2"})
+        if url.endswith("/root/delta"):
+            return _json_response({"value": [{"id": "x"}], "@odata.nextLink": url + "?page=2"})
+        return _json_response({"value": [{"id": "y"}], "@odata.deltaLink": delta_link})
+
+    monkeypatch.setattr(base.connector_middleware, "_transport", fake_transport)
+    connector = MicrosoftOnedriveConnector("od", "OD", {"access_token": "t", "rate_limit": (1000, 1000)})
+
+    full = await connector.sync()
+    assert [c["id"] for c in full["changes"]] == ["x", "y"]
+    assert full["cursor"] == delta_link
+
+    delta = await connector.sync(full["cursor"])
+    assert delta["full"] is False
+    assert delta["changes"][0]["removed"] is True
+    assert delta["cursor"] == delta_link + "2"
+
+@pytest.mark.asyncio
+async def test_telegram_long_poll_ingestion(monkeypatch):
+    from manus_pro_server.connectors import base
+    from manus_pro_server.connectors.telegram import TelegramConnector
+    from manus_pro_server.telegram_ingest import TelegramIngestor
+
+    def fake_transport(method, url, params=None, timeout=None, **kwargs):
+        assert url.endswith("/getUpdates")
+        assert timeout > params["timeout"]  # مهلة HTTP أطول من الـ long poll
+        result = [
+            {"update_id": u, "message": {"text": f"/task goal {u}", "chat": {"id": 7}, "from": {"username": "u"}}}
+            for u in range(params["offset"] or 10, 13)
+        ]
+        return _json_response({"ok": True, "result": result})
+
+    monkeypatch.setattr(base.connector_middleware, "_transport", fake_transport)
+    connector = TelegramConnector("tg", "TG", {"token": "123:abc", "rate_limit": (1000, 1000)})
+    created = []
+    ingestor = TelegramIngestor("tg", connector, handler=lambda u: created.append(u["text"]) or "task")
+    committed = []
+    # الإزاحة تُحفظ بعد معالجة الدفعة كاملة فقط
+    monkeypatch.setattr(ingestor, "commit_offset", lambda offset: committed.append((offset, len(created))))
+
+    offset = await ingestor.poll_once(0, timeout=25)
+    assert offset == 13 and committed == [(13, 3)]
+    assert created == ["/task goal 10", "/task goal 11", "/task goal 12"]
+    # إعادة تسليم نفس التحديث (مثل webhook مكرر) تُتجاهل
+    assert await ingestor.submit({"update_id": 12, "message": {}}) is False
+    await ingestor.close()
+    assert ingestor.stats["duplicates"] == 1 and ingestor.stats["tasks_created"] == 3
+
+@pytest.mark.asyncio
+async def test_fan_out_send_runs_concurrently():
+    from manus_pro_server.connectors.base import BaseConnector, ConnectorAuthType
+    from manus_pro_server.connectors.fanout import fan_out_send
+
+    class SlowConnector(BaseConnector):
+        def __init__(self, connector_id, delay, fail=False):
+            super().__init__(connector_id, connector_id, "fake", [ConnectorCapability.WRITE], ConnectorAuthType.NONE, {})
+            self.delay, self.fail = delay, fail
+        async def connect(self): return True
+        async def disconnect(self): return True
+        async def fetch(self, params): return []
+        async def send(self, payload, attachments=None):
+            await asyncio.sleep(self.delay)
+            if self.fail:
+                return {"success": False, "error": "boom"}
+            return {"sent": payload["text"], "chat": payload.get("chat_id")}
+
+    a = SlowConnector("a", 0.2)
+    connectors = [a, SlowConnector("b", 0.2), SlowConnector("c", 0.05, fail=True), SlowConnector("d", 5), a]
+    streamed = []
+    report = await fan_out_send(
+        connectors, {"text": "hi"}, timeout=0.5, overrides={"a": {"chat_id": 42}}, on_result=streamed.append,
+    )
+
+    # الزمن الكلي ≈ المهلة (أبطأ موصل) وليس مجموع الأزمنة
+    assert report["elapsed"] < 1.0
+    # المكرر يُرسل إليه مرة واحدة، وانتهاء المهلة نتيجة غير معروفة لا فشل
+    assert report["total"] == 4 and report["succeeded"] == 2
+    assert report["failed"] == 1 and report["unknown"] == 1
+    assert report["results"]["d"]["unknown"] is True
+    assert report["results"]["a"]["result"]["chat"] == 42
+    assert streamed[0]["connector_id"] == "c"  # النتائج تُبث بترتيب الاكتمال
+
+    # المعرّفات تُحلّ لكل وجهة: معرّف مجهول أو فشل تحديث الرمز لا يلغي الإرسال للبقية
+    live = {"a": SlowConnector("a", 0.01), "b": SlowConnector("b", 0.01)}
+    async def resolve(connector_id):
+        if connector_id == "expired":
+            raise RuntimeError("invalid_grant")
+        return live[connector_id]
+    report = await fan_out_send(["a", "missing", "b", "expired", "a"], {"text": "hi"}, timeout=0.5, resolve=resolve)
+    assert report["total"] == 4 and report["succeeded"] == 2 and report["failed"] == 2
+    assert "connector resolution failed" in report["results"]["missing"]["error"]
+    assert "invalid_grant" in report["results"]["expired"]["error"]
+    assert report["results"]["b"]["result"]["sent"] == "hi"
+
+@pytest.mark.asyncio
+async def test_local_device_fetch_pagination_and_filters(tmp_path):
+    for rel in ["a/x.txt", "a/y.py", "a/sub/z.py", "b.txt", "c/d/e.py", "node_modules/m.js"]:
+        (tmp_path / rel).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / rel).write_text("hi")
+    connector = LocalDeviceConnector(connector_id="ld", name="LD", config={"root_path": str(tmp_path)})
+
+    top = await connector.fetch({})
+    assert [i["name"] for i in top] == ["a", "b.txt", "c", "node_modules"]
+
+    filtered = await connector.fetch({"recursive": True, "include": "*.py", "exclude": ["node_modules"]})
+    assert [i["name"] for i in filtered if i["type"] == "file"] == ["z.py", "y.py", "e.py"]
+
+    shallow = await connector.fetch({"recursive": True, "max_depth": 1})
+    assert "e.py" not in [i["name"] for i in shallow]
+
+    # الترقيم بالمؤشر يعيد كل العناصر مرة واحدة بالترتيب
+    pages, cursor = [], None
+    while True:
+        page = await connector.fetch_page({"recursive": True, "limit": 4, "cursor": cursor})
+        pages.append([i["name"] for i in page["items"]])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    everything = [i["name"] for i in await connector.fetch({"recursive": True})]
+    assert sum(pages, []) == everything
+    assert len(everything) == 11 and all(len(p) <= 4 for p in pages)
+
+@pytest.mark.asyncio
+async def test_refresh_expiring_tokens_only_refreshes_due(isolated_db, monkeypatch):
+    import uuid
+    from manus_pro_server import db, token_refresh
+    from manus_pro_server.connectors import base
+
+    due, fresh = f"gd_{uuid.uuid4().hex[:8]}", f"gd_{uuid.uuid4().hex[:8]}"
+    for cid in (due, fresh):
+        db.upsert_connector(cid, cid, "google_drive", {"client_id": "id", "client_secret": "secret"}, status="active")
+    db.save_oauth_token(due, "old-due", "refresh-due", token_refresh.expiry_iso(60))
+    db.save_oauth_token(fresh, "old-fresh", "refresh-fresh", token_refresh.expiry_iso(3600 * 24 * 365))
+
+    calls = []
+    def fake_transport(method, url, **kwargs):
+        calls.append(kwargs["data"]["refresh_token"])
+        return _json_response({"access_token": "new-due", "expires_in": 3600})
+    monkeypatch.setattr(base.connector_middleware, "_transport", fake_transport)
+
+    # طلبات متزامنة لنفس الموصل تشترك في تحديث واحد
+    tokens = await asyncio.gather(*(token_refresh.ensure_fresh_token(due, skew_seconds=120) for _ in range(5)))
+    assert tokens == ["new-due"] * 5 and calls == ["refresh-due"]
+
+    # الرمز المحدّث صار خارج النافذة، والرمز البعيد لا يُلمس
+    await token_refresh.refresh_expiring_tokens(window_seconds=600)
+    assert calls.count("refresh-due") == 1 and "refresh-fresh" not in calls
+    assert db.get_oauth_token(due)["refresh_token"] == "refresh-due"
+    assert db.get_oauth_token(fresh)["access_token"] == "old-fresh"
+
+    # مسار الطلبات: الموصل يُبنى بعد تحديث الرمز القريب من الانتهاء
+    from manus_pro_server.connectors import get_fresh_connector, registry
+    db.save_oauth_token(due, "stale-due", "refresh-due", token_refresh.expiry_iso(30))
+    connector = await get_fresh_connector(due, skew_seconds=120)
+    assert connector.access_token == "new-due" and calls.count("refresh-due") == 2
+    assert (await get_fresh_connector(due, skew_seconds=120)) is connector and len(calls) == 2
+    registry.invalidate(due)
+
+    # عملية أخرى تحجز التحديث: الانتظار ثم قراءة رمزها بدلاً من تحديث ثانٍ بنفس refresh_token
+    monkeypatch.setattr(token_refresh, "REFRESH_WAIT_INTERVAL_SEC", 0.01)
+    db.save_oauth_token(due, "stale-due", "refresh-due", token_refresh.expiry_iso(30))
+    assert db.claim_oauth_refresh(due, "other-process", 60)
+    waiting = asyncio.ensure_future(token_refresh.ensure_fresh_token(due, skew_seconds=120))
+    await asyncio.sleep(0.05)
+    assert not waiting.done()
+    db.save_oauth_token(due, "from-other", "refresh-rotated", token_refresh.expiry_iso(3600))
+    db.release_oauth_refresh(due, "other-process")
+    assert await waiting == "from-other" and len(calls) == 2
+    assert db.claim_oauth_refresh(due, "next", 60)  # الحجز حُرّر بعد القراءة
+
+def test_connector_registry_caches_and_evicts(isolated_db, tmp_path):
+    import sys
+    import uuid
+    from manus_pro_server import db
+    from manus_pro_server.connectors import ConnectorRegistry
+
+    now = [0.0]
+    registry = ConnectorRegistry(idle_ttl=60, clock=lambda: now[0])
+    cid = f"ld_{uuid.uuid4().hex[:8]}"
+    db.upsert_connector(cid, "Local", "local_device", {"root_path": str(tmp_path)}, status="active")
+
+    # استيراد كسول: الصنف يُحمّل عند أول طلب ثم يُعاد من الذاكرة
+    first = registry.get(cid)
+    assert "manus_pro_server.connectors.local_device" in sys.modules
+    assert registry.get(cid) is first and first.root_path == tmp_path
+    session = first.session
+
+    # تغيّر الرموز يُبطل النسخة المخزنة
+    db.save_oauth_token(cid, "tok", None, None)
+    second = registry.get(cid)
+    assert second is not first and first._session is None and session is not second.session
+
+    now[0] = 61.0
+    assert registry.evict_idle() == [cid] and len(registry) == 0
+
+    with db.conn() as c:
+        c.execute("DELETE FROM oauth_tokens WHERE connector_id=?", (cid,))
+        c.execute("DELETE FROM connectors WHERE id=?", (cid,))
+    with pytest.raises(KeyError):
+        registry.get(cid)
@@ -0,0 +1,118 @@
+"""
+اختبارات طبقة db على الخلفيتين: SQLite دائماً، و PostgreSQL عند ضبط MANUS_PRO_TEST_DATABASE_URL
+(كل تشغيل في مخطط مؤقت يُحذف بعده).
+"""
+
+import os
+import uuid
+
+import pytest
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def backend_db(request, tmp_path, monkeypatch):
+    from manus_pro_server import db
+
+    schema = None
+    if request.param == "postgres":
+        dsn = os.getenv("MANUS_PRO_TEST_DATABASE_URL")
+        if not dsn:
+            pytest.skip("MANUS_PRO_TEST_DATABASE_URL not set")
+        pytest.importorskip("asyncpg")
+        schema = f"test_{uuid.uuid4().hex[:12]}"
+        db.configure_backend("postgres", dsn=dsn, schema=schema, min_size=1, max_size=4)
+    else:
+        monkeypatch.setattr(db, "DB_PATH", tmp_path / "state.sqlite3")
+        db.configure_backend("sqlite")
+    db.settings_cache.close()
+    db.init_db()
+    yield db
+    if schema is not None:
+        with db.conn() as c:
+            c.execute(f'DROP SCHEMA "{schema}" CASCADE')
+    db.close()
+    db.configure_backend()
+
+
+def test_sql_translation_for_postgres():
+    from manus_pro_server.db_postgres import translate_ddl, translate_sql
+
+    assert translate_sql("SELECT * FROM t WHERE a=? AND b='?' AND c IN (?,?)") == \
+        "SELECT * FROM t WHERE a=$1 AND b='?' AND c IN ($2,$3)"
+    assert translate_sql("INSERT OR IGNORE INTO t(a) VALUES(?)") == "INSERT INTO t(a) VALUES($1) ON CONFLICT DO NOTHING"
+    ddl = translate_ddl(
+        "CREATE TABLE e (id INTEGER PRIMARY KEY AUTOINCREMENT, n INTEGER NOT NULL, p REAL, d BLOB);\n"
+        "INSERT OR IGNORE INTO g(id) VALUES (1);"
+    )
+    assert ddl == (
+        "CREATE TABLE e (id BIGSERIAL PRIMARY KEY, n BIGINT NOT NULL, p DOUBLE PRECISION, d BYTEA);\n"
+        "INSERT INTO g(id) VALUES (1) ON CONFLICT DO NOTHING;"
+    )
+
+
+def test_db_operations_identical_across_backends(backend_db):
+    db = backend_db
+
+    # الإعدادات مشفرة مع عدّاد الأجيال
+    db.set_setting("api_key_1", "sk-test")
+    assert db.get_settings(["api_key_1", "missing"]) == {"api_key_1": "sk-test", "missing": None}
+
+    # المهام والأحداث
+    db.create_task("task_a", "goal a", "/tmp/a", 1000)
+    db.create_task("task_b", "goal b", "/tmp/b", 1000)
+    db.update_task_fields("task_a", status="running", progress=0.5, steps_done=3)
+    assert db.fetch_next_runnable_task()["id"] == "task_b"
+    db.request_cancel("task_b")
+    task = db.fetch_next_runnable_task()
+    assert task["id"] == "task_a" and task["progress"] == 0.5 and task["state_json"]["task_id"] == "task_a"
+    # الحجز: لا يأخذ عامل آخر المهمة حتى تُحرَّر أو ينتهي الحجز
+    assert task["claimed_by"] == "" and db.fetch_next_runnable_task("w2") is None
+    db.release_task_claim("task_a", "w2")
+    assert db.fetch_next_runnable_task("w2") is None
+    db.release_task_claim("task_a", "")
+    assert db.fetch_next_runnable_task("w2", lease_sec=0)["claimed_by"] == "w2"
+    assert db.fetch_next_runnable_task("w3")["claimed_by"] == "w3"
+    db.release_task_claim("task_a", "w3")
+    db.add_event("task_a", "info", "step", "one", {"n": 1})
+    db.add_event("task_a", "info", "step", "two")
+    events = db.list_events("task_a")
+    assert [e["message"] for e in events] == ["one", "two"] and events[0]["data"] == {"n": 1}
+    assert db.list_events("task_a", after_id=events[0]["id"])[0]["data"] is None
+
+    # الموصلات والرموز (COALESCE يُبقي refresh_token السابق)
+    db.upsert_connector("conn_1", "Drive", "google_drive", {"folder": "x"})
+    db.save_oauth_token("conn_1", "access-1", "refresh-1", "2000-01-01T00:00:00Z")
+    db.save_oauth_token("conn_1", "access-2", None, "2000-01-01T00:00:00Z")
+    assert db.get_oauth_token("conn_1")["refresh_token"] == "refresh-1"
+    assert [t["connector_id"] for t in db.list_expiring_tokens("2001-01-01T00:00:00Z")] == ["conn_1"]
+    assert db.get_connector_record("conn_1")["config"] == {"folder": "x"}
+    db.set_connector_cursor("conn_1", "page-2")
+    assert db.get_connector_cursor("conn_1") == "page-2"
+
+    # الاستبدال المشروط يعيد عدد الصفوف المتأثرة
+    row = db.fetch_encrypted_batch("settings", None, 10)[0]
+    assert db.replace_encrypted_values("settings", [(row["key"], "value", row["value"], row["value"])]) == 1
+    assert db.replace_encrypted_values("settings", [(row["key"], "value", "stale", "new")]) == 0
+
+    # المستخدمون ومفاتيح API والتدقيق
+    db.create_user("user_1", "alice", "alice@example.com", "hash", role="viewer")
+    db.update_user_fields("user_1", permission_overrides={"grant": ["task:create"]})
+    db.create_api_key("key_1", "user_1", "abcd1234", "f" * 64, "ci")
+    user = db.get_user_by_api_key_hash("f" * 64)
+    assert user["api_key_id"] == "key_1" and user["is_active"] is True and user["role"] == "viewer"
+    assert user["permission_overrides"] == {"grant": ["task:create"]}
+    assert db.revoke_api_key("key_1") == "f" * 64 and db.get_user_by_api_key_hash("f" * 64) is None
+    assert db.create_audit_logs([
+        {"user_id": "user_1", "action": "login", "resource_type": "user", "details": {"ok": True}},
+        {"user_id": "user_1", "action": "logout", "resource_type": "user"},
+    ]) == 2
+    assert [r["action"] for r in db.list_audit_logs("user_1")] == ["logout", "login"]
+
+    # اللقطات بترتيب الإدراج عند تساوي الوقت
+    for snap_id in ("snap_2", "snap_1"):
+        db.add_workspace_snapshot({
+            "id": snap_id, "task_id": "task_a", "parent_id": None, "root": "/tmp/a", "label": None,
+            "file_count": 1, "total_bytes": 2 ** 40, "new_bytes": 0, "created_at": "2025-12-01T00:00:00Z",
+        })
+    snapshots = db.list_workspace_snapshots("task_a")
+    assert [s["id"] for s in snapshots] == ["snap_1", "snap_2"] and snapshots[0]["total_bytes"] == 2 ** 40
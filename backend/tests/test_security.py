@@ -23,3 +23,396 @@ def test_jwt_token_creation():
     token = create_access_token(data)
     assert isinstance(token, str)
     assert len(token) > 10
+
+def test_key_rotation_reencrypts_in_batches(tmp_path, monkeypatch):
+    from manus_pro_server import db
+    from cryptography.fernet import Fernet
+    from manus_pro_server.key_rotation import reencrypt_all, reencrypt_table, retire_old_keys
+
+    # قاعدة بيانات وملف مفاتيح مستقلان حتى لا يمس التدوير بيانات الاختبارات الأخرى
+    monkeypatch.setattr(crypto, "FERNET_KEY_PATH", tmp_path / "fernet.key")
+    monkeypatch.setattr(db, "DB_PATH", tmp_path / "state.sqlite3")
+    monkeypatch.setattr(db, "settings_cache", db.SettingsCache())
+    crypto.reload_keys()
+    db.init_db()
+    for i in range(5):
+        db.set_setting(f"key_{i}", f"secret-{i}")
+    db.upsert_connector("conn_1", "Drive", "google_drive", {"folder": "x"})
+    db.save_oauth_token("conn_1", "access", "refresh", None)
+    old_value = db.fetch_encrypted_batch("settings", None, 1)[0]["value"]
+
+    assert crypto.rotate_key() == 2
+    monkeypatch.setattr(crypto, "KEY_RECHECK_INTERVAL_SEC", 0)
+    assert not crypto.is_primary(old_value)
+    # القيم القديمة تبقى مقروءة قبل إعادة التشفير
+    assert db.get_setting("key_0") == "secret-0"
+
+    # دفعة واحدة ثم الاستئناف من نقطة التقدم
+    partial = reencrypt_table("settings", batch_size=2, pause=0, max_batches=1)
+    assert partial == {"table": "settings", "scanned": 2, "rotated": 2, "failed": 0, "completed": False}
+    # لا إزالة للمفاتيح قبل اكتمال كل الجداول بالمفتاح الحالي
+    with pytest.raises(RuntimeError, match="settings, oauth_tokens, connectors"):
+        retire_old_keys()
+    result = reencrypt_all(batch_size=2, pause=0)
+    assert result["completed"]
+    assert [r["rotated"] for r in result["tables"]] == [5, 2, 1]
+
+    # عملية أخرى لم تلتقط المفتاح الجديد بعد كتبت بالمفتاح القديم: المسح الأخير يعيد تشفيرها
+    old_key = crypto.load_keys()[1]
+    with db.conn() as c:
+        c.execute("UPDATE settings SET value=? WHERE key=?", (Fernet(old_key).encrypt(b"late").decode(), "key_4"))
+    db.settings_cache.invalidate()
+    with pytest.raises(RuntimeError, match="Primary key changed"):
+        crypto.retire_old_keys(expected_primary_id="0" * 16)
+
+    retired = retire_old_keys(batch_size=2)
+    assert retired["removed"] == 1 and retired["swept"][0] == {"table": "settings", "rotated": 1, "failed": 0}
+    assert db.get_setting("key_4") == "late"
+    assert [db.get_setting(f"key_{i}") for i in range(4)] == [f"secret-{i}" for i in range(4)]
+    assert db.get_oauth_token("conn_1")["refresh_token"] == "refresh"
+    assert db.get_connector_record("conn_1")["config"] == {"folder": "x"}
+    assert crypto.decrypt_str(old_value) == "[DECRYPTION_FAILED]"
+    monkeypatch.undo()
+    crypto.reload_keys()
+
+def test_stream_encryption_roundtrip_and_tamper_detection():
+    import io
+    import os
+    from manus_pro_server import crypto_stream
+
+    for size in (0, 1, 64, 64 * 3, 64 * 3 + 5):
+        data = os.urandom(size)
+        reader = crypto_stream.EncryptingReader(io.BytesIO(data), size, chunk_size=64)
+        # قراءة بأحجام غير متوافقة مع الأجزاء كما تفعل مكتبات الرفع
+        parts = []
+        while True:
+            part = reader.read(50)
+            if not part:
+                break
+            parts.append(part)
+        blob = b"".join(parts)
+        assert len(blob) == reader.size and crypto_stream.is_encrypted(blob)
+        assert crypto_stream.DecryptingReader(io.BytesIO(blob)).read() == data
+
+    blob = b"".join(crypto_stream.encrypt_stream(io.BytesIO(os.urandom(200)), chunk_size=64))
+    tampered = bytearray(blob)
+    tampered[-20] ^= 1
+    # الاقتطاع عند حد جزء كامل، وحذف الجزء الأخير القصير
+    for bad in (bytes(tampered), blob[:-(200 % 64 + 16)], blob[:-(200 % 64 + 16) - 80]):
+        with pytest.raises(crypto_stream.StreamDecryptionError):
+            b"".join(crypto_stream.decrypt_stream(io.BytesIO(bad)))
+
+def test_stream_reencryption_after_key_rotation(isolated_db):
+    import io
+    import os
+    from manus_pro_server import crypto, crypto_stream
+
+    data = os.urandom(64 * 3 + 5)
+    reader = crypto_stream.EncryptingReader(io.BytesIO(data), len(data), chunk_size=64)
+    blob = reader.read()
+    header_size = len(blob) - crypto_stream.ciphertext_size(len(data), 0, 64)
+    assert crypto_stream.plaintext_size(len(blob), header_size, 64) == len(data)
+    # مفتاح البيانات مغلّف بالأساسي الحالي: لا حاجة لإعادة التشفير
+    assert crypto_stream.reencrypting_reader(io.BytesIO(blob), len(blob)) is None
+
+    crypto.rotate_key()
+    rewrapped = crypto_stream.reencrypting_reader(io.BytesIO(blob), len(blob))
+    assert rewrapped is not None
+    fresh = rewrapped.read()
+    assert len(fresh) == rewrapped.size and fresh != blob
+    assert crypto_stream.reencrypting_reader(io.BytesIO(fresh), len(fresh)) is None
+
+    # بعد حذف المفتاح القديم يبقى الكائن المعاد تشفيره مقروءاً
+    crypto.retire_old_keys()
+    assert crypto_stream.DecryptingReader(io.BytesIO(fresh)).read() == data
+    with pytest.raises(crypto_stream.StreamDecryptionError):
+        crypto_stream.DecryptingReader(io.BytesIO(blob)).read()
+
+def test_get_current_user_caches_token_and_user(monkeypatch):
+    import asyncio
+    from fastapi import HTTPException
+    from fastapi.security import HTTPAuthorizationCredentials
+    from manus_pro_server import auth, db
+
+    users = {"user_1": {"id": "user_1", "is_active": True, "role": "user"}}
+    lookups = []
+
+    def get_user_by_id(user_id):
+        lookups.append(user_id)
+        user = users.get(user_id)
+        return dict(user) if user else None
+
+    monkeypatch.setattr(db, "get_user_by_id", get_user_by_id, raising=False)
+    monkeypatch.setattr(auth, "auth_cache", auth.AuthCache(ttl=60))
+    decoded = []
+    real_decode = auth.decode_token
+    monkeypatch.setattr(auth, "decode_token", lambda t: decoded.append(t) or real_decode(t))
+    creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials=create_access_token({"sub": "user_1"}))
+
+    for _ in range(3):
+        user = asyncio.run(auth.get_current_user(creds))
+        user["role"] = "admin"  # تعديل النسخة لا يمس المخزن
+    assert len(decoded) == 1 and lookups == ["user_1"]
+    assert asyncio.run(auth.get_current_user(creds))["role"] == "user"
+
+    # التعطيل مع الإبطال يسري فوراً
+    users["user_1"]["is_active"] = False
+    auth.invalidate_user("user_1")
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(auth.get_current_user(creds))
+    assert exc.value.status_code == 403 and len(lookups) == 2
+
+    # رمز التجديد لا يُقبل ولا يُخزّن
+    from manus_pro_server.auth import create_refresh_token
+    refresh = HTTPAuthorizationCredentials(scheme="Bearer", credentials=create_refresh_token({"sub": "user_1"}))
+    for _ in range(2):
+        with pytest.raises(HTTPException):
+            asyncio.run(auth.get_current_user(refresh))
+    assert len(decoded) == 3
+
+def test_user_update_invalidates_cached_user(isolated_db, monkeypatch):
+    import asyncio
+    from fastapi import HTTPException
+    from fastapi.security import HTTPAuthorizationCredentials
+    from manus_pro_server import auth
+
+    db = isolated_db
+    monkeypatch.setattr(auth, "auth_cache", auth.AuthCache(ttl=60))
+    db.create_user("user_1", "alice", "alice@example.com", "hash", role="viewer")
+    creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials=create_access_token({"sub": "user_1"}))
+    assert asyncio.run(auth.get_current_user(creds))["role"] == "viewer"
+
+    # التعديل عبر طبقة db يبطل السجل المخزن دون استدعاء صريح من المستدعي
+    db.update_user_fields("user_1", role="admin")
+    assert asyncio.run(auth.get_current_user(creds))["role"] == "admin"
+    db.update_user_fields("user_1", is_active=0)
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(auth.get_current_user(creds))
+    assert exc.value.status_code == 403
+
+@pytest.mark.asyncio
+async def test_password_hasher_keeps_event_loop_responsive():
+    import asyncio
+    from fastapi import HTTPException
+    from manus_pro_server.auth import PasswordHasher
+
+    hasher = PasswordHasher(max_workers=2, max_pending=4)
+    hashed = get_password_hash("strong_password")
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    tick_task = asyncio.create_task(ticker())
+    try:
+        results = await asyncio.gather(
+            *(hasher.verify("strong_password" if i % 2 else "wrong", hashed) for i in range(4))
+        )
+    finally:
+        tick_task.cancel()
+    assert results == [False, True, False, True]
+    # الحلقة استمرت في العمل أثناء الحساب (أربع عمليات bcrypt على خيطين)
+    assert ticks >= 5
+    stats = hasher.stats()
+    assert stats["completed"] == 4 and stats["running"] == 0 and stats["queued"] == 0
+
+    # تجاوز حد الطابور يُرفض فوراً بـ 503
+    outcomes = await asyncio.gather(*(hasher.hash("pw") for _ in range(5)), return_exceptions=True)
+    rejected = [o for o in outcomes if isinstance(o, HTTPException)]
+    assert len(rejected) == 1 and rejected[0].status_code == 503
+    assert hasher.stats()["rejected"] == 1
+    hasher.shutdown()
+
+@pytest.mark.asyncio
+async def test_async_password_helpers_and_authenticate_user(isolated_db, monkeypatch):
+    from fastapi import HTTPException
+    from manus_pro_server import auth
+
+    hasher = auth.PasswordHasher(max_workers=1, max_pending=4)
+    monkeypatch.setattr(auth, "password_hasher", hasher)
+    hashed = await auth.get_password_hash_async("strong_password")
+    assert await auth.verify_password_async("strong_password", hashed)
+    isolated_db.create_user("user_1", "alice", "alice@example.com", hashed)
+
+    assert (await auth.authenticate_user("alice@example.com", "strong_password"))["id"] == "user_1"
+    assert await auth.authenticate_user("alice@example.com", "wrong") is None
+    # بريد غير موجود: مقارنة مع البصمة الثابتة ثم None (نفس زمن الاستجابة)
+    assert await auth.authenticate_user("nobody@example.com", "strong_password") is None
+    assert hasher.stats()["completed"] == 5  # تجزئة + 4 مقارنات، كلها في مجمّع الخيوط
+    hasher.shutdown()
+
+    # امتلاء طابور التجزئة يصل إلى مسار الدخول كـ 503 بدلاً من حجز الحلقة
+    monkeypatch.setattr(auth, "password_hasher", auth.PasswordHasher(max_workers=1, max_pending=0))
+    with pytest.raises(HTTPException) as exc:
+        await auth.authenticate_user("alice@example.com", "strong_password")
+    assert exc.value.status_code == 503 and exc.value.headers["Retry-After"] == "1"
+
+def test_rate_limit_keyed_by_verified_user():
+    from fastapi import FastAPI, Request
+    from fastapi.testclient import TestClient
+    from slowapi import Limiter, _rate_limit_exceeded_handler
+    from slowapi.errors import RateLimitExceeded
+    from slowapi.middleware import SlowAPIASGIMiddleware
+    from manus_pro_server.auth import rate_limit_key
+
+    app = FastAPI()
+    app.state.limiter = Limiter(key_func=rate_limit_key, default_limits=["2/minute"],
+                                storage_uri="memory://", strategy="sliding-window-counter")
+    app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+    app.add_middleware(SlowAPIASGIMiddleware)
+
+    @app.get("/ping")
+    async def ping(request: Request):
+        return {"key": rate_limit_key(request)}
+
+    client = TestClient(app)
+    alice = {"Authorization": f"Bearer {create_access_token({'sub': 'alice'})}"}
+    bob = {"Authorization": f"Bearer {create_access_token({'sub': 'bob'})}"}
+    # رمز بتوقيع خاطئ لا يُنسب إلى المستخدم المذكور فيه
+    forged = {"Authorization": "Bearer " + create_access_token({"sub": "bob"})[:-4] + "AAAA"}
+
+    assert client.get("/ping", headers=alice).json() == {"key": "user:alice"}
+    assert client.get("/ping", headers=forged).json()["key"].startswith("ip:")
+    assert client.get("/ping", headers=alice).status_code == 200
+    assert client.get("/ping", headers=alice).status_code == 429
+    # لكل مستخدم حصته المستقلة
+    assert client.get("/ping", headers=bob).status_code == 200
+
+@pytest.mark.asyncio
+async def test_audit_writer_batches_and_spills_to_journal(isolated_db, tmp_path, monkeypatch):
+    import asyncio
+    import uuid
+    from manus_pro_server import db
+    from manus_pro_server.audit import AuditWriter
+
+    user_id = f"user_{uuid.uuid4().hex[:12]}"
+    batches = []
+    real_create = db.create_audit_logs
+    monkeypatch.setattr(db, "create_audit_logs", lambda records: batches.append(len(records)) or real_create(records))
+    writer = AuditWriter(tmp_path / "audit.jsonl", queue_size=5, batch_size=100, flush_interval=0.05)
+
+    # 8 سجلات في طابور سعته 5: الزائد يُلحق بالـ journal ولا يُفقد
+    for i in range(8):
+        writer.submit({"user_id": user_id, "action": "task.create", "resource_type": "task", "resource_id": str(i)})
+    assert writer.stats["queued"] == 5 and writer.stats["spilled"] == 3
+    assert (tmp_path / "audit.jsonl").exists()
+
+    for _ in range(100):
+        await asyncio.sleep(0.02)
+        if writer.stats["written"] == 5 and writer.stats["replayed"] == 3:
+            break
+    await writer.close()
+    assert batches[0] == 5  # دفعة واحدة لكل ما في الطابور
+    assert not (tmp_path / "audit.jsonl").exists()
+    logs = db.list_audit_logs(user_id)
+    assert sorted(int(r["resource_id"]) for r in logs) == list(range(8))
+
+    # فشل قاعدة البيانات: السجلات تذهب إلى الـ journal ثم تُعاد لاحقاً
+    monkeypatch.setattr(db, "create_audit_logs", lambda records: (_ for _ in ()).throw(RuntimeError("db down")))
+    writer.submit({"user_id": user_id, "action": "task.delete", "resource_type": "task", "details": {"n": 1}})
+    await writer.close()
+    assert writer.stats["errors"] == 1 and writer.stats["spilled"] == 4
+    monkeypatch.setattr(db, "create_audit_logs", real_create)
+    assert writer.replay_journal() == 1
+    assert db.list_audit_logs(user_id, limit=1)[0]["details"] == {"n": 1}
+
+def test_audit_journal_replay_resumes_and_is_exclusive(isolated_db, tmp_path, monkeypatch):
+    import uuid
+    from manus_pro_server import db
+    from manus_pro_server.audit import AuditWriter
+
+    user_id = f"user_{uuid.uuid4().hex[:12]}"
+    journal = tmp_path / "audit.jsonl"
+    writer = AuditWriter(journal, batch_size=2)
+    writer._spill([{"user_id": user_id, "action": "a", "resource_type": "task", "resource_id": str(i)} for i in range(5)])
+
+    # عملية أخرى (مثيل آخر على نفس الملف) تعيد الإدخال حالياً: لا إدخال مزدوج
+    other = AuditWriter(journal, batch_size=2)
+    with other._file_lock(other._replay_lock, ".replay.lock", blocking=False) as acquired:
+        assert acquired
+        assert writer.replay_journal() == 0
+
+    # فشل الدفعة الثانية: الأولى لا يُعاد إدخالها عند الاستئناف
+    real_create = db.create_audit_logs
+    calls = []
+    def flaky(records):
+        calls.append(len(records))
+        if len(calls) == 2:
+            raise RuntimeError("db down")
+        return real_create(records)
+    monkeypatch.setattr(db, "create_audit_logs", flaky)
+    with pytest.raises(RuntimeError):
+        writer.replay_journal()
+    monkeypatch.setattr(db, "create_audit_logs", real_create)
+    assert writer.replay_journal() == 3
+    assert sorted(int(r["resource_id"]) for r in db.list_audit_logs(user_id)) == list(range(5))
+    assert not list(tmp_path.glob("audit.jsonl.replaying*"))
+
+def test_api_key_hashed_lookup_and_negative_cache(isolated_db, monkeypatch):
+    import asyncio
+    import uuid
+    from fastapi import HTTPException
+    from fastapi.security import HTTPAuthorizationCredentials
+    from manus_pro_server import auth, db
+
+    monkeypatch.setattr(auth, "auth_cache", auth.AuthCache(ttl=60))
+    user_id = f"user_{uuid.uuid4().hex[:12]}"
+    db.create_user(user_id, user_id, f"{user_id}@example.com", "x")
+    created = auth.create_api_key(user_id, "ci")
+    key = created["api_key"]
+    assert key.startswith(f"mkh_{created['prefix']}_")
+    # المفتاح نفسه لا يُخزّن
+    with db.conn() as c:
+        row = c.execute("SELECT * FROM api_keys WHERE id=?", (created["id"],)).fetchone()
+    assert key not in dict(row).values() and row["key_hash"] == auth.hash_api_key(key)
+
+    lookups = []
+    real_lookup = db.get_user_by_api_key_hash
+    monkeypatch.setattr(db, "get_user_by_api_key_hash", lambda h: lookups.append(h) or real_lookup(h))
+    creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials=key)
+    user = asyncio.run(auth.get_api_key_user(creds))
+    assert user["id"] == user_id and user["api_key_id"] == created["id"]
+    assert asyncio.run(auth.verify_api_key(key)) and len(lookups) == 1
+
+    # التخمين: صيغة خاطئة بلا بحث، والبصمة غير الصالحة تُبحث مرة واحدة فقط
+    guess = "mkh_00000000_" + "A" * 43
+    for _ in range(3):
+        assert not asyncio.run(auth.verify_api_key(guess))
+        assert not asyncio.run(auth.verify_api_key("not-a-key"))
+    assert len(lookups) == 2
+
+    assert auth.revoke_api_key(created["id"])
+    with pytest.raises(HTTPException):
+        asyncio.run(auth.get_api_key_user(creds))
+
+
+def test_compiled_role_permissions():
+    from manus_pro_server import auth
+    from manus_pro_server.auth import Permission, Role
+
+    viewer = {"id": "u1", "role": Role.VIEWER}
+    assert auth.has_permission(viewer, Permission.TASK_READ)
+    assert not auth.has_permission(viewer, Permission.TASK_CREATE)
+    assert not auth.has_permission(viewer, "unknown:perm")
+    assert auth.ROLE_PERMISSION_SETS[Role.VIEWER] == frozenset(auth.ROLE_PERMISSIONS[Role.VIEWER])
+    # الدور admin يُجمّع إلى كل الصلاحيات
+    assert auth.has_permission({"role": Role.ADMIN}, Permission.CONNECTOR_DELETE)
+    assert auth.has_permission({"is_admin": True, "role": Role.VIEWER}, Permission.TASK_DELETE)
+
+    # المنح والمنع لكل مستخدم فوق صلاحيات الدور
+    user = auth.with_permission_mask({
+        "id": "u2", "role": Role.USER,
+        "permission_overrides": {"grant": [Permission.TASK_DELETE], "deny": [Permission.SETTING_WRITE]},
+    })
+    assert auth.has_permission(user, Permission.TASK_DELETE)
+    assert not auth.has_permission(user, Permission.SETTING_WRITE)
+    assert auth.has_permission(user, Permission.TASK_READ)
+
+    # dependency واحدة لكل صلاحية
+    assert auth.require_permission(Permission.TASK_READ) is auth.require_permission(Permission.TASK_READ)
+    with pytest.raises(ValueError):
+        auth.require_permission("unknown:perm")
+
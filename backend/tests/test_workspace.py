@@ -0,0 +1,295 @@
+"""
+اختبارات الـ Workspace: فهرس الشجرة في الذاكرة وعمليات الملفات
+"""
+
+import os
+
+import pytest
+
+from manus_pro_server.workspace_index import WorkspaceIndex
+
+
+def _make_tree(root):
+    (root / "src" / "pkg").mkdir(parents=True)
+    (root / "src" / "pkg" / "mod.py").write_text("x = 1\n")
+    (root / "src" / "B.txt").write_text("b")
+    (root / "src" / "a.txt").write_text("aa")
+    (root / "README.md").write_text("readme")
+
+
+def test_workspace_index_listing_and_pagination(tmp_path):
+    _make_tree(tmp_path)
+    index = WorkspaceIndex(tmp_path)
+    index.build()
+
+    # مجلدات أولاً ثم أبجدياً دون حساسية لحالة الأحرف
+    listing = index.list_dir("src")
+    assert [i["name"] for i in listing["items"]] == ["pkg", "a.txt", "B.txt"]
+    assert listing["items"][1] == {"name": "a.txt", "path": "src/a.txt", "type": "file", "size_bytes": 2,
+                                   "mtime": int((tmp_path / "src" / "a.txt").stat().st_mtime)}
+
+    page = index.list_dir("src", offset=1, limit=1)
+    assert [i["path"] for i in page["items"]] == ["src/a.txt"] and page["total"] == 3
+
+    tree = index.walk(".")
+    assert [(i["path"], i["depth"]) for i in tree["items"]] == [
+        ("src", 1), ("src/pkg", 2), ("src/pkg/mod.py", 3), ("src/a.txt", 2), ("src/B.txt", 2), ("README.md", 1),
+    ]
+    first = index.walk(".", limit=2)
+    rest = index.walk(".", offset=2, limit=10)
+    assert first["has_more"] and not rest["has_more"]
+    assert [i["path"] for i in first["items"] + rest["items"]] == [i["path"] for i in tree["items"]]
+    assert [i["path"] for i in index.walk(".", max_depth=1)["items"]] == ["src", "README.md"]
+
+    with pytest.raises(NotADirectoryError):
+        index.list_dir("README.md")
+    with pytest.raises(FileNotFoundError):
+        index.list_dir("missing")
+
+
+def test_workspace_index_incremental_refresh(tmp_path):
+    _make_tree(tmp_path)
+    index = WorkspaceIndex(tmp_path)
+    index.build()
+    version = index.version
+
+    # مجلد جديد بمحتواه يُفهرس من حدث واحد على أحد أبنائه
+    (tmp_path / "new" / "deep").mkdir(parents=True)
+    (tmp_path / "new" / "deep" / "f.txt").write_text("hello")
+    assert index.refresh_abs(str(tmp_path / "new" / "deep" / "f.txt"))
+    assert [i["path"] for i in index.walk("new")["items"]] == ["new/deep", "new/deep/f.txt"]
+    assert index.version > version
+
+    # إعادة قراءة ملف لم يتغير لا تزيد الإصدار
+    version = index.version
+    assert not index.refresh("README.md") and index.version == version
+
+    (tmp_path / "src" / "a.txt").write_text("changed content")
+    assert index.refresh("src/a.txt")
+    assert index.list_dir("src")["items"][1]["size_bytes"] == len("changed content")
+
+    # حذف مجلد يزيل كل ما تحته
+    os.remove(tmp_path / "src" / "pkg" / "mod.py")
+    os.rmdir(tmp_path / "src" / "pkg")
+    assert index.refresh("src/pkg")
+    assert [i["name"] for i in index.list_dir("src")["items"]] == ["a.txt", "B.txt"]
+    assert "src/pkg/mod.py" not in [i["path"] for i in index.walk(".")["items"]]
+
+    # إعادة البناء الكامل تطابق الحالة المحدّثة تدريجياً دون تغيير الإصدار
+    index.refresh("src")  # حدث تعديل المجلد الأب كما يرسله المراقب
+    version = index.version
+    index.build()
+    assert index.version == version
+
+
+def test_read_file_ranges_and_tail(tmp_path, monkeypatch):
+    from manus_pro_server import workspace_fs
+
+    monkeypatch.setattr(workspace_fs, "WORKSPACE_ROOT", tmp_path)
+    log = tmp_path / "app.log"
+    log.write_bytes(b"".join(f"line {i:04d}\n".encode() for i in range(1000)))
+    size = log.stat().st_size
+
+    # الحد يُفحص من الحجم دون قراءة الملف
+    with pytest.raises(ValueError):
+        workspace_fs.read_file("app.log", max_bytes=100)
+
+    page = workspace_fs.read_file("app.log", max_bytes=100, offset=20, length=20)
+    assert page["content"] == "line 0002\nline 0003\n" and page["size_bytes"] == size and not page["eof"]
+    assert workspace_fs.read_file("app.log", max_bytes=100, offset=0, length=10_000)["length"] == 100
+
+    tail = workspace_fs.read_file("app.log", length=25, tail=True)
+    assert tail["content"] == "line 0998\nline 0999\n" and tail["eof"]
+    assert tail["offset"] == size - 20
+
+    assert workspace_fs.read_file("app.log", offset=size + 5, length=10)["content"] == ""
+
+
+def test_range_header_and_streaming(tmp_path, monkeypatch):
+    from manus_pro_server import workspace_fs
+
+    monkeypatch.setattr(workspace_fs, "WORKSPACE_ROOT", tmp_path)
+    (tmp_path / "blob.bin").write_bytes(bytes(range(256)) * 4)
+
+    assert workspace_fs.parse_range_header(None, 1024) is None
+    assert workspace_fs.parse_range_header("bytes=10-19", 1024) == (10, 19)
+    assert workspace_fs.parse_range_header("bytes=1000-", 1024) == (1000, 1023)
+    assert workspace_fs.parse_range_header("bytes=-24", 1024) == (1000, 1023)
+    assert workspace_fs.parse_range_header("bytes=0-99999", 1024) == (0, 1023)
+    for bad in ("bytes=2000-", "items=0-1", "bytes=5-1", "bytes=0-1,4-5"):
+        with pytest.raises(ValueError):
+            workspace_fs.parse_range_header(bad, 1024)
+
+    chunks = list(workspace_fs.iter_file_range("blob.bin", 250, 261, chunk_size=5))
+    assert [len(c) for c in chunks] == [5, 5, 2]
+    assert b"".join(chunks) == bytes(range(250, 256)) + bytes(range(6))
+
+
+async def _chunks(*parts):
+    for part in parts:
+        yield part
+
+
+@pytest.mark.asyncio
+async def test_stream_upload_hashes_limits_and_dedupes(isolated_db, tmp_path, monkeypatch):
+    import hashlib
+    from manus_pro_server import workspace_fs
+
+    monkeypatch.setattr(workspace_fs, "WORKSPACE_ROOT", tmp_path)
+    content = os.urandom(3000)
+    parts = (content[:1000], content[1000:2500], content[2500:])
+
+    first = await workspace_fs.stream_upload(_chunks(*parts), "../../evil/data.bin")
+    assert first["path"] == "uploads/data.bin" and not first["deduplicated"]
+    assert first["sha256"] == hashlib.sha256(content).hexdigest()
+    assert (tmp_path / "uploads" / "data.bin").read_bytes() == content
+
+    # نفس المحتوى باسم آخر: الملف المطلوب يُنشأ ويُشار إلى النسخة الموجودة؛
+    # deduplicated فقط عند نجاح reflink من الأصل (المحاكاة هنا بنسخ عادي)
+    reflinks = []
+    def fake_reflink(src, dst):
+        reflinks.append(src.name)
+        dst.write_bytes(src.read_bytes())
+        return True
+    monkeypatch.setattr(workspace_fs, "reflink_file", fake_reflink)
+    second = await workspace_fs.stream_upload(_chunks(*parts), "copy.bin")
+    assert second["deduplicated"] and second["path"] == "uploads/copy.bin" and reflinks == ["data.bin"]
+    assert second["duplicate_of"] == "uploads/data.bin"
+    assert (tmp_path / "uploads" / "copy.bin").read_bytes() == content
+    (tmp_path / "uploads" / "copy.bin").unlink()
+
+    # بدون دعم reflink تبقى النسخة المكتوبة ولا يُدّعى توفير المساحة
+    monkeypatch.setattr(workspace_fs, "reflink_file", lambda src, dst: False)
+    copied = await workspace_fs.stream_upload(_chunks(*parts), "copy.bin")
+    assert not copied["deduplicated"] and copied["duplicate_of"] == "uploads/data.bin"
+    assert (tmp_path / "uploads" / "copy.bin").read_bytes() == content
+    assert sorted(p.name for p in (tmp_path / "uploads").iterdir()) == ["copy.bin", "data.bin"]
+    (tmp_path / "uploads" / "copy.bin").unlink()
+
+    # إعادة رفع نفس الملف بنفس الاسم تحدّث السجل ولا تشير إلى نفسها
+    again = await workspace_fs.stream_upload(_chunks(*parts), "data.bin")
+    assert not again["deduplicated"] and "duplicate_of" not in again
+    assert (await workspace_fs.stream_upload(_chunks(*parts), "copy.bin"))["duplicate_of"] == "uploads/data.bin"
+    (tmp_path / "uploads" / "copy.bin").unlink()
+
+    # تجاوز الحد يُرفض أثناء التدفق ولا يترك ملفات مؤقتة
+    with pytest.raises(workspace_fs.UploadTooLarge):
+        await workspace_fs.stream_upload(_chunks(*parts), "big.bin", max_bytes=2000)
+    assert sorted(p.name for p in (tmp_path / "uploads").iterdir()) == ["data.bin"]
+
+    # بعد تعديل الملف الأصلي لا تُستخدم البصمة القديمة
+    (tmp_path / "uploads" / "data.bin").write_bytes(b"changed")
+    third = await workspace_fs.stream_upload(_chunks(*parts), "copy.bin")
+    assert not third["deduplicated"] and (tmp_path / "uploads" / "copy.bin").read_bytes() == content
+
+
+def test_workspace_search_incremental(tmp_path):
+    from manus_pro_server.workspace_search import WorkspaceSearchIndex
+
+    root = tmp_path / "ws"
+    (root / "docs").mkdir(parents=True)
+    (root / "node_modules").mkdir()
+    (root / "docs" / "guide.md").write_text("Deploy the worker with celery and redis.\n" * 3)
+    (root / "notes.txt").write_text("مرحبا بالعالم — redis cache notes")
+    (root / "image.bin").write_bytes(b"\x00\x01redis\x00")
+    (root / "node_modules" / "dep.js").write_text("redis")
+    index = WorkspaceSearchIndex(tmp_path / "fts.sqlite3", root)
+
+    assert index.sync() == {"scanned": 3, "updated": 3, "removed": 0}
+    result = index.search("redis")
+    assert sorted(r["path"] for r in result["results"]) == ["docs/guide.md", "notes.txt"]
+    assert "[redis]" in result["results"][0]["snippet"]
+    assert [r["path"] for r in index.search("مرحبا")["results"]] == ["notes.txt"]
+    assert [r["path"] for r in index.search("cel*")["results"]] == ["docs/guide.md"]
+    assert [r["path"] for r in index.search("redis", path_prefix="docs")["results"]] == ["docs/guide.md"]
+    # علامات الاقتباس في نص المستخدم لا تكسر الاستعلام
+    assert index.search('"redis')["results"]
+
+    # لا شيء تغيّر: لا إعادة فهرسة
+    assert index.sync()["updated"] == 0
+
+    (root / "notes.txt").write_text("nothing here")
+    os.remove(root / "docs" / "guide.md")
+    assert index.sync("notes.txt")["updated"] == 1
+    assert index.sync("docs")["removed"] == 1
+    assert index.search("redis")["results"] == []
+
+    # روابط رمزية تشير خارج الـ Workspace لا تُفهرس ولا يظهر محتواها في المقتطفات
+    outside = tmp_path / "secrets"
+    outside.mkdir()
+    (outside / "fernet.key").write_text("topsecretkey")
+    os.symlink(outside / "fernet.key", root / "key.txt")
+    os.symlink(outside, root / "linked")
+    index.sync()
+    for rel in ("key.txt", "linked", "linked/fernet.key"):
+        index.sync(rel)
+    assert index.search("topsecretkey")["results"] == []
+
+
+def test_workspace_snapshots_restore_and_diff(isolated_db, tmp_path):
+    import uuid
+    from manus_pro_server import db
+    from manus_pro_server.workspace_snapshots import SnapshotStore
+
+    root = tmp_path / "ws"
+    (root / "src").mkdir(parents=True)
+    (root / "src" / "main.py").write_text("print('v1')\n")
+    (root / "data.bin").write_bytes(os.urandom(4096))
+    store = SnapshotStore(tmp_path / "snapshots")
+    task_id = f"task_{uuid.uuid4().hex[:12]}"
+
+    first = store.create(str(root), task_id, "baseline")
+    assert first["file_count"] == 2 and first["new_bytes"] == first["total_bytes"]
+
+    # الملفات غير المتغيرة لا تُنسخ مرة أخرى
+    (root / "src" / "main.py").write_text("print('v2 broken')\n")
+    (root / "tmp").mkdir()
+    (root / "tmp" / "scratch.txt").write_text("junk")
+    second = store.create(str(root), task_id, "checkpoint 1")
+    assert second["parent_id"] == first["id"]
+    assert second["new_bytes"] == len("print('v2 broken')\n") + len("junk")
+
+    assert store.diff(first["id"], second["id"]) == {
+        "from": first["id"], "to": second["id"],
+        "added": ["tmp/scratch.txt"], "removed": [], "modified": ["src/main.py"],
+    }
+    os.remove(root / "data.bin")
+    assert store.diff(second["id"])["removed"] == ["data.bin"]
+
+    result = store.restore(first["id"])
+    assert result["written"] == 2 and result["deleted"] == 1
+    assert (root / "src" / "main.py").read_text() == "print('v1')\n"
+    assert not (root / "tmp").exists() and (root / "data.bin").stat().st_size == 4096
+    assert store.diff(first["id"]) == {"from": first["id"], "to": "current", "added": [], "removed": [], "modified": []}
+    assert [s["id"] for s in db.list_workspace_snapshots(task_id)] == [second["id"], first["id"]]
+
+
+def test_workspace_snapshot_delete_and_blob_gc(isolated_db, tmp_path):
+    import uuid
+    from manus_pro_server import db
+    from manus_pro_server.workspace_snapshots import SnapshotStore
+
+    root = tmp_path / "ws"
+    root.mkdir()
+    (root / "keep.txt").write_text("shared")
+    (root / "old.txt").write_text("only in first")
+    store = SnapshotStore(tmp_path / "snapshots")
+    task_id = f"task_{uuid.uuid4().hex[:12]}"
+    first = store.create(str(root), task_id)
+    os.remove(root / "old.txt")
+    second = store.create(str(root), task_id)
+
+    # الكتل الحديثة محمية بمهلة السماح (لقطة قيد الإنشاء)
+    assert store.delete(first["id"]) and db.get_workspace_snapshot(first["id"]) is None
+    assert store.gc()["deleted"] == 0
+    assert store.gc(grace_sec=-1) == {"deleted": 1, "freed_bytes": len("only in first")}
+    assert store.diff(second["id"])["modified"] == []
+    assert len(list(store.blob_dir.glob("*/*"))) == 1
+
+    # كتلة أزالها gc تُخزّن من جديد بدلاً من الإشارة إليها من اللقطة السابقة
+    store.delete(second["id"])
+    store.gc(grace_sec=-1)
+    third = store.create(str(root), task_id, parent_id=second["id"])
+    assert third["new_bytes"] == len("shared")
+    (root / "keep.txt").write_text("changed")
+    assert store.restore(third["id"])["written"] == 1 and (root / "keep.txt").read_text() == "shared"